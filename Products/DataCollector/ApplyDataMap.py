@@ -26,6 +26,7 @@ from Products.ZenUtils.events import pausedAndOptimizedIndexing
 from Products.DataCollector.Exceptions import ObjectCreationError
 from Products.ZenEvents.ZenEventClasses import Change_Add,Change_Remove,Change_Set,Change_Add_Blocked,Change_Remove_Blocked,Change_Set_Blocked
 from Products.ZenModel.Lockable import Lockable
+from Products.DataCollector.plugins.DataMaps import MultiArgs
 from Products.ZenEvents import Event
 from Products.ZenRelations.ToManyContRelationship import ToManyContRelationship
 from zExceptions import NotFound
@@ -44,6 +45,9 @@ def isSameData(x, y):
     dictionaries.
     """
     if isinstance(x, (tuple, list)) and isinstance(y, (tuple, list)):
+        # remodeled data usually comes back in the same order
+        if x == y:
+            return True
         if x and y and isinstance(x[0], dict) and isinstance(y[0], dict):
             x = set(tuple(sorted(d.items())) for d in x)
             y = set(tuple(sorted(d.items())) for d in y)
@@ -189,6 +193,7 @@ class ApplyDataMap(object):
     def _updateRelationship(self, device, relmap):
         """Add/Update/Remote objects to the target relationship.
         """
+        from Products.ZenModel.ZenModelRM import ZenModelRM
         changed = False
         rname = relmap.relname
         rel = getattr(device, rname, None)
@@ -196,32 +201,24 @@ class ApplyDataMap(object):
             log.warn("no relationship:%s found on:%s (%s %s)",
                           relmap.relname, device.id, device.__class__, device.zPythonClass)
             return changed
-        relids = set(rel.objectIdsAll())
+        # The existing objects are read once; their classes are known
+        # without loading them, ToManyRelationship._getOb scans the whole
+        # relationship for every id.
+        existing = dict(rel.objectItemsAll())
+        relids = set(existing)
         seenids = defaultdict(int)
         for objmap in relmap:
-            from Products.ZenModel.ZenModelRM import ZenModelRM
             if hasattr(objmap, 'modname') and hasattr(objmap, 'id'):
                 objmap_id = objmap.id
                 seenids[objmap_id] += 1
                 if seenids[objmap_id] > 1:
                     objmap_id = objmap.id = "%s_%s" % (objmap_id, seenids[objmap_id])
                 if objmap_id in relids:
-                    obj = rel._getOb(objmap_id)
+                    obj = existing[objmap_id]
 
                     # Handle the possibility of objects changing class by
                     # recreating them. Ticket #5598.
-                    existing_modname = ''
-                    existing_classname = ''
-                    try:
-                        import inspect
-                        existing_modname = inspect.getmodule(obj).__name__
-                        existing_classname = obj.__class__.__name__
-                    except Exception:
-                        pass
-
-                    if objmap.modname == existing_modname and \
-                        objmap.classname in ('', existing_classname):
-
+                    if self._sameClass(obj, objmap):
                         changed |= self._updateObject(obj, objmap)
                     else:
                         rel._delObject(objmap_id)
@@ -249,7 +246,7 @@ class ApplyDataMap(object):
                     relids.discard(obj.id)
 
         for id in relids:
-            obj = rel._getOb(id)
+            obj = existing[id]
             if isinstance(obj, Lockable) and obj.isLockedFromDeletion():
                 objname = obj.id
                 try: objname = obj.name()
@@ -270,6 +267,15 @@ class ApplyDataMap(object):
         return changed
 
 
+    def _sameClass(self, obj, objmap):
+        """Is obj of the class objmap creates?
+        """
+        # the class of a ghost is known without loading it
+        klass = aq_base(obj).__class__
+        return objmap.modname == getattr(klass, '__module__', '') and \
+            objmap.classname in ('', klass.__name__)
+
+
     def _updateObject(self, obj, objmap):
         """Update an object using a objmap.
         """
@@ -289,6 +295,8 @@ class ApplyDataMap(object):
             if obj.sendEventWhenBlocked():
                 self.logEvent(device, obj,Change_Set_Blocked,msg,Event.Warning)
             return changed
+        # looked up on the first string attribute, see below
+        codec = None
         for attname, value in objmap.items():
             if attname.startswith('_'):
                 continue
@@ -305,7 +313,8 @@ class ApplyDataMap(object):
                     #   that UnicodeString back into a regular string of bytes,
                     #   and for that we use the system default encoding, which
                     #   is now utf-8.
-                    codec = obj.zCollectorDecoding or sys.getdefaultencoding()
+                    if codec is None:
+                        codec = obj.zCollectorDecoding or sys.getdefaultencoding()
                     value = value.decode(codec)
                     value = value.encode(sys.getdefaultencoding())
                 except UnicodeDecodeError:
@@ -325,7 +334,6 @@ class ApplyDataMap(object):
                     log.warn("getter for '%s' not found on obj '%s', skipping",
                              attname, obj.id)
                     continue
-                from Products.DataCollector.plugins.DataMaps import MultiArgs
                 if isinstance(value, MultiArgs):
                     args = value.args
                     value_to_test = value.args
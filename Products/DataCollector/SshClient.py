@@ -587,6 +587,8 @@ class CommandChannel(channel.SSHChannel):
         self.command = command
         self.exitCode = None
         self.env = env if env is not None else CommandChannel.DEFAULT_ENV
+        self.data = ''
+        self._output = []
 
     @property
     def targetIp(self):
@@ -639,7 +641,7 @@ class CommandChannel(channel.SSHChannel):
 
         log.debug('%s channel %s Opening command channel for %s',
                   self.targetIp, self.conn.localChannelID, self.command)
-        self.data = ''
+        self._output = []
         self.stderr = ''
 
         # Send environment variables
@@ -682,16 +684,20 @@ class CommandChannel(channel.SSHChannel):
         @param data: returned value from device
         @type data: string
         """
-        self.data += data
+        # joined once the channel closes; appending to a string would copy
+        # the output received so far for every packet
+        self._output.append(data)
 
 
     def closed(self):
         """
         Cleanup for the channel, as both ends have closed the channel.
         """
-        log.debug('%s channel %s CommandChannel closing command channel for command %s with data: %s',
+        self.data = ''.join(self._output)
+        self._output = []
+        log.debug('%s channel %s CommandChannel closing command channel for command %s with data: %r',
                   self.targetIp, getattr(self.conn, 'localChannelID', None),
-                  self.command, repr(self.data))
+                  self.command, self.data)
         self.conn.factory.addResult(self.command, self.data, self.exitCode, self.stderr)
         self.loseConnection()
 
@@ -11,10 +11,14 @@
 
 import Globals
 
-from Products.DataCollector.ApplyDataMap import ApplyDataMap
-from Products.DataCollector.plugins.DataMaps import RelationshipMap
+from Products.DataCollector.ApplyDataMap import ApplyDataMap, isSameData
+from Products.DataCollector.plugins.DataMaps import ObjectMap, RelationshipMap
+from Products.ZenModel.IpInterface import IpInterface
 from Products.ZenTestCase.BaseTestCase import BaseTestCase
 
+class TestInterface(IpInterface):
+    pass
+
 class _dev(object):
     id = 'mydevid'
     def device(self): return self
@@ -145,6 +149,65 @@ class ApplyDataMapTest(BaseTestCase):
 
         self.assertEquals(1, len(device.os.interfaces))
 
+    def testRelationshipMapUsesComponentDecoding(self):
+        device = self.dmd.Devices.createInstance('testDevice')
+        device.setZenProperty('zCollectorDecoding', 'utf-8')
+        device.os.addIpInterface('eth0', False)
+        iface = device.os.interfaces._getOb('eth0')
+        iface.zCollectorDecoding = 'latin-1'
+
+        relmap = RelationshipMap(relname="interfaces", compname="os",
+                                 modname="Products.ZenModel.IpInterface",
+                                 objmaps=[{'id': 'eth0',
+                                           'description': u'\xe0'.encode('latin-1')}])
+        self.assertTrue(self.adm._applyDataMap(device, relmap))
+        self.assertEquals(u'\xe0'.encode('utf-8'),
+                          device.os.interfaces._getOb('eth0').description)
+
+    def testIsSameData(self):
+        self.assertTrue(isSameData([1, 2, 3], [1, 2, 3]))
+        self.assertTrue(isSameData([3, 1, 2], (1, 2, 3)))
+        self.assertFalse(isSameData([1, 2], [1, 2, 3]))
+        self.assertTrue(isSameData([{'a': 1, 'b': 2}, {'a': 3}],
+                                   [{'a': 3}, {'b': 2, 'a': 1}]))
+        self.assertFalse(isSameData([{'a': 1}], [{'a': 2}]))
+        self.assertTrue(isSameData('abc', 'abc'))
+
+    def testSameClass(self):
+        device = self.dmd.Devices.createInstance('testDevice')
+        device.os.addIpInterface('eth0', False)
+        iface = device.os.interfaces._getOb('eth0')
+        def objmap(modname, classname=''):
+            return ObjectMap({'id': 'eth0'}, modname=modname,
+                             classname=classname)
+        self.assertTrue(self.adm._sameClass(
+            iface, objmap('Products.ZenModel.IpInterface')))
+        self.assertTrue(self.adm._sameClass(
+            iface, objmap('Products.ZenModel.IpInterface', 'IpInterface')))
+        self.assertFalse(self.adm._sameClass(
+            iface, objmap('Products.ZenModel.IpInterface', 'TestInterface')))
+        self.assertFalse(self.adm._sameClass(
+            iface, objmap(__name__, 'TestInterface')))
+
+    def testRelationshipMapClassChange(self):
+        device = self.dmd.Devices.createInstance('testDevice')
+        device.os.addIpInterface('eth0', False)
+        device.os.addIpInterface('eth1', False)
+
+        relmap = RelationshipMap(relname="interfaces", compname="os",
+                                 modname=__name__,
+                                 objmaps=[{'id': 'eth0', 'mtu': 9000}])
+        for objmap in relmap:
+            objmap.classname = 'TestInterface'
+        self.assertTrue(self.adm._applyDataMap(device, relmap))
+        self.assertEquals(['eth0'], device.os.interfaces.objectIds())
+        iface = device.os.interfaces._getOb('eth0')
+        self.assertTrue(isinstance(iface, TestInterface))
+        self.assertEquals(9000, iface.mtu)
+
+        # applying the same map again changes nothing
+        self.assertFalse(self.adm._applyDataMap(device, relmap))
+
 def test_suite():
     from unittest import TestSuite, makeSuite
     suite = TestSuite()
@@ -59,7 +59,7 @@ import os
 import sys
 import traceback
 from random import randint
-from itertools import chain
+from itertools import chain, islice
 
 defaultPortScanTimeout = 5
 defaultParallel = 1
@@ -107,6 +107,8 @@ class ZenModeler(PBDaemon):
         self.modelerCycleInterval = self.options.cycletime
         self.collage = float( self.options.collage ) / 1440.0
         self.pendingNewClients = False
+        # configurations fetched ahead of free collection slots
+        self.readyDevices = collections.deque()
         self.clients = []
         self.finished = []
         self.devicegen = None
@@ -824,7 +826,7 @@ class ZenModeler(PBDaemon):
         @param unused: unused (unused)
         @type unused: string
         """
-        if self.pendingNewClients or self.clients: return
+        if self.pendingNewClients or self.clients or self.readyDevices: return
         if self._devicegen_has_items: return
 
         if self.start:
@@ -842,34 +844,30 @@ class ZenModeler(PBDaemon):
 
     def fillCollectionSlots(self, driver):
         """
-        An iterator which either returns a device to collect or
-        calls checkStop()
+        An iterator which starts collecting from the devices whose
+        configuration is ready while there are free collection slots,
+        and fetches the configuration of the next devices, several
+        devices per call, to keep up to options.parallel of them ready.
+        Then calls checkStop().
+
         @param driver: driver object
         @type driver: driver object
         """
         count = len(self.clients)
-        while count < self.options.parallel and self._devicegen_has_items \
-            and not self.pendingNewClients:
+        while True:
+            self._startReadyDevices()
+            wanted = self.options.parallel - len(self.readyDevices)
+            if wanted <= 0 or self.pendingNewClients \
+                or not self._devicegen_has_items:
+                break
             self.pendingNewClients = True
             try:
-                device = self.devicegen.next()
-                yield self.config().callRemote('getDeviceConfig', [device],
+                names = list(islice(self.devicegen, wanted))
+                yield self.config().callRemote('getDeviceConfig', names,
                                             self.options.checkStatus)
-                # just collect one device, and let the timer add more
-                devices = driver.next()
-                if devices:
-                    d = devices[0]
-                    if d.skipModelMsg:
-                        self.log.info(d.skipModelMsg)
-                    else:
-                        self.collectDevice(d)
-                else:
-                    self.log.info("Device %s not returned is it down?", device)
-            except StopIteration:
-                self.devicegen = None
+                self._queueDevices(names, driver.next())
             finally:
                 self.pendingNewClients = False
-            break
         update = len(self.clients)
         if update != count and update != 1:
             self.log.info('Running %d clients', update)
@@ -877,6 +875,33 @@ class ZenModeler(PBDaemon):
             self.log.debug('Running %d clients', update)
         self.checkStop()
 
+    def _queueDevices(self, names, devices):
+        """
+        Add the device configurations returned by zenhub to the ready queue
+
+        @param names: the device names asked for
+        @type names: list of strings
+        @param devices: the configurations returned
+        @type devices: list of DeviceProxy
+        """
+        for device in devices:
+            if device.skipModelMsg:
+                self.log.info(device.skipModelMsg)
+            else:
+                self.readyDevices.append(device)
+        if len(devices) < len(names):
+            returned = set(device.id for device in devices)
+            for name in names:
+                if name not in returned:
+                    self.log.info("Device %s not returned is it down?", name)
+
+    def _startReadyDevices(self):
+        """
+        Start collecting from ready devices while there are free slots
+        """
+        while self.readyDevices and len(self.clients) < self.options.parallel:
+            self.collectDevice(self.readyDevices.popleft())
+
     def timeMatches(self):
         """
         Check whether the current time matches a cron-like
@@ -1097,7 +1122,7 @@ class ZenModeler(PBDaemon):
         if self.options.cycle:
             driveLater(self.cycleTime(), self.mainLoop)
 
-        if self.clients:
+        if self.clients or self.readyDevices:
             self.log.error("Modeling cycle taking too long")
             return
 
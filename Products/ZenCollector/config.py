@@ -92,6 +92,17 @@ class ConfigurationProxy(object):
         d = serviceProxy.callRemote('getDeviceConfigs', ids)
         return d
 
+    def getConfigProxyChanges(self, prefs, versions):
+        if not ICollectorPreferences.providedBy(prefs):
+            raise TypeError("config must provide ICollectorPreferences")
+
+        self._collector = zope.component.queryUtility(ICollector)
+        serviceProxy = self._collector.getRemoteConfigServiceProxy()
+
+        log.debug("Fetching changed configurations")
+        d = serviceProxy.callRemote('getDeviceConfigChanges', versions)
+        return d
+
     def deleteConfigProxy(self, prefs, id):
         if not ICollectorPreferences.providedBy(prefs):
             raise TypeError("config must provide ICollectorPreferences")
@@ -197,10 +208,17 @@ class ConfigurationLoaderTask(ObservableMixin):
 
     def _deviceConfigs(self, d, devices):
         """
-        Load the device configuration
+        Load the device configuration. When loading all devices only the
+        configurations that changed since the last load are fetched, if the
+        configuration proxy supports it.
         """
-        d.addCallback(self._fetchConfig, devices)
-        d.addCallback(self._processConfig)
+        if (not devices and hasattr(self._configProxy, 'getConfigProxyChanges')
+                and hasattr(self._daemon, 'getDeviceConfigVersions')):
+            d.addCallback(self._fetchConfigChanges)
+            d.addCallback(self._processConfigChanges)
+        else:
+            d.addCallback(self._fetchConfig, devices)
+            d.addCallback(self._processConfig)
 
     def _notifyConfigLoaded(self, result):
         self._daemon.runPostConfigTasks()
@@ -245,6 +263,43 @@ class ConfigurationLoaderTask(ObservableMixin):
         return defer.maybeDeferred(self._configProxy.getConfigProxies,
                                    self._prefs, devices)
 
+    def _fetchConfigChanges(self, result):
+        self.state = self.STATE_FETCH_DEVICE_CONFIG
+        d = defer.maybeDeferred(self._configProxy.getConfigProxyChanges,
+                                self._prefs,
+                                self._daemon.getDeviceConfigVersions())
+
+        def fetchAll(failure):
+            if failure.check(HubDown):
+                return failure
+            log.debug("Unable to fetch configuration changes (%s), "
+                      "fetching all configurations", failure.getErrorMessage())
+            d = self._fetchConfig(result, [])
+            d.addCallback(lambda configs: (configs, None))
+            return d
+
+        d.addErrback(fetchAll)
+        return d
+
+    @defer.inlineCallbacks
+    def _processConfigChanges(self, changes):
+        """
+        Apply changed configurations and deletions. A deleted list of None
+        means the configurations are the complete set.
+        """
+        configs, deleted = changes
+        if deleted is None or not self._daemon.getDeviceConfigVersions():
+            result = yield self._processConfig(configs)
+            defer.returnValue(result)
+
+        log.debug("Received %d changed configurations, %d deleted",
+                  len(configs), len(deleted))
+        self.state = self.STATE_PROCESS_DEVICE_CONFIG
+        yield self._daemon._updateDeviceConfigs(configs, False)
+        for configId in deleted:
+            self._daemon._deleteDevice(configId)
+        defer.returnValue(configs)
+
     @defer.inlineCallbacks
     def _processConfig(self, configs, purgeOmitted=True):
         if self.options.device:
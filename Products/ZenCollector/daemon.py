@@ -212,6 +212,7 @@ class CollectorDaemon(RRDDaemon):
 
         self._deviceGuids = {}
         self._devices = set()
+        self._deviceConfigVersions = {}
         self._unresponsiveDevices = set()
         self._rrd = None
         self._metric_writer = None
@@ -346,6 +347,14 @@ class CollectorDaemon(RRDDaemon):
                 eventCopy['device_guid'] = guid
         return eventCopy
 
+    def metricWriter(self):
+        if not self._metric_writer:
+            writer = super(CollectorDaemon, self).metricWriter()
+            # stop collecting while the metric publisher is backed up
+            if hasattr(self._scheduler, 'pauseProducing'):
+                writer.registerProducer(self._scheduler)
+        return self._metric_writer
+
     def writeMetric(self, contextUUID, metric, value, metricType, contextId,
                     timestamp='N', min='U', max='U',
                     threshEventData={}, deviceuuid=None):
@@ -383,13 +392,77 @@ class CollectorDaemon(RRDDaemon):
         # compute (and cache) a rate for COUNTER/DERIVE
         if metricType in {'COUNTER', 'DERIVE'}:
             value = self._derivative_tracker.derivative(
-                contextUUID, (int(value), timestamp), min, max)
+                '%s/%s' % (contextUUID, metric), (int(value), timestamp),
+                min, max)
 
         # check for threshold breaches and send events when needed
         if value is not None:
             self._threshold_notifier.notify(contextUUID, contextId, metric, timestamp,
                                             value, threshEventData)
 
+    def writeMetrics(self, batch):
+        """
+        Writes a batch of metrics to the metric publisher.  This is equivalent
+        to calling writeMetric for each datapoint in the batch, but the
+        metric names are parsed once per distinct name, the publisher is
+        called once, and derivatives and threshold checks run as a single
+        pass over the batch.
+        @param batch: the datapoints to write
+        @type batch: Products.ZenUtils.metricwriter.MetricBatch
+        """
+        if not batch:
+            return
+        now = int(time.time())
+        timestamps = [now if ts == 'N' else ts for ts in batch.timestamps]
+
+        contextUUIDs = batch.contextUUIDs
+        metrics = batch.metrics
+        values = list(batch.values)
+        names = {}
+        published = []
+        written = []
+        for i, deviceuuid in enumerate(batch.deviceUUIDs):
+            metric = metrics[i]
+            name = names.get(metric)
+            if name is None:
+                name = names[metric] = metric.split("_")
+            if len(name) != 2:
+                self.log.error("Invalid metric name %s for %s",
+                               metric, contextUUIDs[i])
+                continue
+            tags = {
+                'datasource': name[0],
+                'uuid': contextUUIDs[i]
+            }
+            if deviceuuid:
+                tags['device'] = deviceuuid
+            published.append((name[1], values[i], timestamps[i], tags))
+            written.append(i)
+
+        # write the raw metrics to Redis
+        self._metric_writer.write_metrics(published)
+
+        # compute (and cache) rates for COUNTER/DERIVE
+        metricTypes = batch.metricTypes
+        derivative = self._derivative_tracker.derivative
+        for i in written:
+            if metricTypes[i] in {'COUNTER', 'DERIVE'}:
+                try:
+                    values[i] = derivative('%s/%s' % (contextUUIDs[i], metrics[i]),
+                                           (int(values[i]), timestamps[i]),
+                                           batch.mins[i], batch.maxes[i])
+                except Exception:
+                    self.log.exception("Unable to compute rate for %s %s",
+                                       contextUUIDs[i], metrics[i])
+                    values[i] = None
+
+        # check for threshold breaches and send events when needed
+        contextIds = batch.contextIds
+        threshEventData = batch.threshEventData
+        self._threshold_notifier.notify_many(
+            (contextUUIDs[i], contextIds[i], metrics[i], timestamps[i],
+             values[i], threshEventData[i]) for i in written)
+
     @deprecated
     def writeRRD(self, path, value, rrdType, rrdCommand=None, cycleTime=None,
                  min='U', max='U', threshEventData={}, timestamp='N', allowStaleDatapoint=True):
@@ -466,7 +539,9 @@ class CollectorDaemon(RRDDaemon):
             
     def remote_notifyConfigChanged(self):
         """
-        Called from zenhub to notify that the entire config should be updated  
+        Called from zenhub to notify that the entire config should be updated.
+        Only the device configurations that changed since they were loaded
+        are fetched again, see _rebuildConfig.
         """
         if self.reconfigureTimeout and self.reconfigureTimeout.active():
             # We will run along with the already scheduled task
@@ -478,7 +553,11 @@ class CollectorDaemon(RRDDaemon):
 
     def _rebuildConfig(self):
         """
-        Delete and re-add the configuration tasks to completely re-build the configuration.
+        Delete and re-add the configuration loader task to reload the
+        configuration. The loader asks zenhub for the device configurations
+        whose version changed, so only the tasks of changed, added or
+        deleted devices are rebuilt. Devices with unchanged configurations
+        keep their scheduled tasks. Restart the daemon to rebuild every task.
         """
         if self.reconfigureTimeout and not self.reconfigureTimeout.active():
             self.reconfigureTimeout = None
@@ -524,6 +603,7 @@ class CollectorDaemon(RRDDaemon):
         else:
             self._devices.add(configId)
             self._configListener.added(cfg)
+        self._deviceConfigVersions[configId] = getattr(cfg, 'configVersion', None)
 
         newTasks = self._taskSplitter.splitConfiguration([cfg])
         self.log.debug("Tasks for config %s: %s", configId, newTasks)
@@ -585,10 +665,19 @@ class CollectorDaemon(RRDDaemon):
         for configId in deletedDevices:
             self._deleteDevice(configId)
             
+    def getDeviceConfigVersions(self):
+        """
+        Return the configVersion of each device configuration, keyed by
+        configId. Unversioned configurations map to None.
+        """
+        return dict((configId, self._deviceConfigVersions.get(configId))
+                    for configId in self._devices)
+
     def _deleteDevice(self, deviceId):
         self.log.debug("Device %s deleted" % deviceId)
 
         self._devices.discard(deviceId)
+        self._deviceConfigVersions.pop(deviceId, None)
         self._configListener.deleted(deviceId)
         self._configProxy.deleteConfigProxy(self.preferences, deviceId)
         self._scheduler.removeTasksForConfig(deviceId)
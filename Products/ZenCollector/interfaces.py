@@ -153,6 +153,23 @@ class IConfigurationProxy(zope.interface.Interface):
         """
         pass
 
+    def getConfigProxyChanges(self, prefs, versions):
+        """
+        Optional. Called by the framework instead of getConfigProxies when
+        all configurations are refreshed, to retrieve only the configurations
+        that changed.
+
+        @param prefs: the collector preferences object
+        @type prefs: an object providing ICollectorPreferences
+        @param versions: configVersion of each current configuration, keyed
+                         by configId
+        @type versions: dict
+        @return: a twisted Deferred firing with a tuple of the changed or
+                 added configurations and the configIds to delete
+        @rtype: twisted.internet.defer.Deferred
+        """
+        pass
+
     def deleteConfigProxy(self, prefs, configId):
         """
         Called by the framework whenever a configuration should be removed.
@@ -419,6 +436,16 @@ class IDataService(zope.interface.Interface):
         """
         pass
 
+    def writeMetrics(self, batch):
+        """
+        Write a batch of metrics.  Each datapoint in the batch is handled as
+        if writeMetric had been called for it.
+
+        @param batch: the datapoints to write
+        @type batch: Products.ZenUtils.metricwriter.MetricBatch
+        """
+        pass
+
     def writeRRD(self, path, value, rrdType, rrdCommand=None, cycleTime=None,
                  min='U', max='U', threshEventData=None, timestamp='N', allowStaleDatapoint=True):
         """
@@ -337,6 +337,18 @@ class Scheduler(object):
     def executor(self):
         return self._executor
 
+    def pauseProducing(self):
+        """
+        Stop running tasks until resumeProducing is called.  Tasks that come
+        due in the meantime wait in the executor queue.
+        """
+        log.info("Pausing task execution")
+        self._executor.pause()
+
+    def resumeProducing(self):
+        log.info("Resuming task execution")
+        self._executor.resume()
+
     def _getMaxTasks(self):
         return self._executor.getMax()
 
@@ -10,6 +10,8 @@
 
 from twisted.internet import defer
 from twisted.spread import pb
+import cPickle as pickle
+import hashlib
 import logging
 
 from Acquisition import aq_parent
@@ -51,6 +53,15 @@ class DeviceProxy(pb.Copyable, pb.RemoteCopy):
         retval = getattr(self, "_config_id", None)
         return retval if (retval is not None) else self.id
 
+    @property
+    def configVersion(self):
+        """
+        Hash of the configuration content set by the config service, used by
+        collectors to request only configurations that have changed. None if
+        the configuration is not versioned.
+        """
+        return getattr(self, "_config_version", None)
+
     @property
     def deviceGuid(self):
         """
@@ -74,6 +85,13 @@ BASE_ATTRIBUTES = ('id',
 
 
 class CollectorConfigService(HubService, ThresholdMixin):
+
+    # The configuration versions zenhub last sent to the collector, as
+    # {device id: {configId: configVersion}}, and the ids of the devices
+    # invalidated since. None until a full configuration was sent.
+    _sentConfigVersions = None
+    _staleDevices = frozenset()
+
     def __init__(self, dmd, instance, deviceProxyAttributes=()):
         """
         Constructs a new CollectorConfig instance.
@@ -151,12 +169,14 @@ class CollectorConfigService(HubService, ThresholdMixin):
     def perfConfUpdated(self, object, event):
         with gc_cache_every(1000, db=self.dmd._p_jar._db):
             if object.id == self.instance:
+                self._forgetSentConfigs()
                 for listener in self.listeners:
                     listener.callRemote('setPropertyItems', object.propertyItems())
 
     @onUpdate(ZenPack)
     def zenPackUpdated(self, object, event):
         with gc_cache_every(1000, db=self.dmd._p_jar._db):
+            self._forgetSentConfigs()
             for listener in self.listeners:
                 try:
                     listener.callRemote('updateThresholdClasses',
@@ -224,6 +244,9 @@ class CollectorConfigService(HubService, ThresholdMixin):
     def deviceDeleted(self, object, event):
         with gc_cache_every(1000, db=self.dmd._p_jar._db):
             devid = object.id
+            if self._sentConfigVersions is not None:
+                self._sentConfigVersions.pop(devid, None)
+                self._staleDevices.discard(devid)
             collector = object.getPerformanceServer().getId()
             # The invalidation is only sent to the collector where the deleted device was
             if collector == self.instance:
@@ -269,11 +292,135 @@ class CollectorConfigService(HubService, ThresholdMixin):
                 deviceConfigs.extend(proxies)
 
         self._wrapFunction(self._postCreateDeviceProxy, deviceConfigs)
+        self._setConfigVersions(deviceConfigs)
         return deviceConfigs
 
+    @translateError
+    def remote_getDeviceConfigChanges(self, configVersions):
+        """
+        Return only the device configurations that differ from the ones the
+        collector already has.
+
+        @param configVersions: the configVersion of every configuration the
+               collector holds, keyed by configId (None if unversioned)
+        @type configVersions: dict
+        @return: the changed or added configurations and the configIds of
+                 the configurations that should be deleted
+        @rtype: tuple
+        """
+        deviceConfigs = self.remote_getDeviceConfigs()
+        changed = [cfg for cfg in deviceConfigs
+                   if cfg.configVersion is None
+                   or configVersions.get(cfg.configId) != cfg.configVersion]
+        current = set(cfg.configId for cfg in deviceConfigs)
+        deleted = [configId for configId in configVersions
+                   if configId not in current]
+        self.log.debug("Sending %d of %d configurations, %d deleted",
+                       len(changed), len(deviceConfigs), len(deleted))
+        return changed, deleted
+
+    def local_getDeviceConfigChanges(self, deferToWorker, configVersions):
+        """
+        Answer remote_getDeviceConfigChanges in zenhub, which sees the
+        invalidations the workers do not. Nothing is built if the collector
+        holds the versions last sent to it and none of its devices was
+        invalidated since. Otherwise a worker builds the configurations of
+        the invalidated devices only, or all of them if the collector holds
+        something else.
+
+        @param deferToWorker: calls a remote method of this service on a
+               worker, returns a Deferred
+        @type deferToWorker: function
+        """
+        sent = self._sentConfigVersions
+        deviceNames = None
+        if sent is not None:
+            held = {}
+            for versions in sent.itervalues():
+                held.update(versions)
+            if held == configVersions:
+                if not self._staleDevices:
+                    self.log.debug("Configurations are up to date")
+                    return [], []
+                deviceNames = sorted(self._staleDevices)
+        else:
+            # filled in once the configurations are built
+            self._sentConfigVersions = {}
+        # devices invalidated from now on are built again next time
+        self._staleDevices = set()
+        d = deferToWorker('getDeviceConfigs', deviceNames)
+        d.addCallback(self._sentConfigChanges, configVersions, deviceNames)
+        d.addErrback(self._sentConfigChangesFailed)
+        return d
+
+    def _sentConfigChanges(self, deviceConfigs, configVersions, deviceNames):
+        """
+        Return the changes to send for the configurations built for
+        deviceNames, all devices if None, and remember the versions sent.
+        """
+        changed = [cfg for cfg in deviceConfigs
+                   if cfg.configVersion is None
+                   or configVersions.get(cfg.configId) != cfg.configVersion]
+        built = self._configVersionsByDevice(deviceConfigs)
+        deleted = []
+        if deviceNames is None:
+            current = set(cfg.configId for cfg in deviceConfigs)
+            deleted = [configId for configId in configVersions
+                       if configId not in current]
+            if self._sentConfigVersions is not None:
+                self._sentConfigVersions = built
+        elif self._sentConfigVersions is None or \
+                not set(built).issubset(deviceNames):
+            # the versions sent are unknown or not kept by device id, the
+            # next request builds all configurations and finds the deletes
+            self._forgetSentConfigs()
+        else:
+            sent = self._sentConfigVersions
+            for name in deviceNames:
+                versions = built.get(name, {})
+                deleted.extend(configId for configId in sent.pop(name, ())
+                               if configId not in versions)
+                if versions:
+                    sent[name] = versions
+        self.log.debug("Sending %d of %d configurations, %d deleted",
+                       len(changed), len(deviceConfigs), len(deleted))
+        return changed, deleted
+
+    def _sentConfigChangesFailed(self, failure):
+        self._forgetSentConfigs()
+        return failure
+
+    def _configVersionsByDevice(self, deviceConfigs):
+        versions = {}
+        for cfg in deviceConfigs:
+            versions.setdefault(cfg.id, {})[cfg.configId] = cfg.configVersion
+        return versions
+
+    def _forgetSentConfigs(self):
+        """
+        Called when something all configurations may depend on changed, the
+        next request for changes builds all of them.
+        """
+        self._sentConfigVersions = None
+        self._staleDevices = frozenset()
+
     def _postCreateDeviceProxy(self, deviceConfigs):
         pass
 
+    def _setConfigVersions(self, deviceConfigs):
+        """
+        Stamp each proxy with a hash of its content. Proxies that cannot be
+        pickled are left unversioned and are always sent.
+        """
+        for proxy in deviceConfigs:
+            try:
+                state = sorted(proxy.__dict__.iteritems())
+                data = pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                self.log.debug("Unable to version configuration %r", proxy)
+                continue
+            proxy._config_version = hashlib.md5(data).hexdigest()
+
     def _createDeviceProxies(self, device):
         proxy = self._createDeviceProxy(device)
         return (proxy,) if (proxy is not None) else ()
@@ -365,6 +512,8 @@ class CollectorConfigService(HubService, ThresholdMixin):
         """
         Notify all instances (daemons) of a change for the device
         """
+        if self._sentConfigVersions is not None:
+            self._staleDevices.add(object.id)
         # procrastinator schedules a call to _pushConfig
         self._procrastinator.doLater(object)
 
@@ -378,9 +527,16 @@ class CollectorConfigService(HubService, ThresholdMixin):
             proxies = self._wrapFunction(self._createDeviceProxies, device)
             if proxies:
                 self._wrapFunction(self._postCreateDeviceProxy, proxies)
+                self._setConfigVersions(proxies)
         else:
             proxies = None
 
+        sent = self._sentConfigVersions
+        if sent is not None and self.listeners:
+            sent.pop(device.id, None)
+            sent.update(self._configVersionsByDevice(proxies or ()))
+            self._staleDevices.discard(device.id)
+
         prev_collector = device.dmd.Monitors.primaryAq().getPreviousCollectorForDevice(device.id)
         for listener in self.listeners:
             if not proxies:
@@ -426,6 +582,7 @@ class CollectorConfigService(HubService, ThresholdMixin):
         ncc = self._notifyConfigChange(object)
         self.log.debug("services/config.py _reconfigureIfNotify object=%r _notifyConfigChange=%s" % (object, ncc))
         if ncc:
+            self._forgetSentConfigs()
             self.log.debug('scheduling collector reconfigure')
             self._reconfigProcrastinator.doLater(True)
 
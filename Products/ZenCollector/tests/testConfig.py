@@ -8,6 +8,8 @@
 ##############################################################################
 
 
+import logging
+
 import Globals
 import zope.component
 import zope.interface
@@ -15,8 +17,14 @@ import zope.interface
 from twisted.internet import defer
 from Products.ZenTestCase.BaseTestCase import BaseTestCase
 
-from Products.ZenCollector.config import ConfigurationProxy
-from Products.ZenCollector.interfaces import ICollector, ICollectorPreferences
+from Products.ZenCollector.config import ConfigurationProxy, \
+    ConfigurationLoaderTask
+from Products.ZenCollector.interfaces import ICollector, \
+    ICollectorPreferences, IFrameworkFactory
+from Products.ZenCollector.services.config import CollectorConfigService, \
+    DeviceProxy
+
+log = logging.getLogger('zen.testConfig')
 
 
 class MyCollector(object):
@@ -35,6 +43,9 @@ class MyCollector(object):
         def remote_getDeviceConfigs(self, devices=[]):
             return defer.succeed(['hmm', 'foo', 'bar'])
 
+        def remote_getDeviceConfigChanges(self, versions):
+            return defer.succeed((['foo'], [k for k in versions if k == 'gone']))
+
         def callRemote(self, methodName, *args):
             if methodName is 'getConfigProperties':
                 return self.remote_propertyItems()
@@ -44,6 +55,8 @@ class MyCollector(object):
                 return self.remote_getCollectorThresholds()
             elif methodName is 'getDeviceConfigs':
                 return self.remote_getDeviceConfigs(args)
+            elif methodName is 'getDeviceConfigChanges':
+                return self.remote_getDeviceConfigChanges(*args)
 
     def getRemoteConfigServiceProxy(self):
         return MyCollector.MyConfigServiceProxy()
@@ -117,8 +130,204 @@ class TestConfig(BaseTestCase):
         d.addBoth(validate)
         return d
 
+    def testConfigProxyChanges(self):
+        def validate(result):
+            changed, deleted = result
+            self.assertEqual(changed, ['foo'])
+            self.assertEqual(deleted, ['gone'])
+            return result
+
+        cfgService = ConfigurationProxy()
+        prefs = MyPrefs()
+
+        d = cfgService.getConfigProxyChanges(prefs, {'foo': None, 'gone': 'abc'})
+        d.addBoth(validate)
+        return d
+
+
+class VersionedConfigService(CollectorConfigService):
+    """
+    Builds a proxy from each of a list of dicts instead of from devices.
+    """
+    def __init__(self, devices):
+        self.log = log
+        self.devices = devices
+        self.listeners = []
+        self.built = []
+
+    def _getDevices(self, deviceNames=None):
+        if deviceNames is None:
+            return self.devices
+        return [device for device in self.devices
+                if device['id'] in deviceNames]
+
+    def _filterDevices(self, devices):
+        return devices
+
+    def _createDeviceProxies(self, device):
+        proxy = DeviceProxy()
+        proxy.__dict__.update(device)
+        return (proxy,)
+
+    def _deferToWorker(self, method, *args):
+        self.built.append(args[0])
+        return defer.succeed(getattr(self, 'remote_' + method)(*args))
+
+    def getDeviceConfigChanges(self, configVersions):
+        result = []
+        defer.maybeDeferred(self.local_getDeviceConfigChanges,
+                            self._deferToWorker, configVersions
+                            ).addCallback(result.append)
+        return result[0]
+
+
+class TestDeviceConfigChanges(BaseTestCase):
+
+    def testHubSendsOnlyChanges(self):
+        service = VersionedConfigService([dict(id='a', port=1),
+                                          dict(id='b', port=2)])
+        configs = service.remote_getDeviceConfigs()
+        versions = dict((cfg.configId, cfg.configVersion) for cfg in configs)
+        self.assertNotEqual(versions['a'], versions['b'])
+
+        # nothing changed
+        changed, deleted = service.remote_getDeviceConfigChanges(versions)
+        self.assertEqual([], changed)
+        self.assertEqual([], deleted)
+
+        # b changed, c was added and d is gone
+        service.devices = [dict(id='a', port=1), dict(id='b', port=3),
+                           dict(id='c', port=4)]
+        versions['d'] = 'abc'
+        changed, deleted = service.remote_getDeviceConfigChanges(versions)
+        self.assertEqual(['b', 'c'], sorted(cfg.configId for cfg in changed))
+        self.assertEqual(['d'], deleted)
+
+        # unversioned configurations are always sent
+        versions = dict((cfg.configId, None) for cfg in configs)
+        changed, deleted = service.remote_getDeviceConfigChanges(versions)
+        self.assertEqual(['a', 'b', 'c'],
+                         sorted(cfg.configId for cfg in changed))
+
+    def testZenHubBuildsOnlyInvalidatedDevices(self):
+        service = VersionedConfigService([dict(id='a', port=1),
+                                          dict(id='b', port=2)])
+        # nothing was sent yet, everything is built
+        changed, deleted = service.getDeviceConfigChanges({})
+        self.assertEqual(['a', 'b'], sorted(cfg.configId for cfg in changed))
+        self.assertEqual([None], service.built)
+        versions = dict((cfg.configId, cfg.configVersion) for cfg in changed)
+
+        # up to date, nothing is built
+        self.assertEqual(([], []), service.getDeviceConfigChanges(versions))
+        self.assertEqual([None], service.built)
+
+        # only the invalidated device is built
+        service.devices = [dict(id='a', port=1), dict(id='b', port=3)]
+        service._staleDevices.add('b')
+        changed, deleted = service.getDeviceConfigChanges(versions)
+        self.assertEqual(['b'], [cfg.configId for cfg in changed])
+        self.assertEqual([None, ['b']], service.built)
+        versions['b'] = changed[0].configVersion
+        self.assertEqual(([], []), service.getDeviceConfigChanges(versions))
+
+        # an invalidated device that is gone is deleted
+        service.devices = [dict(id='a', port=1)]
+        service._staleDevices.add('b')
+        self.assertEqual(([], ['b']), service.getDeviceConfigChanges(versions))
+        self.assertEqual([None, ['b'], ['b']], service.built)
+        del versions['b']
+        self.assertEqual(([], []), service.getDeviceConfigChanges(versions))
+
+        # the collector holds something else, everything is built
+        versions['c'] = 'abc'
+        self.assertEqual(([], ['c']), service.getDeviceConfigChanges(versions))
+        self.assertEqual([None, ['b'], ['b'], None], service.built)
+        del versions['c']
+
+        # a change every configuration may depend on
+        service._forgetSentConfigs()
+        self.assertEqual(([], []), service.getDeviceConfigChanges(versions))
+        self.assertEqual([None, ['b'], ['b'], None, None], service.built)
+
+    def testZenHubForgetsVersionsOnFailure(self):
+        service = VersionedConfigService([dict(id='a', port=1)])
+        def failing(method, *args):
+            return defer.fail(Exception('failed build'))
+        errors = []
+        service.local_getDeviceConfigChanges(failing, {}).addErrback(
+            errors.append)
+        self.assertEqual(1, len(errors))
+        self.assertEqual(None, service._sentConfigVersions)
+        changed, deleted = service.getDeviceConfigChanges({})
+        self.assertEqual(['a'], [cfg.configId for cfg in changed])
+
+
+class ConfigChangesCollector(MyCollector):
+    heartbeatTimeout = None
+
+    def __init__(self, versions):
+        self.versions = versions
+        self.updated = []
+        self.deleted = []
+
+    def getDeviceConfigVersions(self):
+        return dict(self.versions)
+
+    def _updateDeviceConfigs(self, configs, purgeOmitted):
+        self.updated.append((configs, purgeOmitted))
+        return defer.succeed(None)
+
+    def _deleteDevice(self, configId):
+        self.deleted.append(configId)
+
+
+class MyFrameworkFactory(object):
+    zope.interface.implements(IFrameworkFactory)
+
+    def getConfigurationProxy(self):
+        return ConfigurationProxy()
+
+
+class MyTaskPrefs(MyPrefs):
+    configCycleInterval = 360
+    cycleInterval = 300
+
+
+class TestConfigurationLoaderTask(BaseTestCase):
+
+    def createTask(self, versions):
+        self.collector = ConfigChangesCollector(versions)
+        zope.component.provideUtility(self.collector, ICollector)
+        zope.component.provideUtility(MyFrameworkFactory(), IFrameworkFactory,
+                                      'core')
+        return ConfigurationLoaderTask('configLoader',
+                                       taskConfig=MyTaskPrefs())
+
+    def testProcessConfigChanges(self):
+        task = self.createTask({'unchanged': 'v1', 'changed': 'v2',
+                                'removed': 'v3'})
+        changed = DeviceProxy()
+        changed.id = 'changed'
+        task._processConfigChanges(([changed], ['removed']))
+        # only the changed device is updated, without purging the others
+        self.assertEqual([([changed], False)], self.collector.updated)
+        self.assertEqual(['removed'], self.collector.deleted)
+
+    def testProcessAllConfigs(self):
+        task = self.createTask({'unchanged': 'v1'})
+        processed = []
+        task._processConfig = lambda configs: processed.append(configs)
+        # a full fetch, after the hub did not support changes
+        task._processConfigChanges((['all'], None))
+        self.assertEqual([['all']], processed)
+        self.assertEqual([], self.collector.updated)
+
+
 def test_suite():
     from unittest import TestSuite, makeSuite
     suite = TestSuite()
     suite.addTest(makeSuite(TestConfig))
+    suite.addTest(makeSuite(TestDeviceConfigChanges))
+    suite.addTest(makeSuite(TestConfigurationLoaderTask))
     return suite
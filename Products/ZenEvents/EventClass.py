@@ -24,9 +24,11 @@ from AccessControl import Permissions
 from Products.ZenModel.ManagedEntity import ManagedEntity
 from Products.ZenModel.ZenossSecurity import *
 from Acquisition import aq_base
+from BTrees.Length import Length
 
 from Products.ZenRelations.RelSchema import *
-from EventClassInst import EventClassInst, EventClassPropertyMixin
+from EventClassInst import EventClassInst, EventClassPropertyMixin, \
+    invalidateTransform
 from Products.ZenEvents.ZenEventClasses import Unknown
 
 from Products.ZenModel.Organizer import Organizer
@@ -175,6 +177,55 @@ class EventClass(EventClassPropertyMixin, Organizer, ManagedEntity, ZenPackable)
         return insts
 
 
+    def mappingsChanged(self):
+        """
+        Note that event class mappings were added, removed, rekeyed or
+        resequenced, so that the mapping index is rebuilt on next use.
+        Called on the root event class.
+        """
+        generation = getattr(aq_base(self), '_mappingGeneration', None)
+        if generation is None:
+            generation = self._mappingGeneration = Length()
+        generation.change(1)
+        self._v_mappingIndex = None
+
+
+    def _getMappingIndex(self):
+        """
+        Return a dictionary of eventClassKey to the mappings with that key in
+        sequence order.  The index is built by walking the event class tree
+        once per mapping generation; lookups do not touch the catalog.
+        """
+        generation = getattr(aq_base(self), '_mappingGeneration', None)
+        generation = generation() if generation is not None else 0
+        index = getattr(aq_base(self), '_v_mappingIndex', None)
+        if index is None or index[0] != generation:
+            mappings = {}
+            for inst in self.getInstances():
+                mappings.setdefault(inst.eventClassKey, []).append(inst)
+            for insts in mappings.itervalues():
+                insts.sort(key=lambda x: x.sequence)
+            index = self._v_mappingIndex = (generation, mappings)
+        return index[1]
+
+
+    def findMappings(self, evClassKey):
+        """
+        Same as find, but served from the mapping index of this event class
+        tree rather than the catalog.
+
+        @parameter evClassKey: event class key
+        @type evClassKey: string
+        @return: list of event class mappings that match evClassKey, sorted
+        @rtype: list of EventClassInst
+        """
+        index = self._getMappingIndex()
+        insts = list(index.get(evClassKey, ()))
+        if evClassKey != "defaultmapping":
+            insts.extend(index.get("defaultmapping", ()))
+        return insts
+
+
     def lookup(self, evt, device):
         """
         Given an event, return an event class organizer object
@@ -203,7 +254,7 @@ class EventClass(EventClassPropertyMixin, Organizer, ManagedEntity, ZenPackable)
 
         log.debug("No event class specified, searching for eventClassKey %s",
                   eventClassKey)
-        evtcls = self.find(eventClassKey)
+        evtcls = self.getDmdRoot("Events").findMappings(eventClassKey)
         log.debug("Found the following event classes that matched key %s: %s",
                   eventClassKey, evtcls)
 
@@ -339,6 +390,7 @@ class EventClass(EventClassPropertyMixin, Organizer, ManagedEntity, ZenPackable)
         """Save the transform"""
         oldTransform = self.transform
         self.transform = transform
+        invalidateTransform(self)
         if REQUEST:
             audit('UI.EventClass.EditTransform', self, transform=transform, oldData_={'transform':oldTransform})
             return self.callZenScreen(REQUEST)
@@ -13,6 +13,7 @@ from ZODB.transact import transact
 
 import copy
 import re
+from bisect import bisect_left
 import sre_constants
 import logging
 import transaction
@@ -25,7 +26,7 @@ log = logging.getLogger("zen.Events")
 from Globals import InitializeClass
 from AccessControl import ClassSecurityInfo
 from AccessControl import Permissions
-from Acquisition import aq_chain
+from Acquisition import aq_base, aq_chain
 from zope.interface import implements
 
 from Products.ZenModel.interfaces import IIndexed
@@ -50,6 +51,136 @@ def manage_addEventClassInst(context, id, REQUEST = None):
     if REQUEST is not None:
         REQUEST['RESPONSE'].redirect(context.absolute_url() + '/manage_main')
 
+class TransformTimings(object):
+    """
+    Histogram of how long a transform takes to run.
+    """
+    buckets = (0.001, 0.01, 0.1, 1.0, MAX_TRANSFORM_TIME)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, elapsed):
+        self.counts[bisect_left(self.buckets, elapsed)] += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def __str__(self):
+        labels = ['<=%gs' % b for b in self.buckets] + \
+                 ['>%gs' % self.buckets[-1]]
+        return '%d runs, avg %.4fs, max %.4fs, %s' % (
+            self.count, self.total / max(self.count, 1), self.max,
+            ' '.join('%s:%d' % lc for lc in zip(labels, self.counts)))
+
+
+class CompiledTransform(object):
+    """
+    The code object compiled from an event class transform, with the
+    source it was compiled from and the run times of the transform.
+    """
+    __slots__ = ('source', 'code', 'name', 'timings')
+
+    def __init__(self, source, code, name):
+        self.source = source
+        self.code = code
+        self.name = name
+        self.timings = TransformTimings()
+
+
+# compiled transforms, keyed by the oid of the event class or mapping
+_compiledTransforms = {}
+
+
+def _transformKey(eventclass):
+    key = eventclass._p_oid
+    if key is None:
+        key = eventclass.getPrimaryId()
+    return key
+
+
+def invalidateTransform(eventclass):
+    """
+    Drop the compiled transform for an event class or mapping.
+    """
+    _compiledTransforms.pop(_transformKey(eventclass), None)
+
+
+def getTransformTimings():
+    """
+    Return a dictionary of event class path to the TransformTimings of
+    its transform.
+    """
+    return dict((c.name, c.timings) for c in _compiledTransforms.values())
+
+
+# names available to every transform; evt, device, component and dmd are
+# added per event
+_transformGlobals = {
+    'convToUnits':convToUnits, 'zdecode':zdecode,
+    'txnCommit':transaction.commit,  # this function is deprecated in favor of transforms using @transact
+    'transact':transact,
+    'log':log,
+    'getFacade':Zuul.getFacade, 'IInfo':IInfo,
+}
+
+
+class MappingMatcher(object):
+    """
+    The rule or regex of an EventClassInst, compiled once so that matching
+    an event does not have to parse it again.
+    """
+    __slots__ = ('rule', 'regex', 'key', '_code', '_pattern')
+
+    def __init__(self, rule, regex, key):
+        self.rule = rule
+        self.regex = regex
+        self.key = key
+        self._code = None
+        self._pattern = None
+        if rule:
+            try:
+                self._code = compile(rule, '<rule %s>' % key, 'eval')
+            except Exception, e:
+                # reported each time the rule is used, as eval would
+                self._code = e
+        else:
+            try:
+                self._pattern = re.compile(regex, re.I)
+            except sre_constants.error:
+                pass
+
+    def match(self, evt, device):
+        """
+        Match an event against the compiled rule or regex.
+
+        @parameter evt: event to match in our mapping
+        @type evt: dictionary
+        @parameter device: device
+        @type device: DMD object
+        @return: boolean
+        @rtype: boolean
+        """
+        log.debug("match on:%s", self.key)
+        if self.rule:
+            try:
+                if isinstance(self._code, Exception):
+                    raise self._code
+                return eval(self._code, {'evt':evt, 'dev':device, 'device': device})
+            except Exception, e:
+                logging.warn("EventClassInst: %s rule failure: %s",
+                            self.key, e)
+                return False
+        if self._pattern is None:
+            return False
+        return self._pattern.search(evt.message)
+
+
 @contextmanager
 def transformsavepoint(errorCallback=lambda :None):
     sp = None
@@ -206,21 +337,31 @@ Transform:
         down to the actual Event Rules (EventClassInst)
         """
         transpath = self._eventClassPath()
-        variables_and_funcs = {
+        variables_and_funcs = dict(_transformGlobals)
+        variables_and_funcs.update({
             'evt':evt, 'device':device, 'dev':device,
-            'convToUnits':convToUnits, 'zdecode':zdecode,
-            'txnCommit':transaction.commit,  # this function is deprecated in favor of transforms using @transact
-            'transact':transact, 'dmd':self.dmd,
-            'log':log, 'component':component,
-            'getFacade':Zuul.getFacade, 'IInfo':IInfo,
-        }
+            'dmd':self.dmd, 'component':component,
+        })
         for eventclass in transpath:
-            if not eventclass.transform: continue
+            source = eventclass.transform
+            if not source: continue
+            key = _transformKey(eventclass)
+            compiled = _compiledTransforms.get(key)
             startTime = time.time()
             errorCallback = partial(self.sendTransformException, eventclass, evt)
             with transformsavepoint(errorCallback):
-                exec(eventclass.transform, variables_and_funcs)
+                if compiled is None or compiled.source != source:
+                    # compile here rather than in a helper so that
+                    # sendTransformException sees the same traceback
+                    # as for an exec of the source
+                    compiled = CompiledTransform(
+                        source, compile(source, "<string>", "exec"),
+                        eventclass.getPrimaryDmdId())
+                    _compiledTransforms[key] = compiled
+                exec(compiled.code, variables_and_funcs)
             endTime = time.time()
+            if compiled is not None:
+                compiled.timings.add(endTime - startTime)
 
             if endTime - startTime > MAX_TRANSFORM_TIME:
                 log.warning('Event transform took %.1f seconds (threshold %.1f seconds), event context is %s, transform is: %s', endTime - startTime, MAX_TRANSFORM_TIME, evt, eventclass.transform)
@@ -417,21 +558,40 @@ class EventClassInst(EventClassPropertyMixin, ZenModelRM, EventView,
         @return: boolean
         @rtype: boolean
         """
-        value = False
-        log.debug("match on:%s", self.getPrimaryDmdId())
-        if self.rule:
-            try:
-                log.debug("eval rule:%s", self.rule)
-                value = eval(self.rule, {'evt':evt, 'dev':device, 'device': device})
-            except Exception, e:
-                logging.warn("EventClassInst: %s rule failure: %s",
-                            self.getDmdKey(), e)
-        else:
-            try:
-                log.debug("regex='%s' message='%s'", self.regex, evt.message)
-                value = re.search(self.regex, evt.message, re.I)
-            except sre_constants.error: pass
-        return value
+        return self.getMatcher().match(evt, device)
+
+
+    def getMatcher(self):
+        """Return our rule or regex compiled into a MappingMatcher.  The
+        matcher is kept until the object is invalidated or its rule or regex
+        is changed.
+        """
+        matcher = getattr(aq_base(self), '_v_matcher', None)
+        if matcher is None or matcher.rule != self.rule \
+                or matcher.regex != self.regex:
+            matcher = MappingMatcher(self.rule, self.regex, self.getDmdKey())
+            self._v_matcher = matcher
+        return matcher
+
+
+    def index_object(self, idxs=None):
+        super(EventClassInst, self).index_object(idxs)
+        self._mappingsChanged()
+
+
+    def unindex_object(self):
+        super(EventClassInst, self).unindex_object()
+        self._mappingsChanged()
+
+
+    def _mappingsChanged(self):
+        """Tell the event class tree that the set of mappings changed.
+        """
+        try:
+            events = self.getDmdRoot("Events")
+        except (AttributeError, KeyError):
+            return
+        events.mappingsChanged()
 
 
     def testRegexStyle(self):
@@ -472,6 +632,7 @@ class EventClassInst(EventClassPropertyMixin, ZenModelRM, EventView,
         # second pass take out any holes
         for i, map in enumerate(self.sameKey()):
             map.sequence = i
+        self._mappingsChanged()
         if REQUEST:
             audit('UI.EventClassMapping.Resequence', self.id, sequence=seqmap)
             return self.callZenScreen(REQUEST)
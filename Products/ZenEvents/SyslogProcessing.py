@@ -13,6 +13,8 @@ Class for turning syslog events into Zenoss Events
 """
 
 import re
+import sre_parse
+import sre_constants
 import logging
 slog = logging.getLogger("zen.Syslog")
 import socket
@@ -95,6 +97,90 @@ for regex in parsers:
         pass
 
 
+def _literalRuns(parsed, runs):
+    """
+    Collect the runs of literal characters that any match of a parsed
+    regex must contain.  Literals inside optional or alternative parts are
+    skipped.
+    """
+    run = []
+    for op, av in parsed:
+        if op == sre_constants.LITERAL:
+            run.append(chr(av))
+            continue
+        if run:
+            runs.append(''.join(run))
+            run = []
+        if op == sre_constants.SUBPATTERN:
+            _literalRuns(av[-1], runs)
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) \
+                and av[0] >= 1:
+            _literalRuns(av[2], runs)
+    if run:
+        runs.append(''.join(run))
+    return runs
+
+
+def _requirements(regex):
+    """
+    Return the literal prefix a message must start with to match an
+    anchored regex, and up to two literals it must contain to match at all.
+    """
+    if regex.flags & re.IGNORECASE:
+        return '', ()
+    try:
+        parsed = sre_parse.parse(regex.pattern, regex.flags)
+    except (sre_constants.error, ValueError):
+        return '', ()
+    items = list(parsed)
+    prefix = ''
+    if items and items[0] == (sre_constants.AT, sre_constants.AT_BEGINNING):
+        for op, av in items[1:]:
+            if op != sre_constants.LITERAL:
+                break
+            prefix += chr(av)
+    try:
+        runs = _literalRuns(items, [])
+    except ValueError:
+        return '', ()
+    runs = sorted(set(r for r in runs if r not in prefix),
+                  key=len, reverse=True)
+    return prefix, tuple(runs[:2])
+
+
+class ParserDispatch(object):
+    """
+    Finds the first of a list of compiled tag parsers that matches a
+    message.  Each parser is only run if the message starts with the
+    literal prefix the parser is anchored to and contains the literals
+    the parser requires, so most messages only run one or two regexes.
+    The result is the same as running every parser in order.
+    """
+
+    def __init__(self, parsers):
+        self._parsers = []
+        for regex, keepEntry in parsers:
+            prefix, literals = _requirements(regex)
+            self._parsers.append((prefix, literals, regex.search, keepEntry))
+
+    def search(self, msg):
+        """
+        Return the match of the first parser that matches the message and
+        whether to keep the entry, or None and True if no parser matches.
+        """
+        for prefix, literals, search, keepEntry in self._parsers:
+            if prefix and not msg.startswith(prefix):
+                continue
+            for literal in literals:
+                if literal not in msg:
+                    break
+            else:
+                m = search(msg)
+                if m:
+                    return m, keepEntry
+        return None, True
+
+
 class SyslogProcessor(object):
     """
     Class to process syslog messages and convert them into events viewable
@@ -121,6 +207,7 @@ class SyslogProcessor(object):
         self.sendEvent = sendEvent
         self.monitor = monitor
         self.defaultPriority = defaultPriority
+        self.dispatch = ParserDispatch(compiledParsers)
 
 
     def process(self, msg, ipaddr, host, rtime):
@@ -159,6 +246,18 @@ class SyslogProcessor(object):
                 evt['message'] = unicode(evt['message'] )
             self.sendEvent(evt)
 
+
+    def processMany(self, messages):
+        """
+        Process a batch of syslog messages
+
+        @param messages: messages from remote hosts
+        @type messages: iterable of (msg, ipaddr, host, rtime) tuples
+        """
+        process = self.process
+        for msg, ipaddr, host, rtime in messages:
+            process(msg, ipaddr, host, rtime)
+
         
     def parsePRI(self, evt, msg):
         """
@@ -221,8 +320,6 @@ class SyslogProcessor(object):
         @type: (dictionary, string)
         """
         slog.debug(msg)
-        m = re.sub("Kiwi_Syslog_Daemon \d+: \d+: "
-            "\S{3} [\d ]{2} [\d ]{2}:[\d ]{2}:[^:]+: ", "", msg)
         m = self.timeParse(msg)
         if m: 
             slog.debug("parseHEADER timestamp=%s", m.group(1))
@@ -257,20 +354,17 @@ class SyslogProcessor(object):
         @type: dictionary
         """
         slog.debug(msg)
-        for parser, keepEntry in compiledParsers:        
-            slog.debug("tag regex: %s", parser.pattern)
-            m = parser.search(msg)
-            if not m:
-                continue
-            elif not keepEntry:
-                slog.debug("Dropping syslog message due to parser rule.")
-                return None
-            slog.debug("tag match: %s", m.groupdict())
-            evt.update(m.groupdict())
-            break
-        else:
+        m, keepEntry = self.dispatch.search(msg)
+        if m is None:
             slog.info("No matching parser: '%s'", msg)
             evt['summary'] = msg
+        elif not keepEntry:
+            slog.debug("Dropping syslog message due to parser rule.")
+            return None
+        else:
+            fields = m.groupdict()
+            slog.debug("tag match: %s", fields)
+            evt.update(fields)
         return evt
 
 
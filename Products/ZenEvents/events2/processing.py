@@ -17,13 +17,16 @@ from Products.ZenModel.DataRoot import DataRoot
 from Products.ZenEvents.events2.proxy import ZepRawEventProxy, EventProxy
 from Products.ZenUtils.guid.interfaces import IGUIDManager, IGlobalIdentifier
 from Products.ZenUtils.IpUtil import isip, ipToDecimal
-from Products.ZenUtils.FunctionCache import FunctionCache
+from Products.ZenUtils.LRUCache import LRUCache
 from Products.Zuul.interfaces import ICatalogTool
 from Products.AdvancedQuery import Eq, Or
 from zope.component import getUtility, getUtilitiesFor
 from Acquisition import aq_chain
 from Products.ZenEvents import ZenEventClasses
 from itertools import ifilterfalse
+from contextlib import contextmanager
+from functools import wraps
+import time
 
 from zenoss.protocols.jsonformat import to_dict
 from zenoss.protocols.protobufs.model_pb2 import DEVICE, COMPONENT
@@ -58,6 +61,129 @@ class EventLoggerAdapter(logging.LoggerAdapter):
                                             msg=msg)
         return msg, kwargs
 
+def batchCached(keyFunc=None):
+    """
+    Remember the results of a Manager lookup until the end of the batch of
+    events being processed (see Manager.batch). keyFunc turns the arguments
+    of the lookup into a hashable key; the arguments are used as they are
+    by default. Outside of a batch the lookup is always made.
+    """
+    def decorator(func):
+        name = func.__name__
+        @wraps(func)
+        def wrapper(self, *args):
+            cache = self._batchCache
+            if cache is None:
+                return func(self, *args)
+            key = (name, keyFunc(*args) if keyFunc else args)
+            try:
+                return cache[key]
+            except KeyError:
+                result = cache[key] = func(self, *args)
+                return result
+        return wrapper
+    return decorator
+
+class IdentityCache(object):
+    """
+    Process local cache of the uuids of the devices and components that
+    events are identified with.
+
+    The first tier maps a lookup key (an id, name or IP address) to a uuid,
+    the second maps the uuid to the path and the database serial of the
+    element. A uuid is only returned if the element is still at that path
+    and has not been modified since it was cached, so a deleted, renamed,
+    moved or edited element only drops its own entries. Both tiers are
+    bounded LRU caches. Keys that matched nothing are remembered for
+    missTimeout seconds as new elements cannot be seen without a search.
+    """
+
+    def __init__(self, maxsize=10000, missTimeout=60):
+        self._uuids = LRUCache(maxsize)
+        self._elements = LRUCache(maxsize)
+        self.missTimeout = missTimeout
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def resize(self, maxsize):
+        self._uuids.maxsize = self._elements.maxsize = maxsize
+
+    def _valid(self, dmd, uuid):
+        entry = self._elements.get(uuid)
+        if entry is None:
+            return False
+        path, serial = entry
+        element = dmd.unrestrictedTraverse(path, None)
+        if element is None:
+            return False
+        # a ghost keeps the serial it had before it was invalidated, load it
+        # so that changes committed by other processes are seen
+        activate = getattr(element, '_p_activate', None)
+        if activate is not None:
+            activate()
+        return (getattr(element, '_p_serial', None) == serial and
+                not getattr(element, '_p_changed', False) and
+                IGlobalIdentifier(element).getGUID() == uuid)
+
+    def lookup(self, dmd, key, find, *args):
+        """
+        Returns the uuid cached for key or, on a miss, the result of
+        find(*args), which is cached.
+        """
+        cached = self._uuids.get(key)
+        if cached is not None:
+            uuid, cachedAt = cached
+            if uuid is None:
+                if time.time() - cachedAt < self.missTimeout:
+                    self.hits += 1
+                    return None
+            elif self._valid(dmd, uuid):
+                self.hits += 1
+                return uuid
+            else:
+                self.stale += 1
+                self.invalidate(uuid)
+        self.misses += 1
+        uuid = find(*args)
+        self.add(dmd, key, uuid)
+        return uuid
+
+    def add(self, dmd, key, uuid):
+        if uuid:
+            element = IGUIDManager(dmd).getObject(uuid)
+            if element is None:
+                return
+            self._elements[uuid] = (element.getPrimaryId(),
+                                    getattr(element, '_p_serial', None))
+        self._uuids[key] = (uuid, time.time())
+
+    def invalidate(self, uuid):
+        """
+        Drops the element with this uuid, keys that resolve to it are looked
+        up again.
+        """
+        self._elements.pop(uuid)
+
+    def clear(self):
+        self._uuids.clear()
+        self._elements.clear()
+
+    @property
+    def hitRate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def __str__(self):
+        return ('%d keys, %d elements, %d hits, %d misses (%.1f%% hit rate), '
+                '%d stale' % (len(self._uuids), len(self._elements), self.hits,
+                              self.misses, self.hitRate * 100, self.stale))
+
+
+# shared by the Managers of the process; zeneventd sizes it from its options
+identityCache = IdentityCache()
+
+
 class Manager(object):
     """
     Provides lookup access to processing pipes and performs caching.
@@ -70,6 +196,7 @@ class Manager(object):
 
     def __init__(self, dmd):
         self.dmd = dmd
+        self._batchCache = None
         self._initCatalogs()
 
     def _initCatalogs(self):
@@ -85,6 +212,20 @@ class Manager(object):
 
     def reset(self):
         self._initCatalogs()
+        if self._batchCache is not None:
+            self._batchCache.clear()
+
+    @contextmanager
+    def batch(self):
+        """
+        Lookups of elements and uuids made inside this context are made once
+        and shared by all the events of the batch.
+        """
+        self._batchCache = {}
+        try:
+            yield self
+        finally:
+            self._batchCache = None
 
     def getEventClassOrganizer(self, eventClassName):
         try:
@@ -100,6 +241,7 @@ class Manager(object):
         return self._events.lookup(eventContext.eventProxy,
                                    eventContext.deviceObject)
 
+    @batchCached()
     def getElementByUuid(self, uuid):
         """
         Get a Device/Component by UUID
@@ -116,13 +258,18 @@ class Manager(object):
         uuid = brain.uuid
         return uuid if uuid else IGlobalIdentifier(brain.getObject()).getGUID()
 
-    @FunctionCache("getElementUuidById", cache_miss_marker=-1, default_timeout=300)
     def getElementUuidById(self, catalog, element_type_id, id):
         """
         Find element by ID but only cache UUID. This forces us to lookup elements
         each time by UUID (pretty fast) which gives us a chance to see if the element
         has been deleted.
         """
+        key = ('element', catalog.getPrimaryId() if catalog else None,
+               element_type_id, id)
+        return identityCache.lookup(self.dmd, key, self._getElementUuidById,
+                                    catalog, element_type_id, id)
+
+    def _getElementUuidById(self, catalog, element_type_id, id):
         cls = self.ELEMENT_TYPE_MAP.get(element_type_id)
         if cls:
             catalog = catalog or self._catalogs.get(element_type_id)
@@ -144,16 +291,16 @@ class Manager(object):
         """
         Find element by ID, first checking a cache for UUIDs then using that UUID
         to load the element. If the element can't be found by UUID, the UUID
-        cache is cleared and lookup tried again.
+        is dropped from the cache and lookup tried again.
         """
         uuid = self.getElementUuidById(catalog, element_type_id, id)
         if uuid:
             element = self.getElementByUuid(uuid)
             if not element:
                 # Lookup cache must be invalid, try looking up again
-                self.getElementUuidById.clear()
+                identityCache.invalidate(uuid)
                 log.warning(
-                        'Clearing ElementUuidById cache becase we could not find %s' % uuid)
+                        'Dropping %s from the identity cache because we could not find it' % uuid)
                 uuid = self.getElementUuidById(catalog, element_type_id, id)
                 element = self.getElementByUuid(uuid)
             return element
@@ -207,7 +354,7 @@ class Manager(object):
 
         return device_brains, devices
 
-    @FunctionCache("findDeviceUuid", cache_miss_marker=-1, default_timeout=300)
+    @batchCached()
     def findDeviceUuid(self, identifier, ipAddress):
         """
         This will return the device's
@@ -216,6 +363,10 @@ class Manager(object):
         @type  ipaddress: string
         @param ipaddress: The known ipaddress of the device
         """
+        return identityCache.lookup(self.dmd, ('device', identifier, ipAddress),
+                                    self._findDeviceUuid, identifier, ipAddress)
+
+    def _findDeviceUuid(self, identifier, ipAddress):
         device_brains, devices = self._findDevices(identifier, ipAddress, limit=1)
         if device_brains:
             return self.uuidFromBrain(device_brains[0])
@@ -228,6 +379,7 @@ class Manager(object):
         if uuid:
             return self.getElementByUuid(uuid)
 
+    @batchCached(lambda node: node.getPrimaryId())
     def getUuidsOfPath(self, node):
         """
         Looks up all the UUIDs in the tree path of an Organizer
@@ -8,7 +8,8 @@
 ##############################################################################
 
 
-from Products.ZenEvents.events2.processing import Manager
+from Products.ZenEvents.events2.processing import Manager, IdentityCache, \
+    identityCache
 from Products.ZenUtils.guid.interfaces import IGlobalIdentifier
 from Products.ZenTestCase.BaseTestCase import BaseTestCase
 
@@ -36,6 +37,47 @@ class DeviceIdTest(BaseTestCase):
         test('dev', '10.10.10.3', "failed to find by interface's secondary IP")
         test('dev', '10.10.10.4', "failed missing IP test", None)
 
+    def testIdentityCache(self):
+        device = self.dmd.Devices.createInstance('cacheddevice')
+        other = self.dmd.Devices.createInstance('otherdevice')
+        device_uuid = IGlobalIdentifier(device).getGUID()
+        other_uuid = IGlobalIdentifier(other).getGUID()
+        manager = Manager(self.dmd)
+        identityCache.clear()
+
+        hits, stale = identityCache.hits, identityCache.stale
+        self.assertEquals(device_uuid, manager.findDeviceUuid('cacheddevice', ''))
+        self.assertEquals(other_uuid, manager.findDeviceUuid('otherdevice', ''))
+        self.assertEquals(device_uuid, manager.findDeviceUuid('cacheddevice', ''))
+        self.assertEquals(hits + 1, identityCache.hits)
+
+        # a deleted device only drops its own entries
+        self.dmd.Devices.devices._delObject('cacheddevice')
+        self.assertEquals(None, manager.findDeviceUuid('cacheddevice', ''))
+        self.assertEquals(stale + 1, identityCache.stale)
+        self.assertEquals(other_uuid, manager.findDeviceUuid('otherdevice', ''))
+        self.assertEquals(hits + 2, identityCache.hits)
+
+    def testIdentityCacheGhost(self):
+        class Ghost(object):
+            # invalidated by a commit of another process, the new serial
+            # is only seen once the object is loaded again
+            _p_serial = 'old'
+            def _p_activate(self):
+                self._p_serial = 'new'
+
+        class Dmd(object):
+            def unrestrictedTraverse(self, path, default=None):
+                return ghost
+
+        ghost, dmd = Ghost(), Dmd()
+        cache = IdentityCache()
+        cache._elements['uuid'] = ('/zport/dmd/Devices/devices/ghost', 'old')
+        cache._uuids['ghost'] = ('uuid', 0)
+        self.assertEquals(None, cache.lookup(dmd, 'ghost', lambda: None))
+        self.assertEquals(1, cache.stale)
+        self.assertEquals(None, cache._elements.get('uuid'))
+
 def test_suite():
     from unittest import TestSuite, makeSuite
     tests = []
@@ -0,0 +1,81 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2014, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+from Products.Zuul.infos.eventclasses import EventClassInfo
+
+
+class MockEvent(object):
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+
+class TestEventClassMapping(BaseTestCase):
+
+    def afterSetUp(self):
+        super(TestEventClassMapping, self).afterSetUp()
+        self.events = self.dmd.Events
+        self.org = self.events.createOrganizer('/MappingTest')
+
+    def addMapping(self, id, key, regex='', rule=''):
+        inst = self.org.createInstance(id)
+        inst.unindex_object()
+        inst.eventClassKey = key
+        inst.sequence = self.org.nextSequenceNumber(key)
+        inst.regex = regex
+        inst.rule = rule
+        inst.index_object()
+        return inst
+
+    def lookup(self, key, message=''):
+        return self.events.lookup(MockEvent(eventClassKey=key,
+                                            message=message), None)
+
+    def testSequenceOrder(self):
+        first = self.addMapping('first', 'maptest', regex='disk')
+        self.addMapping('second', 'maptest', regex='disk full')
+        self.assertEqual(first, self.lookup('maptest', 'disk full'))
+
+    def testMappingChanges(self):
+        inst = self.addMapping('inst', 'maptest', regex='^up$')
+        self.assertEqual(inst, self.lookup('maptest', 'UP'))
+        # edits that do not reindex are still seen
+        inst.regex = '^down$'
+        self.assertEqual(inst, self.lookup('maptest', 'down'))
+        self.assertNotEqual(inst, self.lookup('maptest', 'up'))
+        # new and removed mappings are seen
+        other = self.addMapping('other', 'othertest', regex='up')
+        self.assertEqual(other, self.lookup('othertest', 'up'))
+        self.org.removeInstances(['other'])
+        self.assertNotEqual(other, self.lookup('othertest', 'up'))
+
+    def testInfoSequence(self):
+        first = self.addMapping('first', 'maptest', regex='disk')
+        second = self.addMapping('second', 'maptest', regex='disk full')
+        self.assertEqual(first, self.lookup('maptest', 'disk full'))
+        # resequencing through the info rebuilds the mapping index
+        EventClassInfo(second).sequence = -1
+        self.assertEqual(second, self.lookup('maptest', 'disk full'))
+        EventClassInfo(second).eventClassKey = 'othertest'
+        self.assertEqual(first, self.lookup('maptest', 'disk full'))
+        self.assertEqual(second, self.lookup('othertest', 'disk full'))
+
+    def testRule(self):
+        inst = self.addMapping('rule', 'maptest', rule='evt.message == "x"')
+        self.assertEqual(inst, self.lookup('maptest', 'x'))
+        self.assertNotEqual(inst, self.lookup('maptest', 'y'))
+        inst.rule = 'evt.message =='
+        self.assertFalse(inst.match(MockEvent(message='x'), None))
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestEventClassMapping))
+    return suite
@@ -8,7 +8,8 @@
 ##############################################################################
 
 
-from Products.ZenEvents.SyslogProcessing import SyslogProcessor
+from Products.ZenEvents.SyslogProcessing import SyslogProcessor, \
+    ParserDispatch, compiledParsers
 from Products.ZenTestCase.BaseTestCase import BaseTestCase
 
 class SyslogProcessingTest(BaseTestCase):
@@ -104,6 +105,40 @@ class SyslogProcessingTest(BaseTestCase):
         self.assertEquals(evt.get('component'), '10/100/1000/e1a')
         self.assertEquals(evt.get('summary'), 'Client 10.0.0.101 (xid 4251521131) is trying to access an unexported mount (fileid 64, snapid 0, generation 6111516 and flags 0x0 on volume 0xc97d89a [No volume name available])')
 
+    def testParserDispatch(self):
+        """
+        The dispatcher picks the same parser as trying every parser in order
+        """
+        msgs = ("-- MARK --",
+                "%LINK-3-UPDOWN: Interface Gi0/1, changed state to down",
+                "Service Control Manager[INFO] 7036 The service started",
+                "sshd[1234]: Accepted publickey for root",
+                "kernel: eth0 link down",
+                "[deviceName: e1a:warning]: Client 10.0.0.101",
+                "no parser matches this")
+        dispatch = ParserDispatch(compiledParsers)
+        for msg in msgs:
+            for parser, keepEntry in compiledParsers:
+                expected = parser.search(msg)
+                if expected:
+                    break
+            m, keepEntry = dispatch.search(msg)
+            if expected is None:
+                self.assertEquals(m, None)
+            else:
+                self.assertEquals(m.re, expected.re)
+                self.assertEquals(m.groupdict(), expected.groupdict())
+
+    def testProcessMany(self):
+        sent = []
+        s = SyslogProcessor(sent.append, 6, False, 'localhost', 3)
+        s.processMany([("<30>sshd[1234]: Accepted", '10.0.0.1', 'a', 1.0),
+                       ("<31>debug: dropped", '10.0.0.1', 'a', 1.5),
+                       ("<30>kernel: eth0 down", '10.0.0.2', 'b', 2.0)])
+        self.assertEquals(['sshd', 'kernel'],
+                          [evt['component'] for evt in sent])
+        self.assertEquals(['a', 'b'], [evt['device'] for evt in sent])
+
 
 def test_suite():
     from unittest import TestSuite, makeSuite
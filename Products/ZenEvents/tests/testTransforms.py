@@ -12,6 +12,7 @@ from Products.ZenTestCase.BaseTestCase import BaseTestCase
 from Products.ZenEvents.zeneventd import EventPipelineProcessor
 from Products.ZenEvents.events2.processing import DropEvent
 from Products.ZenEvents.events2.proxy import EventProxy
+from Products.ZenEvents.EventClassInst import getTransformTimings
 from zenoss.protocols.protobufs.zep_pb2 import Event, STATUS_CLOSED, STATUS_SUPPRESSED, SEVERITY_ERROR,\
     SEVERITY_WARNING, SEVERITY_CLEAR
 from zenoss.protocols.protobufs.model_pb2 import DEVICE, COMPONENT
@@ -250,6 +251,32 @@ evt.device = '%s'
         self.assertEqual('transformed', processed.event.summary)
         self.assert_(isinstance(processed.event.severity, int))
 
+    def testTransformEdited(self):
+        """
+        A changed transform is recompiled and its run times are recorded.
+        """
+        self.dmd.Events.createOrganizer('/Perf/Filesystem')
+        evtclass = self.dmd.Events.Perf.Filesystem
+        evtclass.manage_editEventClassTransform('evt.summary="first"')
+
+        def process():
+            event = Event()
+            event.actor.element_identifier = 'localhost'
+            event.actor.element_type_id = DEVICE
+            event.severity = SEVERITY_ERROR
+            event.event_class = '/Perf/Filesystem'
+            event.summary = 'untransformed'
+            return self._processEvent(event).event.summary
+
+        self.assertEqual('first', process())
+        self.assertEqual('first', process())
+        evtclass.manage_editEventClassTransform('evt.summary="second"')
+        self.assertEqual('second', process())
+        evtclass.transform = 'evt.summary="third"'
+        self.assertEqual('third', process())
+        timings = getTransformTimings()['/Events/Perf/Filesystem']
+        self.assertEqual(1, timings.count)
+
     def testActionDropped(self):
         transform = 'evt._action="drop"'
         self.dmd.Events.createOrganizer('/Perf/Filesystem')
@@ -299,6 +326,35 @@ evt.device = '%s'
         processed = self._processEvent(event)
         self.assertEqual(STATUS_SUPPRESSED, processed.event.status)
 
+    def testProcessMessagesBatch(self):
+        """
+        A batch keeps the order of its events, drops the events the transform
+        drops and reports the events it cannot process.
+        """
+        device = self.dmd.Devices.createInstance('batchdevice')
+        self.dmd.Events.createOrganizer('/Perf/Filesystem')
+        self.dmd.Events.Perf.Filesystem.transform = \
+            'if evt.summary == "drop": evt._action = "drop"'
+
+        events = []
+        for summary in ('first', 'drop', 'third', None):
+            event = Event()
+            event.actor.element_identifier = device.id
+            event.actor.element_type_id = DEVICE
+            event.severity = SEVERITY_ERROR
+            event.event_class = '/Perf/Filesystem'
+            if summary:
+                event.summary = summary
+            events.append(event)
+
+        first, dropped, third, missing = self.processor.processMessages(events)
+        self.assertEqual('first', first.event.summary)
+        self.assertEqual(IGlobalIdentifier(device).getGUID(),
+                         first.event.actor.element_uuid)
+        self.assertTrue(isinstance(dropped, DropEvent))
+        self.assertEqual('third', third.event.summary)
+        self.assertTrue(isinstance(missing, DropEvent))
+
 
 def test_suite():
     from unittest import TestSuite, makeSuite
@@ -32,8 +32,9 @@ from Products.ZenMessaging.queuemessaging.QueueConsumer import QueueConsumer
 from Products.ZenEvents.events2.processing import (Manager, EventPluginPipe, CheckInputPipe, IdentifierPipe,
     AddDeviceContextAndTagsPipe, TransformAndReidentPipe, TransformPipe, UpdateDeviceContextAndTagsPipe,
     AssignDefaultEventClassAndTagPipe, FingerprintPipe, SerializeContextPipe, ClearClassRefreshPipe,
-    EventContext, DropEvent, ProcessingException, CheckHeartBeatPipe)
+    EventContext, DropEvent, ProcessingException, CheckHeartBeatPipe, identityCache)
 from Products.ZenEvents.interfaces import IPreEventPlugin, IPostEventPlugin
+from Products.ZenEvents.EventClassInst import getTransformTimings
 from Products.ZenEvents.daemonlifecycle import DaemonCreatedEvent, SigTermEvent, SigUsr1Event
 from Products.ZenEvents.daemonlifecycle import DaemonStartRunEvent, BuildOptionsEvent
 
@@ -43,6 +44,38 @@ log = logging.getLogger("zen.eventd")
 EXCHANGE_ZEP_ZEN_EVENTS = '$ZepZenEvents'
 QUEUE_RAW_ZEN_EVENTS = '$RawZenEvents'
 
+class PipeTimings(object):
+    """
+    Time spent by a pipe on the events it has handled.
+    """
+    def __init__(self):
+        self.events = 0
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, elapsed, events=1):
+        self.events += events
+        self.calls += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+    def __str__(self):
+        return '%d events in %d calls, avg %.6fs per event, max %.4fs per call' % (
+            self.events, self.calls, self.total / max(self.events, 1), self.max)
+
+
+# time spent in each pipe, by pipe name
+_pipeTimings = {}
+
+
+def getPipeTimings():
+    """
+    Return a dictionary of pipe name to the PipeTimings of the pipe.
+    """
+    return dict(_pipeTimings)
+
+
 class EventPipelineProcessor(object):
 
     SYNC_EVERY_EVENT = False
@@ -69,6 +102,8 @@ class EventPipelineProcessor(object):
             ClearClassRefreshPipe(self._manager),
             CheckHeartBeatPipe(self._manager)
         )
+        self._timings = [_pipeTimings.setdefault(pipe.name, PipeTimings())
+                         for pipe in self._pipes]
 
         if not self.SYNC_EVERY_EVENT:
             # don't call sync() more often than 1 every 0.5 sec - helps throughput
@@ -76,12 +111,7 @@ class EventPipelineProcessor(object):
             self.nextSync = datetime.now()
             self.syncInterval = timedelta(0,0,500000)
 
-    def processMessage(self, message):
-        """
-        Handles a queue message, can call "acknowledge" on the Queue Consumer
-        class when it is done with the message
-        """
-
+    def _sync(self):
         if self.SYNC_EVERY_EVENT:
             doSync = True
         else:
@@ -93,25 +123,41 @@ class EventPipelineProcessor(object):
         if doSync:
             self.dmd._p_jar.sync()
 
+    def _runPipe(self, pipe, eventContext):
+        eventContext = pipe(eventContext)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('After pipe %s, event context is %s' % ( pipe.name, to_dict(eventContext.zepRawEvent) ))
+        if eventContext.event.status == STATUS_DROPPED:
+            raise DropEvent('Dropped by %s' % pipe, eventContext.event)
+        return eventContext
+
+    def _newContext(self, message):
+        # extract event from message body
+        zepevent = ZepRawEvent()
+        zepevent.event.CopyFrom(message)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Received event: %s", to_dict(zepevent.event))
+        return EventContext(log, zepevent)
+
+    def processMessage(self, message):
+        """
+        Handles a queue message, can call "acknowledge" on the Queue Consumer
+        class when it is done with the message
+        """
+        self._sync()
+        return self._processMessage(message)
+
+    def _processMessage(self, message, retry=True):
         try:
-            retry = True
             processed = False
             while not processed:
                 try:
-                    # extract event from message body
-                    zepevent = ZepRawEvent()
-                    zepevent.event.CopyFrom(message)
-                    if log.isEnabledFor(logging.DEBUG):
-                        log.debug("Received event: %s", to_dict(zepevent.event))
+                    eventContext = self._newContext(message)
 
-                    eventContext = EventContext(log, zepevent)
-
-                    for pipe in self._pipes:
-                        eventContext = pipe(eventContext)
-                        if log.isEnabledFor(logging.DEBUG):
-                            log.debug('After pipe %s, event context is %s' % ( pipe.name, to_dict(eventContext.zepRawEvent) ))
-                        if eventContext.event.status == STATUS_DROPPED:
-                            raise DropEvent('Dropped by %s' % pipe, eventContext.event)
+                    for pipe, timings in zip(self._pipes, self._timings):
+                        start = time.time()
+                        eventContext = self._runPipe(pipe, eventContext)
+                        timings.add(time.time() - start)
 
                     processed = True
 
@@ -129,37 +175,95 @@ class EventPipelineProcessor(object):
             # we want these to propagate out
             raise
         except Exception as e:
-            log.info("Failed to process event, forward original raw event: %s", to_dict(zepevent.event))
-            # Pipes and plugins may raise ProcessingException's for their own reasons - only log unexpected
-            # exceptions of other type (will insert stack trace in log)
-            if not isinstance(e, ProcessingException):
-                log.exception(e)
-
-            # construct wrapper event to report this event processing failure (including content of the
-            # original event)
-            origzepevent = ZepRawEvent()
-            origzepevent.event.CopyFrom(message)
-            failReportEvent = dict(
-                uuid = guid.generate(),
-                created_time = int(time.time()*1000),
-                fingerprint='|'.join(['zeneventd', 'processMessage', repr(e)]),
-                # Don't send the *same* event class or we trash and and crash endlessly
-                eventClass='/',
-                summary='Internal exception processing event: %r' % e,
-                message='Internal exception processing event: %r/%s' % (e, to_dict(origzepevent.event)),
-                severity=4,
-            )
-            zepevent = ZepRawEvent()
-            zepevent.event.CopyFrom(from_dict(Event, failReportEvent))
-            eventContext = EventContext(log, zepevent)
-            eventContext.eventProxy.device = 'zeneventd'
-            eventContext.eventProxy.component = 'processMessage'
+            eventContext = self._failureContext(message, e)
 
         if log.isEnabledFor(logging.DEBUG):
             log.debug("Publishing event: %s", to_dict(eventContext.zepRawEvent))
 
         return eventContext.zepRawEvent
 
+    def _failureContext(self, message, e):
+        """
+        Returns the context of an event reporting that message could not
+        be processed because of e.
+        """
+        log.info("Failed to process event, forward original raw event: %s", to_dict(message))
+        # Pipes and plugins may raise ProcessingException's for their own reasons - only log unexpected
+        # exceptions of other type (will insert stack trace in log)
+        if not isinstance(e, ProcessingException):
+            log.exception(e)
+
+        # construct wrapper event to report this event processing failure (including content of the
+        # original event)
+        origzepevent = ZepRawEvent()
+        origzepevent.event.CopyFrom(message)
+        failReportEvent = dict(
+            uuid = guid.generate(),
+            created_time = int(time.time()*1000),
+            fingerprint='|'.join(['zeneventd', 'processMessage', repr(e)]),
+            # Don't send the *same* event class or we trash and and crash endlessly
+            eventClass='/',
+            summary='Internal exception processing event: %r' % e,
+            message='Internal exception processing event: %r/%s' % (e, to_dict(origzepevent.event)),
+            severity=4,
+        )
+        zepevent = ZepRawEvent()
+        zepevent.event.CopyFrom(from_dict(Event, failReportEvent))
+        eventContext = EventContext(log, zepevent)
+        eventContext.eventProxy.device = 'zeneventd'
+        eventContext.eventProxy.component = 'processMessage'
+        return eventContext
+
+    def processMessages(self, messages):
+        """
+        Handles a batch of queue messages. Each pipe is run over all the
+        events of the batch before the next pipe is called, and element and
+        uuid lookups are shared by the events of the batch. The database is
+        synced at most once per batch.
+
+        Returns a list with, for each message and in the same order, the
+        ZepRawEvent to publish or the DropEvent that dropped the event.
+        """
+        self._sync()
+        results = [None] * len(messages)
+        contexts = []
+        for i, message in enumerate(messages):
+            try:
+                contexts.append((i, self._newContext(message)))
+            except Exception as e:
+                results[i] = self._failureContext(message, e).zepRawEvent
+
+        with self._manager.batch():
+            for pipe, timings in zip(self._pipes, self._timings):
+                if not contexts:
+                    break
+                start = time.time()
+                remaining = []
+                for i, eventContext in contexts:
+                    try:
+                        remaining.append((i, self._runPipe(pipe, eventContext)))
+                    except DropEvent as e:
+                        results[i] = e
+                    except AttributeError:
+                        # connection to zope lost - reset and process this
+                        # event again on its own
+                        log.debug("Resetting connection to catalogs")
+                        self._manager.reset()
+                        try:
+                            results[i] = self._processMessage(messages[i], retry=False)
+                        except DropEvent as e:
+                            results[i] = e
+                    except Exception as e:
+                        results[i] = self._failureContext(messages[i], e).zepRawEvent
+                timings.add(time.time() - start, len(contexts))
+                contexts = remaining
+
+        for i, eventContext in contexts:
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("Publishing event: %s", to_dict(eventContext.zepRawEvent))
+            results[i] = eventContext.zepRawEvent
+        return results
+
 class BaseQueueConsumerTask(object):
 
     implements(IQueueConsumerTask)
@@ -208,13 +312,98 @@ class TwistedQueueConsumerTask(BaseQueueConsumerTask):
                 yield self.queueConsumer.reject(message)
 
 
+class BatchingQueueConsumerTask(TwistedQueueConsumerTask):
+    """
+    Collects the messages delivered by the queue into batches of up to
+    batchSize messages, waiting at most batchWait seconds for a batch to
+    fill, and runs each batch through the pipeline at once. Events are
+    published and messages acknowledged in the order they were received.
+    """
+
+    def __init__(self, processor, batchSize, batchWait=0.05):
+        TwistedQueueConsumerTask.__init__(self, processor)
+        self.batchSize = batchSize
+        self.batchWait = batchWait
+        self._batch = []
+        self._flushCall = None
+        self._publishLock = defer.DeferredLock()
+
+    def processMessage(self, message):
+        self._batch.append(message)
+        if len(self._batch) >= self.batchSize:
+            self.flush()
+        elif self._flushCall is None:
+            self._flushCall = reactor.callLater(self.batchWait, self.flush)
+
+    def flush(self):
+        """
+        Processes the messages collected so far. Returns a deferred that
+        fires once their events are published and the messages acknowledged.
+        """
+        if self._flushCall is not None:
+            if self._flushCall.active():
+                self._flushCall.cancel()
+            self._flushCall = None
+        messages, self._batch = self._batch, []
+        results = self._processBatch(messages) if messages else []
+        # publishing is asynchronous, the lock keeps batches in order
+        return self._publishLock.run(self._publishBatch, messages, results)
+
+    def _processBatch(self, messages):
+        """
+        Returns, for each message, the ZepRawEvent to publish, None if the
+        message is to be acknowledged without publishing anything, or the
+        exception that stopped its processing.
+        """
+        hydrated = []
+        for message in messages:
+            try:
+                hydrated.append(hydrateQueueMessage(message, self._queueSchema))
+            except Exception as e:
+                log.error("Failed to hydrate raw event: %s", e)
+                hydrated.append(None)
+        try:
+            processed = iter(self.processor.processMessages(
+                [event for event in hydrated if event is not None]))
+        except Exception as e:
+            log.exception(e)
+            return [None if event is None else e for event in hydrated]
+        return [None if event is None else next(processed) for event in hydrated]
+
+    @defer.inlineCallbacks
+    def _publishBatch(self, messages, results):
+        for message, result in zip(messages, results):
+            try:
+                if isinstance(result, DropEvent):
+                    if log.isEnabledFor(logging.DEBUG):
+                        log.debug('%s - %s' % (result.message, to_dict(result.event)))
+                elif isinstance(result, Exception):
+                    yield self.queueConsumer.reject(message)
+                    continue
+                elif result is not None:
+                    yield self.queueConsumer.publishMessage(EXCHANGE_ZEP_ZEN_EVENTS,
+                        self._routing_key(result), result, declareExchange=False)
+                yield self.queueConsumer.acknowledge(message)
+            except Exception as e:
+                log.exception(e)
+                yield self.queueConsumer.reject(message)
+
+
 class EventDTwistedWorker(object):
-    def __init__(self, dmd):
+    def __init__(self, dmd, batchSize=1, batchWait=0.05):
         super(EventDTwistedWorker, self).__init__()
         self._amqpConnectionInfo = getUtility(IAMQPConnectionInfo)
         self._queueSchema = getUtility(IQueueSchema)
-        self._consumer_task = TwistedQueueConsumerTask(EventPipelineProcessor(dmd))
+        processor = EventPipelineProcessor(dmd)
+        if batchSize > 1:
+            self._consumer_task = BatchingQueueConsumerTask(processor,
+                                                            batchSize, batchWait)
+        else:
+            self._consumer_task = TwistedQueueConsumerTask(processor)
         self._consumer = QueueConsumer(self._consumer_task, dmd)
+        if batchSize > 1:
+            # let the broker deliver a whole batch before the first ack
+            self._consumer.setPrefetch(batchSize)
 
     def run(self):
         reactor.callWhenRunning(self._start)
@@ -226,6 +415,8 @@ class EventDTwistedWorker(object):
 
     @defer.inlineCallbacks
     def _shutdown(self):
+        if isinstance(self._consumer_task, BatchingQueueConsumerTask):
+            yield self._consumer_task.flush()
         if self._consumer:
             yield self._consumer.shutdown()
 
@@ -234,6 +425,7 @@ class ZenEventD(ZCmdBase):
     def __init__(self, *args, **kwargs):
         super(ZenEventD, self).__init__(*args, **kwargs)
         EventPipelineProcessor.SYNC_EVERY_EVENT = self.options.syncEveryEvent
+        identityCache.resize(self.options.identityCacheSize)
         self._heartbeatSender = QueueHeartbeatSender('localhost',
                                                      'zeneventd',
                                                      self.options.maintenancecycle *3)
@@ -255,6 +447,11 @@ class ZenEventD(ZCmdBase):
     def sighandler_USR1(self, signum, frame):
         super(ZenEventD, self).sighandler_USR1(signum, frame)
         log.debug('sighandler_USR1 called %s' % signum)
+        log.info("Identity cache: %s", identityCache)
+        for name, timings in sorted(getPipeTimings().iteritems()):
+            log.info("Pipe %s: %s", name, timings)
+        for name, timings in sorted(getTransformTimings().iteritems()):
+            log.info("Transform %s: %s", name, timings)
         objectEventNotify(SigUsr1Event(self, signum))
 
     def buildOptions(self):
@@ -269,9 +466,29 @@ class ZenEventD(ZCmdBase):
                     help='Sets the number of messages each worker gets from the queue at any given time. Default is 1. '
                     'Change this only if event processing is deemed slow. Note that increasing the value increases the '
                     'probability that events will be processed out of order.')
+        pipelineBuildOptions(self.parser)
         objectEventNotify(BuildOptionsEvent(self))
 
 
+def pipelineBuildOptions(parser):
+    """
+    Adds the options of the event processing pipeline
+    """
+    parser.add_option('--identitycachesize', dest='identityCacheSize', default=10000,
+                type="int",
+                help='Maximum number of devices and components whose uuids are cached for identifying events. '
+                'Default is %default.')
+    parser.add_option('--batchsize', dest='batchSize', default=1,
+                type="int",
+                help='Number of events each worker runs through the processing pipeline at once. Lookups of devices '
+                'and components are shared by the events of a batch, which helps throughput during event storms. '
+                'Default is 1, which processes events one at a time.')
+    parser.add_option('--batchwait', dest='batchWait', default=0.05,
+                type="float",
+                help='Maximum number of seconds to wait for a batch of events to fill before processing it. '
+                'Default is %default.')
+
+
 
 if __name__ == '__main__':
     # explicit import of ZenEventD to activate enterprise extensions
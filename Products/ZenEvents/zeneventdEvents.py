@@ -47,12 +47,17 @@ def onDaemonStartRun(daemon, event):
     defined in zeneventd.py, because onDaemonCreated (above) removes it
     """
     from .zeneventdWorkers import EventDEventletWorker
+    from .zeneventd import EventDTwistedWorker
     # Free up unnecessary database resources in parent zeneventd process
     if daemon.options.daemon or daemon.options.cycle:
         daemon.closedb()
         daemon.closeAll()
         daemon._workers.startWorkers()
         reactor.run()
+    elif daemon.options.batchSize > 1:
+        worker = EventDTwistedWorker(daemon.dmd, daemon.options.batchSize,
+                                     daemon.options.batchWait)
+        worker.run()
     else:
         worker = EventDEventletWorker()
         worker.run()
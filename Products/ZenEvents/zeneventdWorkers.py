@@ -15,7 +15,8 @@ import time
 from amqplib.client_0_8.exceptions import AMQPConnectionException
 from zope.component import getUtility
 from Products.ZenEvents.zeneventd import BaseQueueConsumerTask, EventPipelineProcessor
-from Products.ZenEvents.zeneventd import QUEUE_RAW_ZEN_EVENTS
+from Products.ZenEvents.zeneventd import QUEUE_RAW_ZEN_EVENTS, pipelineBuildOptions
+from Products.ZenEvents.events2.processing import identityCache
 from Products.ZenMessaging.queuemessaging.eventlet import BasePubSubMessageTask
 from Products.ZenUtils.ZCmdBase import ZCmdBase
 from zenoss.protocols.interfaces import IAMQPConnectionInfo, IQueueSchema
@@ -51,6 +52,7 @@ class EventDEventletWorker(ZCmdBase):
         super(EventDEventletWorker, self).__init__()
         self._amqpConnectionInfo = getUtility(IAMQPConnectionInfo)
         self._queueSchema = getUtility(IQueueSchema)
+        identityCache.resize(self.options.identityCacheSize)
 
     def run(self):
         self._shutdown = False
@@ -73,6 +75,7 @@ class EventDEventletWorker(ZCmdBase):
                     help='Sets the number of messages each worker gets from the queue at any given time. Default is 1. '
                     'Change this only if event processing is deemed slow. Note that increasing the value increases the '
                     'probability that events will be processed out of order.')
+        pipelineBuildOptions(self.parser)
 
     def _sigterm(self, signum=None, frame=None):
         log.debug("worker sigterm...")
@@ -41,7 +41,7 @@ from Products.ZenUtils.observable import ObservableMixin
 from Products.ZenEvents.SyslogProcessing import SyslogProcessor
 
 from Products.ZenUtils.Utils import zenPath
-from Products.ZenUtils.IpUtil import asyncNameLookup
+from Products.ZenUtils.IpUtil import NameLookupCache
 
 from Products.ZenEvents.EventServer import Stats
 from Products.ZenUtils.Utils import unused
@@ -121,6 +121,17 @@ class SyslogPreferences(object):
                            action='store_true', default=False,
                            help="Don't convert the remote device's IP address to a hostname."
                            )
+        parser.add_option('--reverseLookupTTL', dest='reverseLookupTTL',
+                           default=300, type='int',
+                           help="Seconds to remember the hostname of a remote"
+                           " device's IP address. Default is %default"
+                           )
+        parser.add_option('--reverseLookupCacheSize',
+                           dest='reverseLookupCacheSize',
+                           default=10000, type='int',
+                           help="Maximum number of hostnames to remember."
+                           " Default is %default"
+                           )
 
     def postStartup(self):
         daemon = zope.component.getUtility(ICollector)
@@ -129,6 +140,8 @@ class SyslogPreferences(object):
         # add our collector's custom statistics
         statService = zope.component.queryUtility(IStatisticsService)
         statService.addStatistic("events", "COUNTER")
+        statService.addStatistic("reverseLookupHits", "COUNTER")
+        statService.addStatistic("reverseLookupMisses", "COUNTER")
 
 
 class SyslogTask(BaseTask, DatagramProtocol):
@@ -161,6 +174,12 @@ class SyslogTask(BaseTask, DatagramProtocol):
         self.options = self._daemon.options
 
         self.stats = Stats()
+        self._pending = []
+        self._lastDate = None
+        self._nameCache = NameLookupCache(
+            ttl=self.options.reverseLookupTTL,
+            negativeTtl=min(60, self.options.reverseLookupTTL),
+            maxsize=self.options.reverseLookupCacheSize)
 
         if not self.options.useFileDescriptor\
              and self.options.syslogport < 1024:
@@ -234,16 +253,23 @@ class SyslogTask(BaseTask, DatagramProtocol):
         start = stop + 1
         stop = start + len(SyslogTask.SAMPLE_DATE)
         dateField = msg[start:stop]
-        try:
-            date = time.strptime(dateField,
-                                 SyslogTask.SYSLOG_DATE_FORMAT)
-            year = time.localtime()[0]
-            date = (year, ) + date[1:]
+        # messages arriving together mostly carry the same timestamp, so
+        # the last one parsed is kept
+        if self._lastDate and self._lastDate[0] == dateField:
+            date = self._lastDate[1]
             start = stop + 1
-        except ValueError:
-
-        # date not present, so use today's date
-            date = time.localtime()
+        else:
+            try:
+                date = time.strptime(dateField,
+                                     SyslogTask.SYSLOG_DATE_FORMAT)
+                year = time.localtime()[0]
+                date = (year, ) + date[1:]
+                self._lastDate = (dateField, date)
+                start = stop + 1
+            except ValueError:
+
+            # date not present, so use today's date
+                date = time.localtime()
 
         # check for a hostname.  default to localhost if not present
         stop = msg.find(' ', start)
@@ -278,11 +304,33 @@ class SyslogTask(BaseTask, DatagramProtocol):
                 message = msg
             self.olog.info(message)
 
-        if self.options.noreverseLookup:
-            d = defer.succeed(ipaddr)
-        else:
-            d = asyncNameLookup(ipaddr)
-        d.addBoth(self.gotHostname, (msg, ipaddr, time.time()))
+        # The port reads the datagrams waiting on the socket, up to its
+        # maxThroughput, before returning to the reactor, so a call
+        # scheduled now runs once they have all been queued.
+        if not self._pending:
+            reactor.callLater(0, self.processPending)
+        self._pending.append((msg, ipaddr, time.time()))
+
+    def processPending(self):
+        """
+        Process the datagrams received since the last call, looking up the
+        name of each sending address once per batch.
+        """
+        pending, self._pending = self._pending, []
+        bySender = {}
+        for data in pending:
+            bySender.setdefault(data[1], []).append(data)
+        for ipaddr, messages in bySender.iteritems():
+            if self.options.noreverseLookup:
+                d = defer.succeed(ipaddr)
+            else:
+                d = self._nameCache.lookup(ipaddr)
+            d.addBoth(self.gotHostnames, ipaddr, messages)
+        if not self.options.noreverseLookup:
+            self._statService.getStatistic("reverseLookupHits").value = \
+                self._nameCache.hits + self._nameCache.coalesced
+            self._statService.getStatistic("reverseLookupMisses").value = \
+                self._nameCache.misses
 
     def gotHostname(self, response, data):
         """
@@ -293,13 +341,27 @@ class SyslogTask(BaseTask, DatagramProtocol):
         @param data: (msg, ipaddr, rtime)
         @type data: tuple of (string, string, datetime object)
         """
-        (msg, ipaddr, rtime) = data
+        self.gotHostnames(response, data[1], [data])
+
+    def gotHostnames(self, response, ipaddr, messages):
+        """
+        Send the events of the messages received from one address, with its
+        resolved name if possible
+
+        @param response: Twisted response
+        @type response: Twisted response
+        @param ipaddr: IP address of the remote host
+        @type ipaddr: string
+        @param messages: (msg, ipaddr, rtime) for each message
+        @type messages: list of tuples of (string, string, datetime object)
+        """
         if isinstance(response, failure.Failure):
             host = ipaddr
         else:
             host = response
         if self.processor:
-            self.processor.process(msg, ipaddr, host, rtime)
+            self.processor.processMany((msg, ipaddr, host, rtime)
+                                       for msg, ipaddr, rtime in messages)
             totalTime, totalEvents, maxTime = self.stats.report()
             stat = self._statService.getStatistic("events")
             stat.value = totalEvents
@@ -314,6 +376,8 @@ class SyslogTask(BaseTask, DatagramProtocol):
 %.5f average seconds per event
 Maximum processing time for one event was %.5f""" % (
                        (totalTime / totalEvents), maxTime)
+        if not self.options.noreverseLookup:
+            display += "\nReverse lookup cache: %s" % self._nameCache
         return display
 
     def cleanup(self):
@@ -44,6 +44,7 @@ from Products.ZenCollector.tasks import SimpleTaskFactory,\
                                         SimpleTaskSplitter,\
                                         BaseTask, TaskStates
 from Products.ZenUtils.observable import ObservableMixin
+from Products.ZenUtils.OidTrie import OidTrie
 
 
 from pynetsnmp import netsnmp, twistedsnmp
@@ -147,9 +148,10 @@ class SnmpTrapPreferences(CaptureReplay):
         self.buildCaptureReplayOptions(parser)
 
     def postStartup(self):
-        # Ensure that we always have an oidMap
+        # Ensure that we always have an oidMap and its trie
         daemon = zope.component.getUtility(ICollector)
         daemon.oidMap = {}
+        daemon.oidTrie = OidTrie()
         # add our collector's custom statistics
         statService = zope.component.queryUtility(IStatisticsService)
         statService.addStatistic("events", "COUNTER")
@@ -193,7 +195,7 @@ class TrapTask(BaseTask, CaptureReplay):
         # For compatibility with captureReplay
         self.options = self._daemon.options
 
-        self.oidMap = self._daemon.oidMap
+        self.oidTrie = self._daemon.oidTrie
         self.stats = Stats()
 
         # Command-line argument sanity checking
@@ -349,29 +351,12 @@ class TrapTask(BaseTask, CaptureReplay):
         @return: Twisted deferred object
         @rtype: Twisted deferred object
         """
-        if isinstance(oid, tuple):
-            oid = '.'.join(map(str, oid))
-
-        oid = oid.strip('.')
-        if exactMatch:
-            if oid in self.oidMap:
-                return self.oidMap[oid]
-            else:
-                return oid
-
-        oidlist = oid.split('.')
-        for i in range(len(oidlist), 0, -1):
-            name = self.oidMap.get('.'.join(oidlist[:i]), None)
-            if name is None:
-                continue
-
-            oid_trail = oidlist[i:]
-            if len(oid_trail) > 0 and not strip:
-                return "%s.%s" % (name, '.'.join(oid_trail))
-            else:
-                return name
-
-        return oid
+        name = self.oidTrie.oid2name(oid, exactMatch, strip)
+        if name is None:
+            if isinstance(oid, tuple):
+                return '.'.join(map(str, oid))
+            return oid.strip('.')
+        return name
 
     def _pre_parse(self, session, transport, transport_data, transport_data_length):
         """Called before the net-snmp library parses the PDU. In the case
@@ -748,6 +733,9 @@ class MibConfigTask(ObservableMixin):
         self._daemon = zope.component.getUtility(ICollector)
 
         self._daemon.oidMap = self._preferences.oidMap
+        added, removed = self._daemon.oidTrie.sync(self._preferences.oidMap)
+        log.debug("OID map updated: %d OIDs added or renamed, %d removed",
+                  added, removed)
 
     def doTask(self):
         return defer.succeed("Already updated OID -> name mappings...")
@@ -20,10 +20,10 @@ import sys
 import time
 import traceback
 import os
+import shutil
 
 from urlparse import urlparse
 from hashlib import sha1
-from itertools import chain
 from functools import partial
 from Products.ZenHub.metricpublisher import publisher
 from twisted.cred import credentials
@@ -191,6 +191,33 @@ class BaseEventQueue(object):
         """
         raise NotImplementedError()
 
+    def popall(self):
+        """
+        Removes all the events from the queue.
+
+        @return: A tuple of the list of events, oldest first, and the list
+                 of their keys to pass back to requeue (None if the queue
+                 does not key its events).
+        @rtype: tuple
+        """
+        raise NotImplementedError()
+
+    def requeue(self, events, keys=None):
+        """
+        Appends the events to the beginning of the queue (they will be the
+        first ones removed with calls to popleft). The list of events are
+        expected to be in order, with the earliest queued events listed
+        first. The cost is proportional to the number of events requeued.
+
+        @param events: The events to add to the beginning of the queue.
+        @type events: list
+        @param keys: The keys returned with the events by popall, if any.
+        @type keys: list
+        @return A list of discarded events that didn't fit on the queue.
+        @rtype list
+        """
+        raise NotImplementedError()
+
     def extendleft(self, events):
         """
         Appends the events to the beginning of the queue (they will be the
@@ -203,7 +230,7 @@ class BaseEventQueue(object):
         @return A list of discarded events that didn't fit on the queue.
         @rtype list
         """
-        raise NotImplementedError()
+        return self.requeue(events)
 
     def __len__(self):
         """
@@ -245,7 +272,12 @@ class DequeEventQueue(BaseEventQueue):
     def popleft(self):
         return self.queue.popleft()
 
-    def extendleft(self, events):
+    def popall(self):
+        events = list(self.queue)
+        self.queue.clear()
+        return events, None
+
+    def requeue(self, events, keys=None):
         if not events:
             return events
         available = self.maxlen - len(self.queue)
@@ -266,10 +298,16 @@ class DequeEventQueue(BaseEventQueue):
 
 class DeDupingEventQueue(BaseEventQueue):
     """
-    Event queue implementation backed by a OrderedDict. This queue performs
-    de-duplication of events (when an event with the same fingerprint is
-    seen, the 'count' field of the event is incremented by one instead of
-    sending an additional event).
+    Event queue implementation that performs de-duplication of events (when
+    an event with the same fingerprint is seen, the 'count' field of the
+    event is incremented by one instead of sending an additional event).
+
+    Queued events are kept by fingerprint, with a serial number, and the
+    order of the queue is a deque of (fingerprint, serial) entries. An event
+    that is replaced by a duplicate leaves its old entry behind, which is
+    skipped because its serial no longer matches; the deque is compacted
+    when such entries outnumber the events. This makes requeueing events
+    at the front of the queue as cheap as appending them.
     """
 
     def __init__(self, maxlen):
@@ -277,7 +315,9 @@ class DeDupingEventQueue(BaseEventQueue):
         self.default_fingerprinter = DefaultFingerprintGenerator()
         self.fingerprinters = \
             _load_utilities(ICollectorEventFingerprintGenerator)
-        self.queue = collections.OrderedDict()
+        self._events = {}
+        self._order = collections.deque()
+        self._serial = 0
 
     def _event_fingerprint(self, event):
         for fingerprinter in self.fingerprinters:
@@ -293,78 +333,244 @@ class DeDupingEventQueue(BaseEventQueue):
         first = lambda evt: evt.get('firstTime', evt['rcvtime'])
         return min(first(event1), first(event2))
 
+    def _entry(self, fingerprint, event):
+        self._serial += 1
+        self._events[fingerprint] = (event, self._serial)
+        return fingerprint, self._serial
+
+    def _current(self):
+        """
+        Returns the (fingerprint, event) pairs of the queue, oldest first.
+        """
+        events = self._events
+        for fingerprint, serial in self._order:
+            current = events.get(fingerprint)
+            if current is not None and current[1] == serial:
+                yield fingerprint, current[0]
+
+    def _compact(self):
+        self._order = collections.deque(
+            (fingerprint, self._events[fingerprint][1])
+            for fingerprint, event in self._current())
+
     def append(self, event):
         # Make sure every processed event specifies the time it was queued.
         if not 'rcvtime' in event:
             event['rcvtime'] = time.time()
 
         fingerprint = self._event_fingerprint(event)
-        if fingerprint in self.queue:
-            # Remove the currently queued item - we will insert again which
-            # will move to the end.
-            current_event = self.queue.pop(fingerprint)
+        discarded = None
+        current = self._events.get(fingerprint)
+        if current is not None:
+            # Replace the currently queued item, the new one goes to the end
+            current_event = current[0]
             event['count'] = current_event.get('count', 1) + 1
             event['firstTime'] = self._first_time(current_event, event)
-            self.queue[fingerprint] = event
-            return
-
-        discarded = None
-        if len(self.queue) == self.maxlen:
+        elif len(self._events) == self.maxlen:
             discarded = self.popleft()
 
-        self.queue[fingerprint] = event
+        self._order.append(self._entry(fingerprint, event))
+        if len(self._order) > 2 * len(self._events) + 100:
+            self._compact()
         return discarded
 
     def popleft(self):
-        try:
-            return self.queue.popitem(last=False)[1]
-        except KeyError:
-            # Re-raise KeyError as IndexError for common interface across
-            # queues.
-            raise IndexError()
+        order, events = self._order, self._events
+        while order:
+            fingerprint, serial = order.popleft()
+            current = events.get(fingerprint)
+            if current is not None and current[1] == serial:
+                del events[fingerprint]
+                return current[0]
+        raise IndexError()
+
+    def popall(self):
+        fingerprints, events = [], []
+        for fingerprint, event in self._current():
+            fingerprints.append(fingerprint)
+            events.append(event)
+        self._events = {}
+        self._order = collections.deque()
+        return events, fingerprints
+
+    def requeue(self, events, keys=None):
+        if keys is None:
+            keys = [self._event_fingerprint(event) for event in events]
 
-    def extendleft(self, events):
         # Attempt to de-duplicate with events currently in queue
-        events_to_add = []
-        for event in events:
-            fingerprint = self._event_fingerprint(event)
-            if fingerprint in self.queue:
-                current_event = self.queue[fingerprint]
+        to_add = []
+        for fingerprint, event in zip(keys, events):
+            current = self._events.get(fingerprint)
+            if current is not None:
+                current_event = current[0]
                 current_event['count'] = current_event.get('count', 1) + 1
                 current_event['firstTime'] = self._first_time(current_event, event)
             else:
-                events_to_add.append(event)
+                to_add.append((fingerprint, event))
 
-        if not events_to_add:
-            return events_to_add
-        available = self.maxlen - len(self.queue)
-        if not available:
-            return events_to_add
-        to_discard = 0
-        if available < len(events_to_add):
-            to_discard = len(events_to_add) - available
-        old_queue, self.queue = self.queue, collections.OrderedDict()
-        for event in events_to_add[to_discard:]:
-            self.queue[self._event_fingerprint(event)] = event
-        for fingerprint, event in old_queue.iteritems():
-            self.queue[fingerprint] = event
-        return events_to_add[:to_discard]
+        available = self.maxlen - len(self._events)
+        to_discard = max(len(to_add) - available, 0)
+        for fingerprint, event in reversed(to_add[to_discard:]):
+            self._order.appendleft(self._entry(fingerprint, event))
+        return [event for fingerprint, event in to_add[:to_discard]]
 
     def __len__(self):
-        return len(self.queue)
+        return len(self._events)
 
     def __iter__(self):
-        return self.queue.itervalues()
+        return (event for fingerprint, event in self._current())
+
+
+class EventSpill(object):
+    """
+    Keeps the events that overflow the event queues in a file until they
+    can be sent, instead of discarding them. Events are read back in the
+    order they were written, and only forgotten once they have been sent.
+
+    The position of the oldest unsent event is kept in a small file next to
+    the spill file, so a restart does not send the same events again, and the
+    sent events are dropped from the spill file once they make up half of it.
+    """
+
+    def __init__(self, path, maxlen, log):
+        self.path = path
+        self.offsetPath = path + '.offset'
+        self.maxlen = maxlen
+        self.log = log
+        self._offset = 0
+        self._count = 0
+        # pick up the events left by a previous run
+        if os.path.exists(path):
+            self._offset = self._loadOffset()
+            try:
+                with open(path, 'rb') as f:
+                    f.seek(self._offset)
+                    while True:
+                        pickle.load(f)
+                        self._count += 1
+            except EOFError:
+                pass
+            except Exception as ex:
+                self.log.warn("Ignoring the unreadable end of %s: %s", path, ex)
+            if self._count:
+                self.log.info("Found %d spilled events in %s", self._count, path)
+            else:
+                self._remove()
+
+    def extend(self, events):
+        """
+        Writes the events to the file.
+
+        @return: The events that did not fit.
+        @rtype: list
+        """
+        room = min(max(self.maxlen - self._count, 0), len(events))
+        if not room:
+            return events
+        try:
+            with open(self.path, 'ab') as f:
+                for event in events[:room]:
+                    pickle.dump(event, f, pickle.HIGHEST_PROTOCOL)
+        except Exception as ex:
+            self.log.error("Unable to spill events to %s: %s", self.path, ex)
+            return events
+        self._count += room
+        return events[room:]
+
+    def read(self, count):
+        """
+        Reads up to count of the oldest events without removing them.
+
+        @return: A tuple of the events and the position to pass to advance
+                 once they are sent.
+        """
+        events = []
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(self._offset)
+                for i in xrange(min(count, self._count)):
+                    events.append(pickle.load(f))
+                return events, f.tell()
+        except Exception as ex:
+            self.log.error("Dropping %d unreadable spilled events from %s: %s",
+                           self._count, self.path, ex)
+            self._count = 0
+            self._remove()
+            return [], 0
+
+    def advance(self, position, count):
+        """
+        Forgets the count events read before position.
+        """
+        self._count = max(self._count - count, 0)
+        self._offset = position
+        if not self._count:
+            self._remove()
+            return
+        try:
+            if position * 2 >= os.path.getsize(self.path):
+                self._compact()
+            else:
+                self._saveOffset()
+        except Exception as ex:
+            self.log.error("Unable to record the sent events in %s: %s",
+                           self.path, ex)
+
+    def _loadOffset(self):
+        """
+        Returns the offset saved by a previous run, or 0 if it was saved for
+        another spill file, e.g. one replaced by _compact.
+        """
+        try:
+            with open(self.offsetPath) as f:
+                inode, offset = map(int, f.read().split())
+            stat = os.stat(self.path)
+            if inode == stat.st_ino and offset <= stat.st_size:
+                return offset
+        except Exception:
+            pass
+        return 0
+
+    def _saveOffset(self):
+        data = '%d %d' % (os.stat(self.path).st_ino, self._offset)
+        atomicWrite(self.offsetPath, data)
+
+    def _compact(self):
+        """
+        Replaces the spill file with one holding only the unsent events.
+        The new file has a new inode, so the old offset no longer applies
+        to it even if saving the new one fails.
+        """
+        tmpPath = self.path + '.tmp'
+        with open(self.path, 'rb') as src:
+            src.seek(self._offset)
+            with open(tmpPath, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+        os.rename(tmpPath, self.path)
+        self._offset = 0
+        self._saveOffset()
+
+    def _remove(self):
+        self._offset = 0
+        for path in (self.path, self.offsetPath):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def __len__(self):
+        return self._count
 
 
 class EventQueueManager(object):
 
     CLEAR_FINGERPRINT_FIELDS = ('device','component','eventKey','eventClass')
 
-    def __init__(self, options, log):
+    def __init__(self, options, log, spill=None):
         self.options = options
         self.transformers = _load_utilities(ICollectorEventTransformer)
         self.log = log
+        self.spill = spill
         self.discarded_events = 0
         # TODO: Do we want to limit the size of the clear event dictionary?
         self.clear_events_count = {}
@@ -419,6 +625,18 @@ class EventQueueManager(object):
                 if clear_fingerprint in self.clear_events_count:
                     self.clear_events_count[clear_fingerprint] -= 1
 
+    def _discard(self, events):
+        """
+        Spills the events that overflowed a queue, if there is room on disk,
+        and discards the others.
+        """
+        if self.spill is not None:
+            events = self.spill.extend(events)
+        for discarded in events:
+            self.log.debug("Discarded event - queue overflow: %r", discarded)
+            self._removeDiscardedEventFromClearState(discarded)
+        self.discarded_events += len(events)
+
     def _addEvent(self, queue, event):
         if self._transformEvent(event) is None:
             return
@@ -449,9 +667,7 @@ class EventQueueManager(object):
         self.log.debug("Queued event (total of %d) %r", len(self.event_queue),
                        event)
         if discarded:
-            self.log.debug("Discarded event - queue overflow: %r", discarded)
-            self._removeDiscardedEventFromClearState(discarded)
-            self.discarded_events += 1
+            self._discard([discarded])
 
     def addEvent(self, event):
         self._addEvent(self.event_queue, event)
@@ -464,63 +680,46 @@ class EventQueueManager(object):
 
     @defer.inlineCallbacks
     def sendEvents(self, event_sender_fn):
-        # Create new queues - we will flush the current queues and don't want to
-        # get in a loop sending events that are queued while we send this batch
-        # (the event sending is asynchronous).
-        prev_heartbeat_event_queue = self.heartbeat_event_queue
-        prev_perf_event_queue = self.perf_event_queue
-        prev_event_queue = self.event_queue
-        self._initQueues()
-
-        perf_events = []
-        events = []
+        # Take the queued events - events queued while we send this batch (the
+        # event sending is asynchronous) are left for the next call.
+        heartbeat_events = list(self.heartbeat_event_queue)
+        self.heartbeat_event_queue.clear()
+        perf_events, perf_keys = self.perf_event_queue.popall()
+        events, keys = self.event_queue.popall()
+        chunksize = self.options.eventflushchunksize
+
+        # Heartbeats go first, then the spilled events, which are the oldest,
+        # then performance events and events.
+        queued = heartbeat_events + perf_events + events
+        sent = 0
         try:
-            def chunk_events():
-                chunk_remaining = self.options.eventflushchunksize
-                heartbeat_events = []
-                num_heartbeat_events = min(chunk_remaining,
-                    len(prev_heartbeat_event_queue))
-                for i in xrange(num_heartbeat_events):
-                    heartbeat_events.append(prev_heartbeat_event_queue.popleft())
-                chunk_remaining -= num_heartbeat_events
-
-                perf_events = []
-                num_perf_events = min(chunk_remaining,
-                    len(prev_perf_event_queue))
-                for i in xrange(num_perf_events):
-                    perf_events.append(prev_perf_event_queue.popleft())
-                chunk_remaining -= num_perf_events
-
-                events = []
-                num_events = min(chunk_remaining, len(prev_event_queue))
-                for i in xrange(num_events):
-                    events.append(prev_event_queue.popleft())
-                return heartbeat_events, perf_events, events
-
-            heartbeat_events, perf_events, events = chunk_events()
-            while heartbeat_events or perf_events or events:
-                self.log.debug(
-                    "Sending %d events, %d perf events, %d heartbeats",
-                    len(events), len(perf_events), len(heartbeat_events))
-                yield event_sender_fn(heartbeat_events + perf_events + events)
-                heartbeat_events, perf_events, events = chunk_events()
+            while self.spill:
+                head = heartbeat_events if not sent else []
+                spilled, position = self.spill.read(chunksize - len(head))
+                if not spilled:
+                    break
+                self.log.debug("Sending %d spilled events", len(spilled))
+                yield event_sender_fn(head + spilled)
+                sent += len(head)
+                self.spill.advance(position, len(spilled))
+
+            while sent < len(queued):
+                chunk = queued[sent:sent + chunksize]
+                self.log.debug("Sending %d events", len(chunk))
+                yield event_sender_fn(chunk)
+                sent += len(chunk)
 
         except Exception:
-            # Restore performance events that failed to send
-            perf_events.extend(prev_perf_event_queue)
-            discarded_perf_events = self.perf_event_queue.extendleft(perf_events)
-            self.discarded_events += len(discarded_perf_events)
-
-            # Restore events that failed to send
-            events.extend(prev_event_queue)
-            discarded_events = self.event_queue.extendleft(events)
-            self.discarded_events += len(discarded_events)
-
-            # Remove any clear state for events that were discarded
-            for discarded in chain(discarded_perf_events, discarded_events):
-                self.log.debug("Discarded event - queue overflow: %r",
-                               discarded)
-                self._removeDiscardedEventFromClearState(discarded)
+            # Restore performance events and events that failed to send
+            sent_perf = max(sent - len(heartbeat_events), 0)
+            sent_events = max(sent_perf - len(perf_events), 0)
+            sent_perf = min(sent_perf, len(perf_events))
+            self._discard(self.perf_event_queue.requeue(
+                perf_events[sent_perf:],
+                perf_keys[sent_perf:] if perf_keys is not None else None))
+            self._discard(self.event_queue.requeue(
+                events[sent_events:],
+                keys[sent_events:] if keys is not None else None))
             raise
 
     @property
@@ -559,7 +758,11 @@ class PBDaemon(ZenDaemon, pb.Referenceable):
         self.lastStats = 0
         self.perspective = None
         self.services = {}
-        self.eventQueueManager = EventQueueManager(self.options, self.log)
+        spill = None
+        if self.options.maxspilledevents > 0:
+            spill = EventSpill(zenPath('var/%s_events.spill' % self.name),
+                               self.options.maxspilledevents, self.log)
+        self.eventQueueManager = EventQueueManager(self.options, self.log, spill)
         self.startEvent = startEvent.copy()
         self.stopEvent = stopEvent.copy()
         details = dict(component=self.name, device=self.options.monitor)
@@ -591,7 +794,10 @@ class PBDaemon(ZenDaemon, pb.Referenceable):
                 port = publisher.defaultRedisPort
             self._publisher = publisher.RedisListPublisher(
                 host, port, self.options.metricBufferSize,
-                channel=self.options.metricsChannel, maxOutstandingMetrics=self.options.maxOutstandingMetrics
+                channel=self.options.metricsChannel, maxOutstandingMetrics=self.options.maxOutstandingMetrics,
+                connections=self.options.metricConnections,
+                batchSize=self.options.metricBatchSize,
+                maxFlushes=self.options.maxMetricFlushes
             )
         return self._publisher
 
@@ -614,14 +820,15 @@ class PBDaemon(ZenDaemon, pb.Referenceable):
                   internal_metric_filter = lambda metric, value, timestamp, tags:\
                       tags and tags.get("internal", False)
                   internal_metric_writer = FilteredMetricWriter(internal_publisher, internal_metric_filter)
-                  self._metric_writer = AggregateMetricWriter( [metric_writer, internal_metric_writer])
-            else:
-                self._metric_writer = metric_writer
+                  metric_writer = AggregateMetricWriter( [metric_writer, internal_metric_writer])
+            self._metric_writer = metric_writer
         return self._metric_writer
 
     def derivativeTracker(self):
-        if not self._derivative_tracker:
-            self._derivative_tracker = DerivativeTracker()
+        if self._derivative_tracker is None:
+            self._derivative_tracker = self.loadDerivatives()
+            self._derivative_tracker.max_idle_cycles = \
+                self.options.derivativeIdleCycles
         return self._derivative_tracker
 
     def connecting(self):
@@ -745,12 +952,12 @@ class PBDaemon(ZenDaemon, pb.Referenceable):
 
 
     def _getThresholdNotifier(self):
-        if not self._threshold_notifier:
+        if self._threshold_notifier is None:
             self._threshold_notifier = ThresholdNotifier(self.sendEvent, self.getThresholds())
         return self._threshold_notifier
 
     def getThresholds(self):
-        if not self._thresholds:
+        if self._thresholds is None:
             self._thresholds = Thresholds()
         return self._thresholds
 
@@ -794,6 +1001,7 @@ class PBDaemon(ZenDaemon, pb.Referenceable):
         if self.stopped:
             return
         self.stopped = True
+        self.saveDerivatives()
         if 'EventService' in self.services:
             # send stop event if we don't have an implied --cycle,
             # or if --cycle has been specified
@@ -850,6 +1058,9 @@ class PBDaemon(ZenDaemon, pb.Referenceable):
             self.lastStats = now
             self.rrdStats.gauge(
                 'eventQueueLength', self.eventQueueManager.event_queue_length)
+            if self.eventQueueManager.spill is not None:
+                self.rrdStats.gauge(
+                    'eventSpillLength', len(self.eventQueueManager.spill))
 
     @defer.inlineCallbacks
     def pushEvents(self):
@@ -911,6 +1122,15 @@ class PBDaemon(ZenDaemon, pb.Referenceable):
         # persist counters values
         self.saveCounters()
 
+        # report on metric publishing so that stalls are visible
+        if self._publisher is not None:
+            self.rrdStats.gauge('metricQueueLength', self._publisher.queueLength)
+            self.rrdStats.gauge('metricPublishLatency',
+                                self._publisher.lastLatency * 1000)
+            self.rrdStats.gauge('metricPublishPaused', int(self._publisher.paused))
+            self.rrdStats.counter('metricsPublished', self._publisher.published)
+            self.rrdStats.counter('metricPublishFailures', self._publisher.failed)
+
     def saveCounters(self):
         atomicWrite(
             zenPath('var/%s_counters.pickle' % self.name),
@@ -924,6 +1144,24 @@ class PBDaemon(ZenDaemon, pb.Referenceable):
         except Exception:
             pass
 
+    def saveDerivatives(self):
+        if self._derivative_tracker is None:
+            return
+        atomicWrite(
+            zenPath('var/%s_derivatives.pickle' % self.name),
+            pickle.dumps(self._derivative_tracker, pickle.HIGHEST_PROTOCOL),
+            raiseException=False,
+        )
+
+    def loadDerivatives(self):
+        try:
+            tracker = pickle.load(open(zenPath('var/%s_derivatives.pickle' % self.name), 'rb'))
+            if isinstance(tracker, DerivativeTracker):
+                return tracker
+        except Exception:
+            pass
+        return DerivativeTracker()
+
     def remote_getName(self):
         return self.name
 
@@ -1013,6 +1251,23 @@ class PBDaemon(ZenDaemon, pb.Referenceable):
                                type='int',
                                help='Maximum number of events to queue')
 
+        self.parser.add_option('--maxspilledevents',
+                               dest='maxspilledevents',
+                               default=0,
+                               type='int',
+                               help='Maximum number of events to keep on disk '
+                               'when more than maxqueuelen events are queued, '
+                               'instead of discarding them. 0 discards them')
+
+        self.parser.add_option('--derivativeidlecycles',
+                               dest='derivativeIdleCycles',
+                               default=10,
+                               type='int',
+                               help='Number of its own collection intervals '
+                               'after which the last value of a COUNTER or '
+                               'DERIVE metric that is no longer collected is '
+                               'forgotten, 0 to never forget')
+
         self.parser.add_option('--zenhubpinginterval',
                                dest='zhPingInterval',
                                default=30,
@@ -1046,4 +1301,19 @@ class PBDaemon(ZenDaemon, pb.Referenceable):
                                type='int',
                                default=publisher.defaultMaxOutstandingMetrics,
                                help='Max Number of metrics to allow in redis')
+        self.parser.add_option('--metricConnections',
+                               dest='metricConnections',
+                               type='int',
+                               default=publisher.defaultRedisConnections,
+                               help='Number of redis connections used to publish metrics')
+        self.parser.add_option('--metricBatchSize',
+                               dest='metricBatchSize',
+                               type='int',
+                               default=publisher.defaultMetricBatchSize,
+                               help='Max number of metrics sent to redis in one batch')
+        self.parser.add_option('--maxMetricFlushes',
+                               dest='maxMetricFlushes',
+                               type='int',
+                               default=publisher.defaultMaxFlushes,
+                               help='Max number of metric batches in flight to redis at once')
         ZenDaemon.buildOptions(self)
@@ -11,8 +11,10 @@
 import re
 from hashlib import md5
 import logging
-from cStringIO import StringIO
 from zope.interface import implements
+from Acquisition import aq_base
+from ZODB.POSException import POSKeyError
+from ZODB.utils import p64, u64
 from Products.ZenModel.DeviceClass import DeviceClass
 from Products.ZenModel.IpAddress import IpAddress
 from Products.ZenModel.IpNetwork import IpNetwork
@@ -21,7 +23,6 @@ from Products.ZenModel.OSProcessClass import OSProcessClass
 from Products.ZenModel.GraphDefinition import GraphDefinition
 from Products.ZenModel.GraphPoint import GraphPoint
 from Products.ZenModel.Software import Software
-from Products.Zuul.interfaces import ICatalogTool
 
 from .interfaces import IInvalidationFilter, FILTER_EXCLUDE, FILTER_CONTINUE
 
@@ -49,7 +50,11 @@ class IgnorableClassesFilter(object):
 class BaseOrganizerFilter(object):
     """
     Base invalidation filter for organizers. Calculates a checksum for
-    the organizer based on its sorted z/c properties.
+    the organizer based on the z/c properties defined on it. Inherited
+    values are not read: changing them invalidates the organizer that
+    defines them. Nothing is loaded at startup: the first time an organizer
+    is seen, its checksum is compared with the one of the revision that was
+    current when the filter was initialized.
     """
     implements(IInvalidationFilter)
 
@@ -58,125 +63,95 @@ class BaseOrganizerFilter(object):
 
     def __init__(self, types):
         self._types = types
-
-    def getRoot(self, context):
-        return context.dmd.primaryAq()
+        self._initializedTid = None
+        self.checksum_map = {}
 
     def initialize(self, context):
-        root = self.getRoot(context)
-        brains = ICatalogTool(root).search(self._types)
-        results = {}
-        for brain in brains:
-            try:
-                obj = brain.getObject()
-                results[brain.getPath()] = self.organizerChecksum(obj)
-            except KeyError:
-                log.warn("Unable to retrieve object: %s", brain.getPath())
-        self.checksum_map = results
-
-    def getZorCProperties(self, organizer):
-        for zId in sorted(organizer.zenPropertyIds(pfilt=self.iszorcustprop)):
-            try:
-                if organizer.zenPropIsPassword(zId):
-                    propertyString = organizer.getProperty(zId, '')
-                else:
-                    propertyString = organizer.zenPropertyString(zId)
-                yield zId, propertyString
-            except AttributeError:
-                # ZEN-3666: If an attribute error is raised on a zProperty assume it was produced by a zenpack
-                # install whose daemons haven't been restarted and continue excluding the offending property.
-                log.debug("Excluding '%s' property", zId)
-
-    def generateChecksum(self, organizer, md5_checksum):
-        # Checksum all zProperties and custom properties
-        for zId, propertyString in self.getZorCProperties(organizer):
-            md5_checksum.update('%s|%s' % (zId, propertyString))
+        self._initializedTid = context.dmd._p_jar.db().lastTransaction()
+        self.checksum_map = {}
+
+    def checksumProperty(self, propId):
+        return self.iszorcustprop(propId)
 
     def organizerChecksum(self, organizer):
         m = md5()
-        self.generateChecksum(organizer, m)
+        for propId in sorted(prop['id'] for prop in organizer._properties):
+            if self.checksumProperty(propId):
+                m.update('%s|%s' % (propId, getattr(organizer, propId, '')))
         return m.hexdigest()
 
+    def initialChecksum(self, organizer):
+        """
+        Return the checksum of the organizer as it was when the filter was
+        initialized, or None if it did not exist yet or the storage no
+        longer has that revision.
+        """
+        jar, oid = organizer._p_jar, organizer._p_oid
+        if self._initializedTid is None or jar is None or oid is None:
+            return None
+        try:
+            revision = jar.db().storage.loadBefore(
+                oid, p64(u64(self._initializedTid) + 1))
+            if revision is None:
+                return None
+            state = jar.oldstate(organizer, revision[1])
+        except POSKeyError:
+            return None
+        cls = aq_base(organizer).__class__
+        initial = cls.__new__(cls)
+        initial.__setstate__(state)
+        return self.organizerChecksum(initial)
+
     def include(self, obj):
         # Move on if it's not one of our types
         if not isinstance(obj, self._types):
             return FILTER_CONTINUE
 
-        # Checksum the device class
+        # Checksum the organizer
         current_checksum = self.organizerChecksum(obj)
         organizer_path = '/'.join(obj.getPrimaryPath())
 
         # Get what we have right now and compare
         existing_checksum = self.checksum_map.get(organizer_path)
+        if existing_checksum is None:
+            existing_checksum = self.initialChecksum(obj)
         if current_checksum != existing_checksum:
             log.debug('%r has a new checksum! Including.', obj)
             self.checksum_map[organizer_path] = current_checksum
             return FILTER_CONTINUE
+        self.checksum_map[organizer_path] = current_checksum
         log.debug('%r checksum unchanged. Skipping.', obj)
         return FILTER_EXCLUDE
 
 
 class DeviceClassInvalidationFilter(BaseOrganizerFilter):
     """
-    Subclass of BaseOrganizerFilter with specific logic for
-    Device classes. Uses both z/c properties as well as locally
-    bound RRD templates to create the checksum.
+    Subclass of BaseOrganizerFilter for Device classes. Template bindings
+    are z properties; changes to template contents invalidate the templates
+    themselves.
     """
 
     def __init__(self):
         super(DeviceClassInvalidationFilter, self).__init__((DeviceClass,))
 
-    def getRoot(self, context):
-        return context.dmd.Devices.primaryAq()
-
-    def generateChecksum(self, organizer, md5_checksum):
-        """
-        Generate a checksum representing the state of the device class as it
-        pertains to configuration. This takes into account templates and
-        zProperties, nothing more.
-        """
-        s = StringIO()
-        # Checksum includes all bound templates
-        for tpl in organizer.rrdTemplates():
-            s.seek(0)
-            s.truncate()
-            # TODO: exportXml is a bit of a hack. Sorted, etc. would be better.
-            tpl.exportXml(s)
-            md5_checksum.update(s.getvalue())
-        # Include z/c properties from base class
-        super(DeviceClassInvalidationFilter, self).generateChecksum(organizer, md5_checksum)
-
 
 class OSProcessOrganizerFilter(BaseOrganizerFilter):
     """
-    Invalidation filter for OSProcessOrganizer objects. This filter only
-    looks at z/c properties defined on the organizer.
+    Invalidation filter for OSProcessOrganizer objects.
     """
 
     def __init__(self):
         super(OSProcessOrganizerFilter, self).__init__((OSProcessOrganizer,))
 
-    def getRoot(self, context):
-        return context.dmd.Processes.primaryAq()
-
 
 class OSProcessClassFilter(BaseOrganizerFilter):
     """
-    Invalidation filter for OSProcessClass objects. This filter uses
-    z/c properties as well as local _properties defined on the organizer
-    to create a checksum.
+    Invalidation filter for OSProcessClass objects. The checksum also
+    covers the local _properties, such as the matching regexes.
     """
 
     def __init__(self):
         super(OSProcessClassFilter, self).__init__((OSProcessClass,))
 
-    def getRoot(self, context):
-        return context.dmd.Processes.primaryAq()
-
-    def generateChecksum(self, organizer, md5_checksum):
-        # Include properties of OSProcessClass
-        for prop in organizer._properties:
-            prop_id = prop['id']
-            md5_checksum.update("%s|%s" % (prop_id, getattr(organizer, prop_id, '')))
-        # Include z/c properties from base class
-        super(OSProcessClassFilter, self).generateChecksum(organizer, md5_checksum)
+    def checksumProperty(self, propId):
+        return True
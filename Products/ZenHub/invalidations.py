@@ -9,6 +9,7 @@
 
 
 import logging
+import time
 from zope.interface import implements, providedBy
 from zope.component import adapter, getGlobalSiteManager
 from twisted.internet import defer, reactor, task
@@ -22,41 +23,38 @@ from .zodb import UpdateEvent, DeletionEvent
 
 log = logging.getLogger('zen.ZenHub')
 
-@defer.inlineCallbacks
-def betterObjectEventNotify(event):
+def notifyBatch(events):
     """
-    This method re-implements zope.component.event.objectEventNotify to give
-    more time back to the reactor. It is slightly different, but works exactly
-    the same for our specific use case.
+    Fire the subscribers for a batch of invalidation events synchronously,
+    giving time back to the reactor once for the whole batch rather than once
+    per subscriber per event. A failing subscriber is logged and does not
+    prevent the remaining events from being delivered.
     """
     gsm = getGlobalSiteManager()
-    subscriptions = gsm.adapters.subscriptions(map(providedBy, (event.object, event)), None)
-    for subscription in subscriptions:
-        yield giveTimeToReactor(subscription, event.object, event)
+    for event in events:
+        subscriptions = gsm.adapters.subscriptions(map(providedBy, (event.object, event)), None)
+        for subscription in subscriptions:
+            try:
+                subscription(event.object, event)
+            except Exception:
+                log.exception("Error notifying services of %r", event)
+    return giveTimeToReactor(lambda: len(events))
 
-def handle_oid(dmd, oid):
-    # Go pull the object out of the database
+def make_event(dmd, oid):
+    """
+    Return the UpdateEvent or DeletionEvent for an invalidated oid, or None
+    if the object is not something services care about.
+    """
     obj = dmd._p_jar[oid]
-    # Don't bother with all the catalog stuff; we're depending on primaryAq
-    # existing anyway, so only deal with it if it actually has primaryAq.
     if (isinstance(obj, PrimaryPathObjectManager)
           or isinstance(obj, DeviceComponent)):
         try:
-            # Try to get the object
             obj = obj.__of__(dmd).primaryAq()
-        except (AttributeError, KeyError), ex:
-            # Object has been removed from its primary path (i.e. was
-            # deleted), so make a DeletionEvent
+        except (AttributeError, KeyError):
             log.debug("Notifying services that %r has been deleted" % obj)
-            event = DeletionEvent(obj, oid)
-        else:
-            # Object was updated, so make an UpdateEvent
-            log.debug("Notifying services that %r has been updated" % obj)
-            event = UpdateEvent(obj, oid)
-        # Fire the event for all interested services to pick up
-        return betterObjectEventNotify(event)
-
-
+            return DeletionEvent(obj, oid)
+        log.debug("Notifying services that %r has been updated" % obj)
+        return UpdateEvent(obj, oid)
 
 class InvalidationProcessor(object):
     """
@@ -69,40 +67,72 @@ class InvalidationProcessor(object):
     _invalidation_queue = None
     _hub = None
     _hub_ready = None
+    _batch_size = 100
 
     def __init__(self):
         self._invalidation_queue = IITreeSet()
         self._hub_ready = defer.Deferred()
+        # (oids, batches, seconds) for the most recent processQueue cycle
+        self.lastCycleStats = (0, 0, 0.0)
         getGlobalSiteManager().registerHandler(self.onHubCreated)
 
     @adapter(IHubCreatedEvent)
     def onHubCreated(self, event):
         self._hub = event.hub
+        self._batch_size = getattr(self._hub.options, 'invalidation_batch_size',
+                                   self._batch_size) or self._batch_size
         self._hub_ready.callback(self._hub)
 
     @defer.inlineCallbacks
     def processQueue(self, oids):
         yield self._hub_ready
-        i = 0
+        count = 0
+        batches = 0
         queue = self._invalidation_queue
         if self._hub.dmd.pauseHubNotifications:
             log.debug('notifications are currently paused')
             return
-        for i, oid in enumerate(oids):
+        start = time.time()
+        batch = []
+        for oid in oids:
             ioid = u64(oid)
             # Try pushing it into the queue, which is an IITreeSet. If it inserted
             # successfully it returns 1, else 0.
             if queue.insert(ioid):
-                # Get the deferred that does the notification
-                d = self._dispatch(self._hub.dmd, oid, ioid, queue)
-                yield d
-        defer.returnValue(i)
+                batch.append((oid, ioid))
+                if len(batch) >= self._batch_size:
+                    count += yield self._dispatchBatch(self._hub.dmd, batch, queue)
+                    batches += 1
+                    batch = []
+        if batch:
+            count += yield self._dispatchBatch(self._hub.dmd, batch, queue)
+            batches += 1
+        elapsed = time.time() - start
+        self.lastCycleStats = (count, batches, elapsed)
+        if count:
+            log.debug("Notified services of %d invalidations in %d batches (%.3fs)",
+                      count, batches, elapsed)
+        defer.returnValue(count)
 
-    def _dispatch(self, dmd, oid, ioid, queue):
+    def _dispatchBatch(self, dmd, batch, queue):
         """
-        Send to all the services that care by firing events.
+        Send a batch of invalidations to all the services that care by
+        firing events. Returns a deferred firing with the batch size.
         """
         try:
-            return handle_oid(dmd, oid)
+            events = []
+            for oid, ioid in batch:
+                try:
+                    event = make_event(dmd, oid)
+                except Exception:
+                    log.exception("Unable to load invalidated object %r", oid)
+                    continue
+                if event is not None:
+                    events.append(event)
+            d = notifyBatch(events)
+            d.addCallback(lambda n: len(batch))
+            return d
         finally:
-            queue.remove(ioid)
+            for oid, ioid in batch:
+                queue.remove(ioid)
+
@@ -8,6 +8,8 @@
 ##############################################################################
 
 import logging
+import sys
+import time
 
 log = logging.getLogger("zen.publisher")
 
@@ -30,6 +32,9 @@ defaultMetricBufferSize = 65536
 defaultPublishFrequency = 1.0
 defaultRedisPort = 6379
 defaultMaxOutstandingMetrics = 864000000
+defaultRedisConnections = 1
+defaultMetricBatchSize = 4096
+defaultMaxFlushes = 2
 
 bufferHighWater = 4096
 
@@ -44,6 +49,83 @@ class BasePublisher(object):
         self._pubfreq = pubfreq
         self._pubtask = None
         self._mq = deque(maxlen=buflen)
+        # producers are paused when the buffer fills past _pauseLevel and
+        # resumed once it has drained below _resumeLevel
+        self._producers = []
+        self._paused = False
+        self._pauseLevel = buflen // 2
+        self._resumeLevel = buflen // 4
+        self._published = 0
+        self._failed = 0
+        self._lastLatency = 0.0
+
+    def registerProducer(self, producer):
+        """
+        Register an object providing pauseProducing and resumeProducing that
+        will be told to stop writing metrics while the buffer is backed up
+
+        @param producer: the producer to throttle
+        """
+        self._producers.append(producer)
+        if self._paused:
+            producer.pauseProducing()
+
+    def unregisterProducer(self, producer):
+        self._producers.remove(producer)
+
+    def _check_pressure(self):
+        """
+        Pause or resume the registered producers depending on how full
+        the buffer is
+        """
+        queued = len(self._mq)
+        if not self._paused and queued >= self._pauseLevel:
+            self._paused = True
+            log.warn('metric buffer holds %d metrics, pausing collection',
+                     queued)
+            for producer in self._producers:
+                producer.pauseProducing()
+        elif self._paused and queued <= self._resumeLevel:
+            self._paused = False
+            log.info('metric buffer holds %d metrics, resuming collection',
+                     queued)
+            for producer in self._producers:
+                producer.resumeProducing()
+
+    @property
+    def paused(self):
+        """
+        Whether producers are currently paused
+        """
+        return self._paused
+
+    @property
+    def queueLength(self):
+        """
+        The number of metrics waiting to be published
+        """
+        return len(self._mq)
+
+    @property
+    def published(self):
+        """
+        The number of metrics successfully published
+        """
+        return self._published
+
+    @property
+    def failed(self):
+        """
+        The number of publish attempts that failed
+        """
+        return self._failed
+
+    @property
+    def lastLatency(self):
+        """
+        How long, in seconds, the most recent publish took
+        """
+        return self._lastLatency
 
     def build_metric(self, metric, value, timestamp, tags):
         return {"metric": metric,
@@ -62,9 +144,12 @@ class BasePublisher(object):
         will stop the errback chain
         """
         log.info('publishing failed: %s', reason.getErrorMessage())
+        self._failed += 1
 
         open_slots = self._mq.maxlen - len(self._mq)
-        self._mq.extendleft(reversed(metrics[-open_slots:]))
+        if open_slots > 0:
+            self._mq.extendleft(reversed(metrics[-open_slots:]))
+        self._check_pressure()
 
         return len(self._mq)
 
@@ -105,16 +190,47 @@ class BasePublisher(object):
         log.debug("writing: %s", mv)
 
         self._mq.append(mv)
+        self._check_pressure()
 
         if len(self._mq) < bufferHighWater:
             return defer.succeed(len(self._mq))
         else:
-            return self._put(self._channel, False)
+            return self._put(False)
+
+    def put_many(self, metrics):
+        """
+        Build a batch of metrics and append them to the buffer in one
+        pass, checking the high water mark once for the whole batch. A
+        metric that cannot be built is logged and left out of the batch.
+
+        @param metrics: list of (metric, value, timestamp, tags) tuples
+        @return: a deferred that will return the number of metrics still
+        in the buffer when fired
+        """
+        if not self._pubtask:
+            self._pubtask = reactor.callLater(self._pubfreq, self._put, True)
+
+        build_metric = self.build_metric
+        built = []
+        for m in metrics:
+            try:
+                built.append(build_metric(*m))
+            except Exception:
+                log.exception("Unable to publish metric %s", m[0])
+        self._mq.extend(built)
+        self._check_pressure()
+
+        if len(self._mq) < bufferHighWater:
+            return defer.succeed(len(self._mq))
+        else:
+            return self._put(False)
 
 
 class RedisListPublisher(BasePublisher):
     """
-    Publish metrics to redis
+    Publish metrics to redis.  Metrics are pushed in batches of at most
+    batchSize over a pool of connections, with up to maxFlushes batches in
+    flight at once.
     """
 
     def __init__(self,
@@ -123,18 +239,53 @@ class RedisListPublisher(BasePublisher):
                  buflen=defaultMetricBufferSize,
                  pubfreq=defaultPublishFrequency,
                  channel=defaultMetricsChannel,
-                 maxOutstandingMetrics=defaultMetricBufferSize):
+                 maxOutstandingMetrics=defaultMetricBufferSize,
+                 connections=defaultRedisConnections,
+                 batchSize=defaultMetricBatchSize,
+                 maxFlushes=defaultMaxFlushes):
         super(RedisListPublisher, self).__init__(buflen, pubfreq)
         self._host = host
         self._port = port
         self._channel = channel
         self._maxOutstandingMetrics = maxOutstandingMetrics
-        self._redis = RedisClientFactory()
-        self._connection = reactor.connectTCP(self._host,
-                                              self._port,
-                                              self._redis)
+        self._batchSize = max(1, batchSize)
+        self._maxFlushes = max(1, maxFlushes)
+        self._flushes = 0
+        self._next = 0
+        self._pool = [self._connect() for i in xrange(max(1, connections))]
         reactor.addSystemEventTrigger('before', 'shutdown', self._shutdown)
 
+    def _connect(self):
+        """
+        Open a connection to redis
+
+        @return: tuple of (RedisClientFactory, connector)
+        """
+        factory = RedisClientFactory()
+        connector = reactor.connectTCP(self._host, self._port, factory)
+        return factory, connector
+
+    def _client(self):
+        """
+        Pick the next connected client from the pool, round robin
+
+        @return: a redis client or None if no connection is up
+        """
+        for i in xrange(len(self._pool)):
+            factory, connector = self._pool[self._next]
+            self._next = (self._next + 1) % len(self._pool)
+            client = getattr(factory, 'client', None)
+            if connector.state == 'connected' and client is not None:
+                return client
+        return None
+
+    @property
+    def inFlight(self):
+        """
+        The number of batches currently being published
+        """
+        return self._flushes
+
     def build_metric(self, metric, value, timestamp, tags):
         """
         Override base method to work with strings instead of dicts
@@ -157,7 +308,55 @@ class RedisListPublisher(BasePublisher):
         @return: the number of metrics still in the queue
         """
         log.info('published %d metrics to redis', metricCount)
-        return 0
+        self._published += metricCount
+        return len(self._mq)
+
+    def _flush(self, client, metrics):
+        """
+        Send one batch of metrics.  The commands are written without waiting
+        for each reply, so batches sent on the same connection are pipelined.
+
+        @param client: connected redis client
+        @param metrics: the serialized metrics to push
+        @return: a deferred that fires with the number of metrics still in
+        the queue
+        """
+        self._flushes += 1
+        start = time.time()
+        d = defer.gatherResults([
+            client.multi(),
+            client.lpush(self._channel, *metrics),
+            client.ltrim(self._channel, 0, self._maxOutstandingMetrics - 1),
+            client.execute(),
+        ], consumeErrors=True)
+
+        def _done(result):
+            self._flushes -= 1
+            self._lastLatency = time.time() - start
+            return result
+
+        def _published(results):
+            queued = self._metrics_published(results[-1][0],
+                                             metricCount=len(metrics))
+            self._drain()
+            return queued
+
+        def _failed(reason):
+            # unwrap the FirstError from gatherResults
+            reason = getattr(reason.value, 'subFailure', reason)
+            return self._publish_failed(reason, metrics)
+
+        d.addBoth(_done)
+        d.addCallbacks(_published, _failed)
+        return d
+
+    def _drain(self):
+        """
+        Keep flushing while a full batch is waiting in the buffer
+        """
+        self._check_pressure()
+        if len(self._mq) >= self._batchSize:
+            self._put(False, reschedule=False)
 
     def _put(self, scheduled, reschedule=True):
         """
@@ -170,40 +369,41 @@ class RedisListPublisher(BasePublisher):
         if len(self._mq) == 0:
             return defer.succeed(0)
 
-        if self._connection.state == 'connected':
-            log.debug('trying to publish %d metrics', len(self._mq))
-
-            metrics = list(self._mq)
-            self._mq.clear()
-
-            @defer.inlineCallbacks
-            def _flush():
-                client = self._redis.client
-                yield client.multi()
-                yield client.lpush(self._channel, *metrics)
-                yield client.ltrim(self._channel, 0, self._maxOutstandingMetrics - 1)
-                result, _ = yield client.execute()
-                try:
-                    yield self._metrics_published(result,
-                                                  metricCount=len(metrics))
-                except Exception:
-                    yield self._publish_failed(metrics=metrics)
-
-            return _flush()
+        flushes = []
+        while self._mq and self._flushes < self._maxFlushes:
+            client = self._client()
+            if client is None:
+                log.debug('no connection to redis, %d metrics buffered',
+                          len(self._mq))
+                break
+            count = min(self._batchSize, len(self._mq))
+            metrics = [self._mq.popleft() for i in xrange(count)]
+            log.debug('trying to publish %d metrics', count)
+            flushes.append(self._flush(client, metrics))
+
+        self._check_pressure()
+        if not flushes:
+            return defer.succeed(len(self._mq))
+        d = defer.DeferredList(flushes)
+        d.addCallback(lambda ignored: len(self._mq))
+        return d
 
     def _shutdown(self):
         def disconnect(c):
             log.debug('shutting down [disconnecting]')
-            if self._connection.state == 'connected':
-                self._connection.disconnect()
+            for factory, connector in self._pool:
+                if connector.state == 'connected':
+                    connector.disconnect()
             log.debug('shutting down [disconnected]')
 
         log.debug('shutting down')
-        if self._connection.state != 'connected':
+        if self._client() is None:
             log.debug('shutting down [not connected: %s]',
-                      self._connection.state)
+                      ', '.join(c.state for f, c in self._pool))
         elif len(self._mq):
             log.debug('shutting down [publishing]')
+            # send everything that is left in one go
+            self._maxFlushes = sys.maxint
             try:
                 d = self._put(False, reschedule=False)
                 d.addCallback(disconnect)
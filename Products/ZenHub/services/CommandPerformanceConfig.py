@@ -21,6 +21,7 @@ from ZODB.POSException import ConflictError
 
 from Products.ZenCollector.services.config import CollectorConfigService
 from Products.ZenRRD.zencommand import Cmd, DataPointConfig
+from Products.ZenRRD.CommandParser import ParserRegistry
 from Products.DataCollector.Plugins import getParserLoader
 from Products.ZenEvents.ZenEventClasses import Error, Clear, Cmd_Fail
 from Products.ZenModel.OSProcess import OSProcess
@@ -41,6 +42,7 @@ class CommandPerformanceConfig(CollectorConfigService):
                                 )
         CollectorConfigService.__init__(self, dmd, instance, 
                                         deviceProxyAttributes)
+        self._parsers = ParserRegistry()
 
     # Use case: create a dummy device to act as a placeholder to execute commands
     #           So don't filter out devices that don't have IP addresses.
@@ -49,7 +51,7 @@ class CommandPerformanceConfig(CollectorConfigService):
         """
         Given a component a data source, gather its data points
         """
-        parser = ploader.create()
+        parser = self._parsers.create(ploader)
         points = []          
         component_name = ds.getComponent(comp)
         contextUUID = comp.getUUID()
@@ -88,6 +88,7 @@ class ProcessConfig(CollectorConfigService):
         proxy.processes = {}
         proxy.snmpConnInfo = device.getSnmpConnInfo()
         devuuid = device.getUUID()
+        classRules = {}
         for p in procs:
             # Find out which datasources are responsible for this process
             # if SNMP is not responsible, then do not add it to the list
@@ -105,31 +106,17 @@ class ProcessConfig(CollectorConfigService):
             if not p.monitored():
                 log.debug("Skipping process %r - zMonitor disabled", p)
                 continue
-            includeRegex = getattr(p.osProcessClass(), 'includeRegex', False)
-            excludeRegex = getattr(p.osProcessClass(), 'excludeRegex', False)
-            replaceRegex = getattr(p.osProcessClass(), 'replaceRegex', False)
-            replacement  = getattr(p.osProcessClass(), 'replacement', False)
-            generatedId  = getattr(p, 'generatedId', False)
-            primaryUrlPath = getattr(p.osProcessClass(), 'processClassPrimaryUrlPath', False)
+            processClass = p.osProcessClass()
+            primaryUrlPath = getattr(processClass, 'processClassPrimaryUrlPath', False)
             if primaryUrlPath: primaryUrlPath = primaryUrlPath()
-
-            if not includeRegex:
-                log.warn("OS process class %s has no defined regex, this process not being monitored",
-                         p.getOSProcessClass())
-                continue
-            bad_regex = False
-            for regex in [includeRegex, excludeRegex, replaceRegex]:
-                if regex:
-                    try:
-                        re.compile(regex)
-                    except re.error as ex:
-                        log.warn(
-                            "OS process class %s has an invalid regex (%s): %s",
-                            p.getOSProcessClass(), regex, ex)
-                        bad_regex = True
-                        break
-            if bad_regex:
+            # processes of the same class share its checked regexes
+            if primaryUrlPath not in classRules:
+                classRules[primaryUrlPath] = self._getClassRules(p, processClass)
+            rules = classRules[primaryUrlPath]
+            if rules is None:
                 continue
+            includeRegex, excludeRegex, replaceRegex, replacement = rules
+            generatedId  = getattr(p, 'generatedId', False)
 
             proc = ProcessProxy()
             proc.contextUUID = p.getUUID()
@@ -151,6 +138,31 @@ class ProcessConfig(CollectorConfigService):
         if proxy.processes:
             return proxy
 
+    def _getClassRules(self, p, processClass):
+        """
+        Return the regexes and replacement of a process class, or None if
+        it has no include regex or an invalid regex.
+        """
+        includeRegex = getattr(processClass, 'includeRegex', False)
+        excludeRegex = getattr(processClass, 'excludeRegex', False)
+        replaceRegex = getattr(processClass, 'replaceRegex', False)
+        replacement  = getattr(processClass, 'replacement', False)
+
+        if not includeRegex:
+            log.warn("OS process class %s has no defined regex, this process not being monitored",
+                     p.getOSProcessClass())
+            return None
+        for regex in [includeRegex, excludeRegex, replaceRegex]:
+            if regex:
+                try:
+                    re.compile(regex)
+                except re.error as ex:
+                    log.warn(
+                        "OS process class %s has an invalid regex (%s): %s",
+                        p.getOSProcessClass(), regex, ex)
+                    return None
+        return includeRegex, excludeRegex, replaceRegex, replacement
+
     @onUpdate(OSProcessClass)
     def processClassUpdated(self, object, event):
         devices = set()
@@ -18,6 +18,8 @@ from pprint import pformat
 import logging
 log = logging.getLogger('zen.HubService.SnmpPerformanceConfig')
 
+_validOID = re.compile(r'(?:\.?\d+)+$').match
+
 import Globals
 from twisted.spread import pb
 from Products.ZenCollector.services.config import DeviceProxy, CollectorConfigService
@@ -43,6 +45,10 @@ pb.setUnjellyableForClass(SnmpDeviceProxy, SnmpDeviceProxy)
 
 
 class SnmpPerformanceConfig(CollectorConfigService):
+
+    _compiledTemplates = None
+    _resolvedOids = None
+
     def __init__(self, dmd, instance):
         deviceProxyAttributes = ('zMaxOIDPerRequest',
                                  'zSnmpMonitorIgnore',
@@ -91,6 +97,51 @@ class SnmpPerformanceConfig(CollectorConfigService):
         return "{0}.{1}".format(oid, index) if index else oid
 
 
+    def _compileTemplate(self, templ, perfServer):
+        """
+        Return the SNMP datasources of a template as a list of
+        (datasource, base OID, datapoints) tuples, where datapoints is a
+        tuple of (name, rrdtype, create command, min, max). Everything here
+        is the same for every component bound to the template.
+        """
+        key = (templ.getPrimaryId(), perfServer.id if perfServer else None)
+        cache = self._compiledTemplates
+        if cache is not None and key in cache:
+            return cache[key]
+        compiled = []
+        for ds in templ.getRRDDataSources("SNMP"):
+            if not ds.enabled or not ds.oid:
+                continue
+            datapoints = tuple(
+                (dp.name(), dp.rrdtype,
+                 dp.getRRDCreateCommand(perfServer).strip(),
+                 dp.rrdmin, dp.rrdmax)
+                for dp in ds.getRRDDataPoints())
+            compiled.append((ds, ds.oid.strip("."), datapoints))
+        if cache is not None:
+            cache[key] = compiled
+        return compiled
+
+    def _resolveOid(self, oid):
+        """
+        Translate a symbolic OID to its numeric form, or None.
+        """
+        resolved = self._resolvedOids
+        if resolved is None:
+            return self.dmd.Mibs.name2oid(oid)
+        if oid not in resolved:
+            resolved[oid] = self.dmd.Mibs.name2oid(oid)
+        return resolved[oid]
+
+    def _resetTemplateCache(self, enabled=True):
+        """
+        Compiled templates and resolved OIDs are only kept for the duration
+        of one configuration build, so changes to templates and MIBs are
+        always picked up by the next one.
+        """
+        self._compiledTemplates = {} if enabled else None
+        self._resolvedOids = {} if enabled else None
+
     def _getComponentConfig(self, comp, perfServer, oids):
         """
         SNMP components can build up the actual OID based on a base OID and
@@ -99,21 +150,18 @@ class SnmpPerformanceConfig(CollectorConfigService):
         if comp.snmpIgnore():
             return None
 
-        validOID = re.compile(r'(?:\.?\d+)+$')
         contextUUID  = comp.getUUID()
         devuuid = comp.device().getUUID()
+        cname = comp.id
         for templ in comp.getRRDTemplates():
-            for ds in templ.getRRDDataSources("SNMP"):
-                if not ds.enabled or not ds.oid:
-                    continue
-
-                oid = self._transform_oid(ds.oid.strip("."), comp)
+            for ds, baseOid, datapoints in self._compileTemplate(templ, perfServer):
+                oid = self._transform_oid(baseOid, comp)
                 if not oid:
                     log.warn("The data source %s OID is blank -- ignoring", ds.id)
                     continue
-                elif not validOID.match(oid):
+                elif not _validOID(oid):
                     oldOid = oid
-                    oid = self.dmd.Mibs.name2oid(oid)
+                    oid = self._resolveOid(oid)
                     if not oid:
                         msg =  "The OID %s is invalid -- ignoring" % oldOid
                         self.sendEvent(dict(
@@ -122,21 +170,34 @@ class SnmpPerformanceConfig(CollectorConfigService):
                         ))
                         continue
 
-                for dp in ds.getRRDDataPoints():
-                    cname = comp.id
+                for name, rrdtype, createCmd, rrdmin, rrdmax in datapoints:
                     oidData = (cname,
-                                 dp.name(),
+                                 name,
                                  contextUUID,
                                  devuuid,
-                                 dp.rrdtype,
-                                 dp.getRRDCreateCommand(perfServer).strip(),
-                                 dp.rrdmin, dp.rrdmax)
+                                 rrdtype,
+                                 createCmd,
+                                 rrdmin, rrdmax)
 
                     # An OID can appear in multiple data sources/data points
                     oids.setdefault(oid, []).append(oidData)
 
         return comp.getThresholdInstances('SNMP')
 
+    def remote_getDeviceConfigs(self, deviceNames=None):
+        self._resetTemplateCache()
+        try:
+            return CollectorConfigService.remote_getDeviceConfigs(self, deviceNames)
+        finally:
+            self._resetTemplateCache(False)
+
+    def _pushConfig(self, device):
+        self._resetTemplateCache()
+        try:
+            return CollectorConfigService._pushConfig(self, device)
+        finally:
+            self._resetTemplateCache(False)
+
     def _createDeviceProxies(self, device):
         manage_ips = {device.manageIp: ([], False)}
         components = device.os.getMonitoredComponents(collector="zenperfsnmp")
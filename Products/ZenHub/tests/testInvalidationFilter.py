@@ -0,0 +1,144 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2014, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+from ZODB.POSException import POSKeyError
+from ZODB.utils import p64
+
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+from Products.ZenHub.interfaces import FILTER_CONTINUE, FILTER_EXCLUDE
+from Products.ZenHub.invalidationfilter import (
+    BaseOrganizerFilter, DeviceClassInvalidationFilter, OSProcessClassFilter
+)
+
+
+class Object(object):
+    pass
+
+
+class Connection(object):
+    """
+    Keeps the revisions of a single object, as {tid: state}.
+    """
+
+    def __init__(self, lastTransaction):
+        self.last = lastTransaction
+        self.revisions = {}
+        self.storage = self
+
+    def db(self):
+        return self
+
+    def lastTransaction(self):
+        return self.last
+
+    def loadBefore(self, oid, tid):
+        if not self.revisions:
+            raise POSKeyError(oid)
+        serials = [serial for serial in self.revisions if serial < tid]
+        if not serials:
+            return None
+        return ('data', max(serials), None)
+
+    def oldstate(self, obj, tid):
+        return dict(self.revisions[tid])
+
+
+class Organizer(object):
+    _properties = ({'id': 'zCommandPort'}, {'id': 'description'})
+
+    def __init__(self, jar, **state):
+        self._p_jar = jar
+        self._p_oid = p64(1)
+        self.__setstate__(state)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def getPrimaryPath(self):
+        return ('', 'zport', 'dmd', 'Devices', 'Test')
+
+
+class TestOrganizerFilters(BaseTestCase):
+
+    def testDeviceClassProperties(self):
+        org = self.dmd.Devices.createOrganizer('/Server/Test')
+        filter = DeviceClassInvalidationFilter()
+        filter.initialize(self)
+        # created after the filter was initialized, so included
+        self.assertEqual(FILTER_CONTINUE, filter.include(org))
+        self.assertEqual(FILTER_EXCLUDE, filter.include(org))
+        org.setZenProperty('zCommandPort', 2222)
+        self.assertEqual(FILTER_CONTINUE, filter.include(org))
+        self.assertEqual(FILTER_EXCLUDE, filter.include(org))
+        # a direct assignment goes through the property descriptor
+        org.zCommandPort = 2223
+        self.assertEqual(FILTER_CONTINUE, filter.include(org))
+        org.deleteZenProperty('zCommandPort')
+        self.assertEqual(FILTER_CONTINUE, filter.include(org))
+
+    def testProcessClassRegexes(self):
+        self.dmd.Processes.manage_addOSProcessClass('test')
+        pc = self.dmd.Processes.osProcessClasses.test
+        filter = OSProcessClassFilter()
+        filter.initialize(self)
+        self.assertEqual(FILTER_CONTINUE, filter.include(pc))
+        self.assertEqual(FILTER_EXCLUDE, filter.include(pc))
+        # the Zuul setters assign the attributes directly
+        pc.includeRegex = 'java'
+        self.assertEqual(FILTER_CONTINUE, filter.include(pc))
+        self.assertEqual(FILTER_EXCLUDE, filter.include(pc))
+
+    def testInitialChecksum(self):
+        jar = Connection(p64(2))
+        jar.revisions[p64(1)] = {'zCommandPort': 22}
+        context = Object()
+        context.dmd = Object()
+        context.dmd._p_jar = jar
+        filter = BaseOrganizerFilter((Organizer,))
+
+        # unchanged since the filter was initialized
+        filter.initialize(context)
+        self.assertEqual(FILTER_EXCLUDE,
+                         filter.include(Organizer(jar, zCommandPort=22)))
+        # only the z/c properties are compared
+        filter.initialize(context)
+        self.assertEqual(FILTER_EXCLUDE,
+                         filter.include(Organizer(jar, zCommandPort=22,
+                                                  description='test')))
+
+        # changed since
+        filter.initialize(context)
+        self.assertEqual(FILTER_CONTINUE,
+                         filter.include(Organizer(jar, zCommandPort=23)))
+        self.assertEqual(FILTER_EXCLUDE,
+                         filter.include(Organizer(jar, zCommandPort=23)))
+
+        # a revision committed later is not the initial one
+        jar.revisions[p64(3)] = {'zCommandPort': 24}
+        filter.initialize(context)
+        self.assertEqual(FILTER_CONTINUE,
+                         filter.include(Organizer(jar, zCommandPort=24)))
+
+        # created after the filter was initialized
+        del jar.revisions[p64(1)]
+        filter.initialize(context)
+        self.assertEqual(FILTER_CONTINUE,
+                         filter.include(Organizer(jar, zCommandPort=24)))
+        # or unknown to the storage
+        jar.revisions.clear()
+        filter.initialize(context)
+        self.assertEqual(FILTER_CONTINUE,
+                         filter.include(Organizer(jar, zCommandPort=24)))
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestOrganizerFilters))
+    return suite
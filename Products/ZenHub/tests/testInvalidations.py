@@ -0,0 +1,186 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2014, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+from zope.component import getGlobalSiteManager
+from zope.interface import Interface, implements
+from twisted.internet import defer
+from ZODB.utils import p64
+
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+# Import from zenhub before importing twisted.internet.reactor
+from Products.ZenHub.zenhub import ZenHub
+from Products.ZenHub import invalidations
+from Products.ZenHub.interfaces import IInvalidationOid, FILTER_CONTINUE
+from Products.ZenHub.invalidationoid import DefaultOidTransform, \
+    DeviceOidTransform
+from Products.ZenHub.invalidations import InvalidationProcessor, notifyBatch
+from Products.ZenHub.zodb import UpdateEvent
+from Products.ZenModel.DeviceComponent import DeviceComponent
+
+
+class Object(object):
+    pass
+
+
+class Component(DeviceComponent):
+
+    def __init__(self, oid, device=None):
+        self._p_oid = oid
+        self._device = device
+
+    def __of__(self, parent):
+        return self
+
+    def primaryAq(self):
+        return self
+
+    def device(self):
+        return self._device
+
+
+class Device(Component):
+
+    def device(self):
+        return self
+
+
+class OwnOidComponent(Component):
+    """
+    A component whose invalidations are not passed on as its device's.
+    """
+
+
+class CountingFilter(object):
+
+    def __init__(self):
+        self.filtered = []
+
+    def include(self, obj):
+        self.filtered.append(obj)
+        return FILTER_CONTINUE
+
+
+class Hub(object):
+    _filter_oids = ZenHub._filter_oids.im_func
+    _transformOid = ZenHub._transformOid.im_func
+
+    def __init__(self, objects):
+        self.dmd = Object()
+        self.dmd._p_jar = dict((obj._p_oid, obj) for obj in objects)
+        self.dmd.getPhysicalRoot = lambda: self.dmd
+        self.dmd.pauseHubNotifications = False
+        self.options = Object()
+        self.options.invalidation_batch_size = 2
+        self._invalidation_filters = [CountingFilter()]
+
+
+class ITestObject(Interface):
+    pass
+
+
+class TestObject(object):
+    implements(ITestObject)
+
+
+class TestInvalidations(BaseTestCase):
+
+    def afterSetUp(self):
+        super(TestInvalidations, self).afterSetUp()
+        self._giveTimeToReactor = invalidations.giveTimeToReactor
+        invalidations.giveTimeToReactor = lambda f: defer.succeed(f())
+        gsm = getGlobalSiteManager()
+        gsm.registerAdapter(DeviceOidTransform, (Component,), IInvalidationOid)
+        gsm.registerAdapter(DefaultOidTransform, (OwnOidComponent,),
+                            IInvalidationOid)
+
+    def beforeTearDown(self):
+        invalidations.giveTimeToReactor = self._giveTimeToReactor
+        gsm = getGlobalSiteManager()
+        gsm.unregisterAdapter(DeviceOidTransform, (Component,),
+                              IInvalidationOid)
+        gsm.unregisterAdapter(DefaultOidTransform, (OwnOidComponent,),
+                              IInvalidationOid)
+        super(TestInvalidations, self).beforeTearDown()
+
+    def testComponentsCollapseIntoDevice(self):
+        device = Device(p64(1))
+        components = [Component(p64(i), device) for i in range(2, 6)]
+        hub = Hub([device] + components)
+        oids = [c._p_oid for c in components] + [device._p_oid]
+        self.assertEqual([device._p_oid], list(hub._filter_oids(oids)))
+        # only the first component is filtered, the others map to its device
+        self.assertEqual([components[0]],
+                         hub._invalidation_filters[0].filtered)
+
+    def testComponentWithOwnOid(self):
+        device = Device(p64(1))
+        component = Component(p64(2), device)
+        ownOid = OwnOidComponent(p64(3), device)
+        hub = Hub([device, component, ownOid])
+        oids = [device._p_oid, component._p_oid, ownOid._p_oid]
+        self.assertEqual([device._p_oid, ownOid._p_oid],
+                         list(hub._filter_oids(oids)))
+        self.assertEqual([device, ownOid],
+                         hub._invalidation_filters[0].filtered)
+
+    def testBatchSize(self):
+        hub = Hub([])
+        # objects services do not care about, the batches are still counted
+        hub.dmd._p_jar = dict((p64(i), Object()) for i in range(1, 6))
+        processor = InvalidationProcessor()
+        try:
+            event = Object()
+            event.hub = hub
+            processor.onHubCreated(event)
+            batches = []
+            dispatchBatch = processor._dispatchBatch
+            def _dispatchBatch(dmd, batch, queue):
+                batches.append([oid for oid, ioid in batch])
+                return dispatchBatch(dmd, batch, queue)
+            processor._dispatchBatch = _dispatchBatch
+
+            oids = sorted(hub.dmd._p_jar)
+            result = []
+            processor.processQueue(oids).addCallback(result.append)
+            self.assertEqual([5], result)
+            self.assertEqual([oids[0:2], oids[2:4], oids[4:]], batches)
+            count, batchCount, elapsed = processor.lastCycleStats
+            self.assertEqual((5, 3), (count, batchCount))
+            self.assertTrue(elapsed >= 0)
+            # the queue is emptied once a batch is dispatched
+            self.assertEqual(0, len(processor._invalidation_queue))
+        finally:
+            getGlobalSiteManager().unregisterHandler(processor.onHubCreated)
+
+    def testNotifyBatchIsolatesFailures(self):
+        notified = []
+        def failing(obj, event):
+            if event.oid == 1:
+                raise Exception('failing subscriber')
+        def recording(obj, event):
+            notified.append(event.oid)
+        gsm = getGlobalSiteManager()
+        gsm.registerHandler(failing, (ITestObject, UpdateEvent))
+        gsm.registerHandler(recording, (ITestObject, UpdateEvent))
+        try:
+            events = [UpdateEvent(TestObject(), oid) for oid in (1, 2)]
+            result = []
+            notifyBatch(events).addCallback(result.append)
+            self.assertEqual([2], result)
+            self.assertEqual([1, 2], notified)
+        finally:
+            gsm.unregisterHandler(failing, (ITestObject, UpdateEvent))
+            gsm.unregisterHandler(recording, (ITestObject, UpdateEvent))
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestInvalidations))
+    return suite
@@ -0,0 +1,139 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2014, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+from twisted.internet import defer
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+from Products.ZenHub.metricpublisher.publisher import RedisListPublisher
+
+
+class LocalRedis(object):
+    """
+    Stands in for a txredis client.  Replies to EXEC are held until
+    reply() is called so that flushes stay in flight.
+    """
+    def __init__(self):
+        self.lists = {}
+        self.pending = []
+
+    def multi(self):
+        return defer.succeed('OK')
+
+    def lpush(self, key, *values):
+        self.lists.setdefault(key, [])[:0] = reversed(values)
+        return defer.succeed('QUEUED')
+
+    def ltrim(self, key, start, end):
+        return defer.succeed('QUEUED')
+
+    def execute(self):
+        d = defer.Deferred()
+        self.pending.append(d)
+        return d
+
+    def reply(self, fail=False):
+        pending, self.pending = self.pending, []
+        for d in pending:
+            if fail:
+                d.errback(IOError('connection lost'))
+            else:
+                d.callback([0, 'OK'])
+
+
+class LocalConnector(object):
+    state = 'connected'
+
+
+class LocalFactory(object):
+    def __init__(self, client):
+        self.client = client
+
+
+class LocalRedisPublisher(RedisListPublisher):
+    def _connect(self):
+        return LocalFactory(LocalRedis()), LocalConnector()
+
+    def _reschedule_pubtask(self, scheduled):
+        pass
+
+
+class Producer(object):
+    paused = False
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+
+
+class TestRedisListPublisher(BaseTestCase):
+
+    def afterSetUp(self):
+        super(TestRedisListPublisher, self).afterSetUp()
+        self.publisher = LocalRedisPublisher(buflen=100, batchSize=10,
+                                             maxFlushes=2, connections=2)
+        self.publisher._pubtask = True
+        self.producer = Producer()
+        self.publisher.registerProducer(self.producer)
+
+    def clients(self):
+        return [factory.client for factory, connector in self.publisher._pool]
+
+    def metrics(self, count):
+        return [('m%d' % i, i, 0, {}) for i in xrange(count)]
+
+    def testBatchesAndFlightLimit(self):
+        self.publisher.put_many(self.metrics(35))
+        self.publisher._put(False)
+        # two batches of ten in flight, one per connection
+        self.assertEqual(2, self.publisher.inFlight)
+        self.assertEqual(15, self.publisher.queueLength)
+        self.assertEqual([10, 10],
+                         [len(c.lists['metrics']) for c in self.clients()])
+        # replies free up the flight slots and the backlog keeps draining
+        for client in self.clients():
+            client.reply()
+        self.assertEqual(5, self.publisher.queueLength)
+        for client in self.clients():
+            client.reply()
+        self.assertEqual(0, self.publisher.inFlight)
+        self.assertEqual(30, self.publisher.published)
+
+    def testFailureRequeues(self):
+        self.publisher.put_many(self.metrics(10))
+        self.publisher._put(False)
+        self.assertEqual(0, self.publisher.queueLength)
+        for client in self.clients():
+            client.reply(fail=True)
+        self.assertEqual(10, self.publisher.queueLength)
+        self.assertEqual(1, self.publisher.failed)
+        self.assertEqual(0, self.publisher.inFlight)
+
+    def testBackpressure(self):
+        for connector in (c for f, c in self.publisher._pool):
+            connector.state = 'connecting'
+        self.publisher.put_many(self.metrics(49))
+        self.assertFalse(self.producer.paused)
+        self.publisher.put_many(self.metrics(1))
+        self.assertTrue(self.producer.paused)
+        self.assertTrue(self.publisher.paused)
+        for connector in (c for f, c in self.publisher._pool):
+            connector.state = 'connected'
+        self.publisher._put(False)
+        for client in self.clients():
+            client.reply()
+        self.assertTrue(self.publisher.queueLength <= 25)
+        self.assertFalse(self.producer.paused)
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestRedisListPublisher))
+    return suite
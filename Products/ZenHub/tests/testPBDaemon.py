@@ -7,7 +7,7 @@
 #
 ##############################################################################
 
-import os, logging
+import os, logging, shutil, tempfile
 
 log = logging.getLogger('zen.testPBDaemon')
 
@@ -25,7 +25,7 @@ from Products.ZenHub.interfaces import (
     ICollectorEventTransformer, TRANSFORM_DROP
 )
 from Products.ZenHub.PBDaemon import (
-    DeDupingEventQueue, DequeEventQueue, EventQueueManager,
+    DeDupingEventQueue, DequeEventQueue, EventQueueManager, EventSpill,
     DefaultFingerprintGenerator, PBDaemon
 )
 
@@ -47,6 +47,19 @@ def createTestEvent(**kwargs):
     evt.update(kwargs)
     return evt
 
+def createOptions(deduplicate_events=True, maxqueuelen=5000,
+                  allowduplicateclears=False, duplicateclearinterval=0,
+                  eventflushchunksize=50):
+    class MockOptions(object):
+        pass
+    options = MockOptions()
+    options.deduplicate_events = deduplicate_events
+    options.maxqueuelen = maxqueuelen
+    options.allowduplicateclears = allowduplicateclears
+    options.duplicateclearinterval = duplicateclearinterval
+    options.eventflushchunksize = eventflushchunksize
+    return options
+
 class BaseEventQueueTest(BaseTestCase):
 
     def __init__(self, queue_type, maxlen, *args, **kwargs):
@@ -139,6 +152,32 @@ class TestDeDupingEventQueue(BaseEventQueueTest):
         self.assertEquals('dev3', queued[3]['device'])
         self.assertEquals(0, queued[3].get('count', 0))
 
+    def testRequeueKeepsFingerprints(self):
+        class CountingFingerprinter(DefaultFingerprintGenerator):
+            calls = 0
+            def generate(self, event):
+                CountingFingerprinter.calls += 1
+                return super(CountingFingerprinter, self).generate(event)
+        self.queue.fingerprinters = [CountingFingerprinter()]
+        for i in range(5):
+            self.queue.append(createTestEvent(device='dev%d' % i))
+        events, keys = self.queue.popall()
+        self.assertEquals(0, len(self.queue))
+        self.queue.append(createTestEvent(device='dev5'))
+        self.assertEquals([], self.queue.requeue(events, keys))
+        self.assertEquals(6, CountingFingerprinter.calls)
+        self.assertEquals(['dev%d' % i for i in range(6)],
+                          [evt['device'] for evt in self.queue])
+
+    def testManyDuplicates(self):
+        for i in range(1000):
+            self.queue.append(createTestEvent(device='dev%d' % (i % 3)))
+        self.assertEquals(3, len(self.queue))
+        queued = list(self.queue)
+        self.assertEquals(['dev1', 'dev2', 'dev0'],
+                          [evt['device'] for evt in queued])
+        self.assertEquals(333, queued[0]['count'])
+
 
 class TestDequeEventQueue(BaseEventQueueTest):
 
@@ -153,18 +192,8 @@ class TestEventQueueManager(BaseTestCase):
         super(TestEventQueueManager, self).afterSetUp()
         self.gsm = getGlobalSiteManager()
 
-    def createOptions(self, deduplicate_events=True, maxqueuelen=5000,
-                      allowduplicateclears=False, duplicateclearinterval=0,
-                      eventflushchunksize=50):
-        class MockOptions(object):
-            pass
-        options = MockOptions()
-        options.deduplicate_events = deduplicate_events
-        options.maxqueuelen = maxqueuelen
-        options.allowduplicateclears = allowduplicateclears
-        options.duplicateclearinterval = duplicateclearinterval
-        options.eventflushchunksize = eventflushchunksize
-        return options
+    def createOptions(self, **kwargs):
+        return createOptions(**kwargs)
 
     def testAddEventDroppedTransform(self):
         class DroppingTransformer(object):
@@ -358,6 +387,74 @@ class TestEventQueueManager(BaseTestCase):
         self.assertTrue(events[0] in sent_events)
 
 
+class TestEventSpill(BaseTestCase):
+
+    def afterSetUp(self):
+        super(TestEventSpill, self).afterSetUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'events.spill')
+
+    def beforeTearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super(TestEventSpill, self).beforeTearDown()
+
+    def createManager(self, maxqueuelen, maxspilled):
+        options = createOptions(maxqueuelen=maxqueuelen,
+                                eventflushchunksize=2)
+        return EventQueueManager(options, log,
+                                 EventSpill(self.path, maxspilled, log))
+
+    def testSpill(self):
+        eqm = self.createManager(2, 2)
+        events = [createTestEvent(device='dev%d' % i) for i in range(5)]
+        for evt in events:
+            eqm.addEvent(evt)
+        # the two oldest events are spilled, the next one discarded
+        self.assertEquals(2, len(eqm.spill))
+        self.assertEquals(1, eqm.discarded_events)
+        self.assertEquals(events[3:], list(eqm.event_queue))
+
+        chunks = []
+        def fail(evts):
+            raise Exception('hub is down')
+        eqm.sendEvents(fail).addErrback(lambda f: None)
+        self.assertEquals(2, len(eqm.spill))
+        self.assertEquals(events[3:], list(eqm.event_queue))
+
+        eqm.sendEvents(chunks.append)
+        self.assertEquals([events[:2], events[3:]], chunks)
+        self.assertEquals(0, len(eqm.spill))
+        self.assertFalse(os.path.exists(self.path))
+
+    def testSpillSurvivesRestart(self):
+        eqm = self.createManager(1, 10)
+        for i in range(3):
+            eqm.addEvent(createTestEvent(device='dev%d' % i))
+        spill = EventSpill(self.path, 10, log)
+        self.assertEquals(2, len(spill))
+        events, position = spill.read(5)
+        self.assertEquals(['dev0', 'dev1'], [evt['device'] for evt in events])
+
+    def testRestartAfterPartialSend(self):
+        events = [createTestEvent(device='dev%d' % i) for i in range(5)]
+        spill = EventSpill(self.path, 10, log)
+        spill.extend(events)
+        sent, position = spill.read(2)
+        spill.advance(position, len(sent))
+        # a restart only finds the unsent events
+        spill = EventSpill(self.path, 10, log)
+        self.assertEquals(3, len(spill))
+        sent, position = spill.read(1)
+        self.assertEquals(events[2:3], sent)
+        size = os.path.getsize(self.path)
+        spill.advance(position, len(sent))
+        # more than half of the file was sent, so it is compacted
+        self.assertTrue(os.path.getsize(self.path) < size)
+        spill = EventSpill(self.path, 10, log)
+        self.assertEquals(2, len(spill))
+        self.assertEquals(events[3:], spill.read(5)[0])
+
+
 class TestDefaultFingerprintGenerator(BaseTestCase):
 
     def afterSetUp(self):
@@ -439,13 +536,58 @@ class TestInternalMetricWriter(BaseTestCase):
         publisher = self.daemon.internalPublisher()
         self.assertIsInstance( publisher, HttpPostPublisher)
 
+class FakeContext(object):
+    deviceName = 'device1'
+    contextKey = 'uuid-device1'
+
+    def key(self):
+        return self.deviceName, ''
+
+class FakeThreshold(object):
+    def __init__(self, limit):
+        self.limit = limit
+
+    def key(self):
+        return 'limit', FakeContext().key()
+
+    def context(self):
+        return FakeContext()
+
+    def dataPoints(self):
+        return ['cpu']
+
+    def checkValue(self, dp, timeAt, value):
+        if value > self.limit:
+            return [dict(eventKey='limit', severity=4, current=value)]
+        return []
+
+class TestDaemonThresholds(BaseTestCase):
+    def setUp(self):
+        self.daemon = PBDaemon()
+        self.events = []
+        self.daemon.sendEvent = self.events.append
+
+    def testNotifierSeesThresholdUpdates(self):
+        # the notifier is created before any threshold is known
+        notifier = self.daemon._getThresholdNotifier()
+        self.daemon.getThresholds().updateForDevice('device1',
+                                                    [FakeThreshold(10)])
+        self.assertTrue(notifier._thresholds is self.daemon.getThresholds())
+        notifier.notify('uuid-device1', 'device1', 'cpu', 0, 5)
+        self.assertEquals([], self.events)
+        notifier.notify('uuid-device1', 'device1', 'cpu', 0, 20)
+        self.assertEquals(1, len(self.events))
+        self.assertEquals('device1|limit', self.events[0]['eventKey'])
+
 def test_suite():
     from unittest import TestSuite, makeSuite
     suite = TestSuite()
     suite.addTest(makeSuite(TestDeDupingEventQueue))
     suite.addTest(makeSuite(TestDequeEventQueue))
     suite.addTest(makeSuite(TestEventQueueManager))
+    suite.addTest(makeSuite(TestEventSpill))
     suite.addTest(makeSuite(TestDefaultFingerprintGenerator))
     suite.addTest(makeSuite(TestMetricWriter))
     suite.addTest(makeSuite(TestInternalMetricWriter))
+    suite.addTest(makeSuite(TestDaemonThresholds))
     return suite
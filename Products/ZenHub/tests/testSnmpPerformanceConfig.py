@@ -0,0 +1,220 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2014, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+import logging
+
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+from Products.ZenHub.services.SnmpPerformanceConfig import \
+    SnmpPerformanceConfig
+
+log = logging.getLogger('zen.testSnmpPerformanceConfig')
+
+
+class Object(object):
+    pass
+
+
+class DataPoint(object):
+    rrdtype = 'GAUGE'
+    rrdmin = None
+    rrdmax = None
+
+    def __init__(self, name):
+        self._name = name
+
+    def name(self):
+        return self._name
+
+    def getRRDCreateCommand(self, perfServer):
+        return 'RRA:%s ' % perfServer.id
+
+
+class DataSource(object):
+
+    def __init__(self, id, oid, enabled=True):
+        self.id = id
+        self.oid = oid
+        self.enabled = enabled
+        self.datapoints = [DataPoint(id)]
+
+    def getRRDDataPoints(self):
+        return self.datapoints
+
+
+class Template(object):
+
+    def __init__(self, path, datasources):
+        self.path = path
+        self.datasources = datasources
+        self.compiles = 0
+
+    def getPrimaryId(self):
+        return self.path
+
+    def getRRDDataSources(self, dsType):
+        self.compiles += 1
+        return list(self.datasources)
+
+
+class Mibs(object):
+
+    def __init__(self):
+        self.lookups = 0
+
+    def name2oid(self, name):
+        self.lookups += 1
+        return {'ifInOctets': '1.3.6.1.2.1.2.2.1.10'}.get(name)
+
+
+class PerfServer(object):
+
+    def __init__(self, id):
+        self.id = id
+
+
+class Device(object):
+
+    def __init__(self, id, template, perfServer):
+        self.id = id
+        self.template = template
+        self.performanceServer = perfServer
+        monitors = Object()
+        monitors.getPreviousCollectorForDevice = lambda id: None
+        self.dmd = Object()
+        self.dmd.Monitors = Object()
+        self.dmd.Monitors.primaryAq = lambda: monitors
+
+
+class Service(SnmpPerformanceConfig):
+    """
+    Builds a configuration by compiling the template of each device.
+    """
+    error = None
+
+    def __init__(self):
+        self.dmd = Object()
+        self.dmd.Mibs = Mibs()
+        self.log = log
+        self.instance = 'localhost'
+        self.listeners = []
+        self.devices = []
+        self.compiled = []
+
+    def _getDevices(self, deviceNames=None):
+        if self.error:
+            raise self.error
+        return self.devices
+
+    def _filterDevices(self, devices):
+        return devices
+
+    def _filterDevice(self, device):
+        if self.error:
+            raise self.error
+        return True
+
+    def _createDeviceProxies(self, device):
+        self.compiled.append(self._compileTemplate(device.template,
+                                                   device.performanceServer))
+        return ()
+
+
+class TestSnmpPerformanceConfig(BaseTestCase):
+
+    def afterSetUp(self):
+        super(TestSnmpPerformanceConfig, self).afterSetUp()
+        self.service = Service()
+        self.inOctets = DataSource('ifInOctets', '.1.3.6.1.2.1.2.2.1.10')
+        self.template = Template('/rrdTemplates/ethernetCsmacd', [
+            self.inOctets,
+            DataSource('disabled', '1.3.6.1.2.1.2.2.1.16', enabled=False),
+            DataSource('blank', '')])
+        self.perf1 = PerfServer('perf1')
+        self.perf2 = PerfServer('perf2')
+
+    def assertCacheOff(self):
+        self.assertEqual(None, self.service._compiledTemplates)
+        self.assertEqual(None, self.service._resolvedOids)
+
+    def testCompileTemplate(self):
+        service, template = self.service, self.template
+        service._resetTemplateCache()
+        compiled = service._compileTemplate(template, self.perf1)
+        self.assertEqual([(self.inOctets, '1.3.6.1.2.1.2.2.1.10',
+                           (('ifInOctets', 'GAUGE', 'RRA:perf1', None, None),))],
+                         compiled)
+        # shared by every component bound to the template
+        for i in range(10):
+            self.assertTrue(compiled is
+                            service._compileTemplate(template, self.perf1))
+        self.assertEqual(1, template.compiles)
+        # the create commands depend on the perfServer
+        service._compileTemplate(template, self.perf2)
+        self.assertEqual(2, template.compiles)
+
+        # outside of a build nothing is kept
+        service._resetTemplateCache(False)
+        service._compileTemplate(template, self.perf1)
+        service._compileTemplate(template, self.perf1)
+        self.assertEqual(4, template.compiles)
+
+    def testResolveOid(self):
+        service = self.service
+        mibs = service.dmd.Mibs
+        service._resetTemplateCache()
+        for i in range(10):
+            self.assertEqual('1.3.6.1.2.1.2.2.1.10',
+                             service._resolveOid('ifInOctets'))
+            self.assertEqual(None, service._resolveOid('unknown'))
+        self.assertEqual(2, mibs.lookups)
+
+        service._resetTemplateCache(False)
+        service._resolveOid('ifInOctets')
+        service._resolveOid('ifInOctets')
+        self.assertEqual(4, mibs.lookups)
+
+    def testGetDeviceConfigsResetsCache(self):
+        service, template = self.service, self.template
+        service.devices = [Device('dev%d' % i, template, self.perf1)
+                           for i in range(3)]
+        service.remote_getDeviceConfigs()
+        self.assertEqual(1, template.compiles)
+        self.assertCacheOff()
+
+        # a template edit shows up in the next build
+        template.datasources.append(
+            DataSource('ifOutOctets', '1.3.6.1.2.1.2.2.1.16'))
+        service.compiled = []
+        service.remote_getDeviceConfigs()
+        self.assertEqual(2, template.compiles)
+        self.assertEqual([2, 2, 2], [len(c) for c in service.compiled])
+        self.assertCacheOff()
+
+        service.error = Exception('failed build')
+        self.assertRaises(Exception, service.remote_getDeviceConfigs)
+        self.assertCacheOff()
+
+    def testPushConfigResetsCache(self):
+        service, template = self.service, self.template
+        device = Device('dev1', template, self.perf1)
+        service._pushConfig(device)
+        service._pushConfig(device)
+        self.assertEqual(2, template.compiles)
+        self.assertCacheOff()
+
+        service.error = Exception('failed push')
+        self.assertRaises(Exception, service._pushConfig, device)
+        self.assertCacheOff()
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestSnmpPerformanceConfig))
+    return suite
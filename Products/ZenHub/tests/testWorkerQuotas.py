@@ -0,0 +1,222 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2014, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+import collections
+import cPickle as pickle
+import logging
+
+from twisted.internet import defer
+
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+# Import from zenhub before importing twisted.internet.reactor
+from Products.ZenHub import zenhub
+from Products.ZenHub.zenhub import ZenHub, HubWorklistItem, _ZenHubWorklist
+
+log = logging.getLogger('zen.testWorkerQuotas')
+
+
+class Object(object):
+    pass
+
+
+class MockReactor(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def callLater(self, seconds, f, *args):
+        self.calls.append((f, args))
+
+
+class MockWorker(object):
+    busy = False
+
+    def __init__(self):
+        self.calls = []
+
+    def callRemote(self, method, *args):
+        d = defer.Deferred()
+        self.calls.append((args, d))
+        return d
+
+    def finish(self, result):
+        args, d = self.calls.pop(0)
+        d.callback([pickle.dumps(result)])
+
+
+class MockWorkerSelector(object):
+
+    def getCandidateWorkerIds(self, method, workers):
+        return (i for i, worker in enumerate(workers) if not worker.busy)
+
+
+class Hub(object):
+    """
+    Dispatches jobs to workers the way zenhub does.
+    """
+    shutdown = False
+    _overQuota = ZenHub._overQuota.im_func
+    _releaseOverQuotaJobs = ZenHub._releaseOverQuotaJobs.im_func
+    _sendToWorker = ZenHub._sendToWorker.im_func
+    _executeFailed = ZenHub._executeFailed.im_func
+    finished = ZenHub.finished.im_func
+    giveWorkToWorkers = ZenHub.giveWorkToWorkers.im_func
+    updateStatusAtStart = ZenHub.updateStatusAtStart.im_func
+    updateStatusAtFinish = ZenHub.updateStatusAtFinish.im_func
+
+    def __init__(self, workers, maxServiceJobs=0, maxCollectorJobs=0):
+        self.log = log
+        self.options = Object()
+        self.options.maxServiceJobs = maxServiceJobs
+        self.options.maxCollectorJobs = maxCollectorJobs
+        self.workers = [MockWorker() for i in range(workers)]
+        self.workerselector = MockWorkerSelector()
+        self.workList = _ZenHubWorklist()
+        self.workTracker = {}
+        self.executionTimer = collections.defaultdict(lambda: [0, 0.0, 0.0, 0])
+        self.counters = collections.Counter()
+        self.runningByService = collections.Counter()
+        self.runningByInstance = collections.Counter()
+        self.overQuotaJobs = collections.defaultdict(list)
+
+    def queue(self, servicename, instance, count):
+        jobs = []
+        for i in range(count):
+            job = HubWorklistItem(0, i, defer.Deferred(), servicename,
+                                  instance, 'getDeviceConfigs',
+                                  (servicename, instance, 'getDeviceConfigs',
+                                   []))
+            self.workList.push(job)
+            jobs.append(job)
+        return jobs
+
+    def running(self):
+        return [args[0] for worker in self.workers
+                for args, d in worker.calls]
+
+    def finish(self, servicename=None, instance=None):
+        for worker in self.workers:
+            for args, d in worker.calls:
+                if servicename in (None, args[0]) and \
+                        instance in (None, args[1]):
+                    worker.finish('done')
+                    return
+
+
+class TestWorkerQuotas(BaseTestCase):
+
+    def afterSetUp(self):
+        super(TestWorkerQuotas, self).afterSetUp()
+        self._reactor = zenhub.reactor
+        zenhub.reactor = MockReactor()
+
+    def beforeTearDown(self):
+        zenhub.reactor = self._reactor
+        super(TestWorkerQuotas, self).beforeTearDown()
+
+    def testOverQuota(self):
+        hub = Hub(1)
+        job = hub.queue('ConfigService', 'localhost', 1)[0]
+        hub.runningByService['ConfigService'] = 5
+        hub.runningByInstance['localhost'] = 5
+        self.assertEqual(None, hub._overQuota(job))
+
+        hub.options.maxCollectorJobs = 5
+        self.assertEqual(('collector', 'localhost'), hub._overQuota(job))
+        hub.options.maxServiceJobs = 5
+        self.assertEqual(('service', 'ConfigService'), hub._overQuota(job))
+        hub.runningByService['ConfigService'] = 4
+        self.assertEqual(('collector', 'localhost'), hub._overQuota(job))
+        hub.runningByInstance['localhost'] = 4
+        self.assertEqual(None, hub._overQuota(job))
+
+    def testJobsSentWithoutWaiting(self):
+        hub = Hub(3)
+        hub.queue('ConfigService', 'localhost', 4)
+        hub.giveWorkToWorkers()
+        # every worker got a job in a single pass
+        self.assertEqual([True] * 3, [w.busy for w in hub.workers])
+        self.assertEqual(1, len(hub.workList))
+        self.assertEqual(3, hub.runningByService['ConfigService'])
+
+        hub.workers[1].finish('done')
+        self.assertFalse(hub.workers[1].busy)
+        self.assertEqual(2, hub.runningByService['ConfigService'])
+        hub.giveWorkToWorkers()
+        self.assertEqual(0, len(hub.workList))
+        self.assertEqual(3, hub.runningByService['ConfigService'])
+
+    def testResultsReturned(self):
+        hub = Hub(1)
+        job = hub.queue('ConfigService', 'localhost', 1)[0]
+        results = []
+        job.deferred.addCallback(results.append)
+        hub.giveWorkToWorkers()
+        hub.workers[0].finish(['config'])
+        self.assertEqual([['config']], results)
+
+    def testMaxServiceJobs(self):
+        hub = Hub(4, maxServiceJobs=2)
+        hub.queue('ConfigService', 'localhost', 4)
+        hub.queue('EventService', 'localhost', 1)
+        hub.giveWorkToWorkers()
+        self.assertEqual(['ConfigService', 'ConfigService', 'EventService'],
+                         sorted(hub.running()))
+        # the jobs over quota wait apart from the worklist
+        self.assertEqual(0, len(hub.workList))
+        self.assertEqual(2, len(hub.overQuotaJobs['service', 'ConfigService']))
+
+        # nothing changes until a job of the service finishes
+        hub.giveWorkToWorkers()
+        self.assertEqual(3, len(hub.running()))
+        hub.finish('EventService')
+        self.assertEqual(2, len(hub.overQuotaJobs['service', 'ConfigService']))
+
+        hub.finish('ConfigService')
+        self.assertEqual(2, len(hub.workList))
+        self.assertFalse(hub.overQuotaJobs)
+        hub.giveWorkToWorkers()
+        self.assertEqual(['ConfigService', 'ConfigService'], hub.running())
+        self.assertEqual(1, len(hub.overQuotaJobs['service', 'ConfigService']))
+
+    def testMaxCollectorJobs(self):
+        hub = Hub(4, maxCollectorJobs=1)
+        hub.queue('ConfigService', 'collector1', 2)
+        hub.queue('EventService', 'collector1', 1)
+        hub.queue('ConfigService', 'collector2', 1)
+        hub.giveWorkToWorkers()
+        self.assertEqual(2, len(hub.running()))
+        self.assertEqual(1, hub.runningByInstance['collector1'])
+        self.assertEqual(1, hub.runningByInstance['collector2'])
+        self.assertEqual(2, len(hub.overQuotaJobs['collector', 'collector1']))
+
+        hub.finish(instance='collector1')
+        hub.giveWorkToWorkers()
+        self.assertEqual(1, hub.runningByInstance['collector1'])
+        self.assertEqual(1, len(hub.overQuotaJobs['collector', 'collector1']))
+
+    def testWorkerError(self):
+        hub = Hub(1, maxServiceJobs=1)
+        failed, waiting = hub.queue('ConfigService', 'localhost', 2)
+        errors = []
+        failed.deferred.addErrback(errors.append)
+        hub.giveWorkToWorkers()
+        args, d = hub.workers[0].calls.pop(0)
+        d.errback(Exception('worker died'))
+        self.assertEqual(1, len(errors))
+        # the failed job frees its quota as well
+        self.assertEqual(0, hub.runningByService['ConfigService'])
+        self.assertEqual([waiting], list(hub.workList.otherworklist))
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestWorkerQuotas))
+    return suite
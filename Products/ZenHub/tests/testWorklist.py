@@ -167,6 +167,29 @@ class TestWorklist(BaseTestCase):
         self.assertEqual(len(worklist.otherworklist), 0)
         self.assertEqual(len(worklist), 0)
 
+    def testWeightedFairness(self):
+        worklist = _ZenHubWorklist()
+        for i in range(70):
+            worklist.push(MockHubWorklistItem(method='test', value=i))
+            worklist.push(MockHubWorklistItem(method='sendEvents', value=i))
+            worklist.push(MockHubWorklistItem(method='applyDataMaps', value=i))
+        methods = collections.Counter(worklist.pop().method for i in range(70))
+        self.assertEqual(methods['sendEvents'], 40)
+        self.assertEqual(methods['test'], 20)
+        self.assertEqual(methods['applyDataMaps'], 10)
+
+    def testApplyNotStarved(self):
+        worklist = _ZenHubWorklist()
+        worklist.push(MockHubWorklistItem(method='applyDataMaps', value=0))
+        for i in range(100):
+            worklist.push(MockHubWorklistItem(method='sendEvents', value=i))
+        methods = [worklist.pop().method for i in range(5)]
+        self.assertIn('applyDataMaps', methods)
+
+    def testPopEmpty(self):
+        worklist = _ZenHubWorklist()
+        self.assertRaises(IndexError, worklist.pop)
+
 
 def test_suite():
     from unittest import TestSuite, makeSuite
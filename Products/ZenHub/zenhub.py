@@ -30,7 +30,6 @@ import signal
 import cPickle as pickle
 import os
 import subprocess
-from random import choice
 
 from twisted.cred import portal, checkers, credentials
 from twisted.spread import pb, banana
@@ -39,7 +38,6 @@ banana.SIZE_LIMIT = 1024 * 1024 * 10
 from twisted.internet import reactor, protocol, defer
 from twisted.web import server, xmlrpc
 from twisted.internet.error import ProcessExitedAlready
-from twisted.internet.defer import inlineCallbacks, returnValue
 from zope.event import notify
 from zope.interface import implements
 from zope.component import getUtility, getUtilitiesFor, adapts
@@ -257,10 +255,21 @@ class WorkerInterceptor(pb.Referenceable):
 
     def remoteMessageReceived(self, broker, message, args, kw):
         """Intercept requests and send them down to workers"""
-        svc = str(self.service.__class__).rpartition('.')[0]
-        instance = self.service.instance
         args = broker.unserialize(args)
         kw = broker.unserialize(kw)
+        # A service can answer a request here, where it sees invalidations,
+        # and hand it on to workers only as needed
+        local = getattr(self.service, 'local_' + message, None)
+        if local is not None:
+            deferred = defer.maybeDeferred(local, self._deferToWorker,
+                                           *args, **kw)
+        else:
+            deferred = self._deferToWorker(message, *args, **kw)
+        return broker.serialize(deferred, self.perspective)
+
+    def _deferToWorker(self, message, *args, **kw):
+        svc = str(self.service.__class__).rpartition('.')[0]
+        instance = self.service.instance
         # hide the types in the args: subverting the jelly protection mechanism,
         # but the types just passed through and the worker may not have loaded
         # the required service before we try passing types for that service
@@ -275,8 +284,7 @@ class WorkerInterceptor(pb.Referenceable):
             chunkedArgs.append(chunk)
             pickledArgs = pickledArgs[chunkSize:]
 
-        deferred = self.zenhub.deferToWorker(svc, instance, message, chunkedArgs)
-        return broker.serialize(deferred, self.perspective)
+        return self.zenhub.deferToWorker(svc, instance, message, chunkedArgs)
 
     def __getattr__(self, attr):
         """Implement the HubService interface by forwarding to the local service"""
@@ -285,16 +293,20 @@ class WorkerInterceptor(pb.Referenceable):
 
 class _ZenHubWorklist(object):
 
+    # relative share of dispatches given to each queue when all have work
+    EVENT_WEIGHT = 4
+    OTHER_WEIGHT = 2
+    APPLY_WEIGHT = 1
+
     def __init__(self):
         self.eventworklist = []
         self.otherworklist = []
         self.applyworklist = []
 
-        #priority lists for eventual task selection. All queues are appended in case
-        #any of them are empty.
-        self.eventPriorityList = [self.eventworklist, self.otherworklist, self.applyworklist]
-        self.otherPriorityList = [self.otherworklist, self.applyworklist, self.eventworklist]
-        self.applyPriorityList = [self.applyworklist, self.eventworklist, self.otherworklist]
+        # queues and their weights for smooth weighted round robin selection
+        self._queues = (self.eventworklist, self.otherworklist, self.applyworklist)
+        self._weights = (self.EVENT_WEIGHT, self.OTHER_WEIGHT, self.APPLY_WEIGHT)
+        self._credits = [0] * len(self._queues)
         self.dispatch = {
             'sendEvents': self.eventworklist,
             'sendEvent': self.eventworklist,
@@ -311,22 +323,39 @@ class _ZenHubWorklist(object):
         """
         Select a single task to be distributed to a worker. We prioritize tasks as follows:
             sendEvents > configuration service calls > applyDataMaps
-        To prevent starving any queue in an event storm, we randomize the task selection,
-        preferring tasks according to the above priority.
+        To prevent starving any queue in an event storm, tasks are selected by
+        smooth weighted round robin: out of every 7 selections made while all
+        queues have work, 4 are events, 2 are service calls and 1 is an
+        applyDataMaps call. Queues without work do not accumulate credit.
         """
-        eventchain = filter(None, self.eventPriorityList)
-        otherchain = filter(None, self.otherPriorityList)
-        applychain = filter(None, self.applyPriorityList)
-        seq = choice([eventchain]*4 +
-                      [otherchain]*2 +
-                      [applychain]
-                                 )
-        return heapq.heappop(seq[0])
+        selected = None
+        total = 0
+        credits = self._credits
+        for i, queue in enumerate(self._queues):
+            if not queue:
+                credits[i] = 0
+                continue
+            credits[i] += self._weights[i]
+            total += self._weights[i]
+            if selected is None or credits[i] > credits[selected]:
+                selected = i
+        if selected is None:
+            raise IndexError("pop from empty worklist")
+        credits[selected] -= total
+        return heapq.heappop(self._queues[selected])
 
     def push(self, job):
         heapq.heappush(self[job.method], job)
     append = push
 
+    def oldest(self):
+        """
+        Return the receive time of the oldest queued task, or None if the
+        worklist is empty.
+        """
+        recvtimes = [job.recvtime for queue in self._queues for job in queue]
+        return min(recvtimes) if recvtimes else None
+
 def publisher(username, password, url):
     return HttpPostPublisher( username, password, url)
   
@@ -406,6 +435,15 @@ class ZenHub(ZCmdBase):
         self.workerprocessmap = {}
         self.shutdown = False
         self.counters = collections.Counter()
+        # number of jobs currently running on workers, per service and per
+        # collector instance, used to enforce the dispatch quotas
+        self.runningByService = collections.Counter()
+        self.runningByInstance = collections.Counter()
+        # jobs held back by a quota, keyed by the quota they would exceed,
+        # until a job counted against that quota finishes
+        self.overQuotaJobs = collections.defaultdict(list)
+        # (average batch size, seconds) of the last invalidation cycle
+        self.invalidationCycleStats = (0, 0.0)
 
         ZCmdBase.__init__(self)
         import Products.ZenHub
@@ -557,9 +595,10 @@ class ZenHub(ZCmdBase):
 
     def _filter_oids(self, oids):
         app = self.dmd.getPhysicalRoot()
-        i = 0
+        # oids already passed on; an object whose oids are all in here, like
+        # a component of a device already seen, need not be filtered again
+        seen = set()
         for oid in oids:
-            i += 1
             try:
                 obj = app._p_jar[oid]
             except POSKeyError:
@@ -573,6 +612,11 @@ class ZenHub(ZCmdBase):
                         # It's a delete. This should go through.
                         yield oid
                     else:
+                        newOids = [newOid for newOid in
+                                   self._transformOid(oid, obj)
+                                   if newOid not in seen]
+                        if not newOids:
+                            continue
                         included = True
                         for fltr in self._invalidation_filters:
                             result = fltr.include(obj)
@@ -580,10 +624,10 @@ class ZenHub(ZCmdBase):
                                 included = (result == FILTER_INCLUDE)
                                 break
                         if included:
-                            oids = self._transformOid(oid, obj)
-                            if oids:
-                                for oid in oids:
-                                    yield oid
+                            for newOid in newOids:
+                                if newOid not in seen:
+                                    seen.add(newOid)
+                                    yield newOid
 
     def _transformOid(self, oid, obj):
         oidTransform = IInvalidationOid(obj)
@@ -607,6 +651,9 @@ class ZenHub(ZCmdBase):
             def done(n):
                 if n:
                     self.log.debug('Processed %s oids' % n)
+                count, batches, elapsed = processor.lastCycleStats
+                self.counters['invalidationsProcessed'] += count
+                self.invalidationCycleStats = (batches and count / batches, elapsed)
 
             d.addCallback(done)
 
@@ -723,12 +770,17 @@ class ZenHub(ZCmdBase):
         self.executionTimer[job.method][0] += 1
         self.executionTimer[job.method][1] += idletime
         self.executionTimer[job.method][3] = now
+        self.counters['workItemWaitTime'] += int((now - job.recvtime) * 1000)
+        self.runningByService[job.servicename] += 1
+        self.runningByInstance[job.instance] += 1
         self.log.debug("Giving %s to worker %d, (%s)", job.method, wId, jobDesc)
         self.workTracker[wId] = WorkerStats('Busy', jobDesc, now, idletime)
 
     def updateStatusAtFinish(self, wId, job, error=None):
         now = time.time()
         self.executionTimer[job.method][3] = now
+        self.runningByService[job.servicename] -= 1
+        self.runningByInstance[job.instance] -= 1
         stats = self.workTracker.pop(wId, None)
         if stats:
             elapsed = now - stats.lastupdate
@@ -737,7 +789,28 @@ class ZenHub(ZCmdBase):
         self.workTracker[wId] = WorkerStats('Error: %s' % error if error else 'Idle',
                                             stats.description, now, 0)
 
-    @inlineCallbacks
+    def _overQuota(self, job):
+        """
+        Return the quota, ('service', servicename) or ('collector', instance),
+        that running the job now would exceed, or None if the job may run.
+        """
+        maxServiceJobs = self.options.maxServiceJobs
+        if maxServiceJobs and self.runningByService[job.servicename] >= maxServiceJobs:
+            return ('service', job.servicename)
+        maxCollectorJobs = self.options.maxCollectorJobs
+        if maxCollectorJobs and self.runningByInstance[job.instance] >= maxCollectorJobs:
+            return ('collector', job.instance)
+        return None
+
+    def _releaseOverQuotaJobs(self, job):
+        """
+        Put the jobs held back by the quotas of a finished job back in the
+        worklist.
+        """
+        for quota in (('service', job.servicename), ('collector', job.instance)):
+            for overQuotaJob in self.overQuotaJobs.pop(quota, ()):
+                self.workList.push(overQuotaJob)
+
     def finished(self, job, result, finishedWorker, wId):
         finishedWorker.busy = False
         error = None
@@ -764,49 +837,67 @@ class ZenHub(ZCmdBase):
             job.deferred.callback(result)
 
         self.updateStatusAtFinish(wId, job, error)
+        self._releaseOverQuotaJobs(job)
         reactor.callLater(0, self.giveWorkToWorkers)
-        yield returnValue(result)
+        return result
+
+    def _executeFailed(self, failure):
+        self.log.warning("Failed to execute job on zenhub worker")
+        return failure.value
+
+    def _sendToWorker(self, wId, worker, job):
+        """
+        Start a job on a worker without waiting for it to complete.
+        """
+        worker.busy = True
+        self.counters['workerItems'] += 1
+        self.updateStatusAtStart(wId, job)
+        d = worker.callRemote('execute', *job.args)
+        d.addErrback(self._executeFailed)
+        d.addCallback(lambda result: self.finished(job, result, worker, wId))
+        return d
 
-    @inlineCallbacks
     def giveWorkToWorkers(self, requeue=False):
-        """Parcel out a method invocation to an available worker process
+        """Parcel out method invocations to all available worker processes.
+
+        Jobs are handed to every idle worker in a single pass; results are
+        handled as they arrive by L{finished}, which schedules the next pass.
         """
         if self.workList:
             self.log.debug("worklist has %d items", len(self.workList))
         incompleteJobs = []
+        retry = False
         while self.workList:
             if all(w.busy for w in self.workers):
                 self.log.debug("all workers are busy")
                 break
 
             job = self.workList.pop()
+            quota = self._overQuota(job)
+            if quota:
+                self.log.debug("quota reached for %s:%s, deferring %s",
+                               job.instance, job.servicename, job.method)
+                # held back until a job counted against the quota finishes
+                self.overQuotaJobs[quota].append(job)
+                continue
+
             self.log.debug("get candidate workers for %s...", job.method)
-            candidateWorkers = list(self.workerselector.getCandidateWorkerIds(job.method, self.workers))
-            self.log.debug("candidate workers are %r", candidateWorkers)
+            candidateWorkers = self.workerselector.getCandidateWorkerIds(job.method, self.workers)
             for i in candidateWorkers:
-                worker = self.workers[i]
-                worker.busy = True
-                self.counters['workerItems'] += 1
-                self.updateStatusAtStart(i, job)
-                try:
-                    result = yield worker.callRemote('execute', *job.args)
-                except Exception as ex:
-                    self.log.warning("Failed to execute job on zenhub worker")
-                    result = ex
-                finally:
-                    yield self.finished(job, result, worker, i)
+                self._sendToWorker(i, self.workers[i], job)
                 break
             else:
                 self.log.debug("no worker available for %s" % job.method)
                 #could not complete this job, put it back in the queue once
                 #we're finished saturating the workers
                 incompleteJobs.append(job)
+                retry = True
 
         for job in reversed(incompleteJobs):
             #could not complete this job, put it back in the queue
             self.workList.push(job)
 
-        if incompleteJobs:
+        if retry:
             reactor.callLater(0, self.giveWorkToWorkers)
 
         if requeue and not self.shutdown:
@@ -819,6 +910,8 @@ class ZenHub(ZCmdBase):
                  '\tOther:\t%s' % len(self.workList.otherworklist),
                  '\tApplyDataMaps:\t%s' % len(self.workList.applyworklist),
                  '\tTotal:\t%s' % len(self.workList),
+                 '\tOver quota:\t%s' % sum(len(jobs) for jobs in self.overQuotaJobs.itervalues()),
+                 '\tRunning by collector:\t%s' % dict((k, v) for k, v in self.runningByInstance.iteritems() if v > 0),
                  '\nHub Execution Timings: [method, count, idle_total, running_total, last_called_time]'
                  ]
 
@@ -929,6 +1022,14 @@ class ZenHub(ZCmdBase):
         r.gauge('services', len(self.services))
         r.counter('totalCallTime', totalTime)
         r.gauge('workListLength', len(self.workList))
+        r.gauge('eventWorkListLength', len(self.workList.eventworklist))
+        r.gauge('otherWorkListLength', len(self.workList.otherworklist))
+        r.gauge('applyWorkListLength', len(self.workList.applyworklist))
+        oldest = self.workList.oldest()
+        r.gauge('workListMaxWaitTime', time.time() - oldest if oldest else 0)
+        batchSize, cycleTime = self.invalidationCycleStats
+        r.gauge('invalidationBatchSize', batchSize)
+        r.gauge('invalidationCycleTime', cycleTime)
         for name, value in self.counters.items():
             r.counter(name, value)
 
@@ -1006,12 +1107,24 @@ class ZenHub(ZCmdBase):
         self.parser.add_option('--workers-reserved-for-events', dest='workersReservedForEvents',
             type='int', default=1,
             help="Number of worker instances to reserve for handling events")
+        self.parser.add_option('--max-service-jobs', dest='maxServiceJobs',
+            type='int', default=0,
+            help="Maximum number of jobs for a single service that may run on"
+                 " workers at once, 0 for no limit (default: %default)")
+        self.parser.add_option('--max-collector-jobs', dest='maxCollectorJobs',
+            type='int', default=0,
+            help="Maximum number of jobs for a single collector instance that"
+                 " may run on workers at once, 0 for no limit (default: %default)")
         self.parser.add_option('--worker-call-limit', dest='worker_call_limit',
             type='int', default=200,
             help="Maximum number of remote calls a worker can run before restarting")
         self.parser.add_option('--invalidation-poll-interval', 
             type='int', default=30,
             help="Interval at which to poll invalidations (default: %default)")
+        self.parser.add_option('--invalidation-batch-size',
+            type='int', default=100,
+            help="Number of invalidations delivered to services before"
+                 " yielding to the reactor (default: %default)")
         self.parser.add_option('--metrics-store-url', dest='metrics_store_url',
             type='string', default='http://localhost:8080/api/metrics/store',
             help='URL for posting internal metrics (default: %default)')
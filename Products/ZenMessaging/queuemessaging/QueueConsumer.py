@@ -82,6 +82,13 @@ class QueueConsumer(object):
         self.shuttingDown = True
         return self.consumer.shutdown()
 
+    def setPrefetch(self, prefetch):
+        """
+        Sets the number of unacknowledged messages the queue delivers to
+        this consumer.
+        """
+        self.consumer.setPrefetch(prefetch)
+
     def acknowledge(self, message):
         """
         Called from a task when it is done successfully processing
@@ -53,3 +53,23 @@ class MibBase(ZenModelRM, ZenPackable):
         """
         return [str(getattr(self, p)) for p in self.propertyIds() \
                 if str(getattr(self, p))]
+
+
+    def index_object(self, idxs=None):
+        super(MibBase, self).index_object(idxs)
+        self._mibsChanged()
+
+
+    def unindex_object(self):
+        super(MibBase, self).unindex_object()
+        self._mibsChanged()
+
+
+    def _mibsChanged(self):
+        """Tell the Mibs root that its OID trie is out of date.
+        """
+        try:
+            mibs = self.getDmdRoot("Mibs")
+        except (AttributeError, KeyError):
+            return
+        mibs.mibsChanged()
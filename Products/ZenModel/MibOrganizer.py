@@ -16,6 +16,8 @@ from Globals import DTMLFile
 from Globals import InitializeClass
 from AccessControl import ClassSecurityInfo
 from AccessControl import Permissions
+from Acquisition import aq_base
+from BTrees.Length import Length
 from Products.Jobber.jobs import SubprocessJob
 from Products.ZenModel.ZenossSecurity import *
 
@@ -23,6 +25,7 @@ from Products.ZenRelations.RelSchema import *
 from Products.ZenUtils.Search import makeCaseInsensitiveKeywordIndex
 from Products.ZenWidgets import messaging
 from Products.ZenUtils.Utils import binPath
+from Products.ZenUtils.OidTrie import OidTrie
 from Organizer import Organizer
 from MibModule import MibModule
 from ZenPackable import ZenPackable
@@ -38,31 +41,6 @@ def manage_addMibOrganizer(context, id, REQUEST = None):
 addMibOrganizer = DTMLFile('dtml/addMibOrganizer',globals())
 
 
-def _oid2name(mibSearch, oid, exactMatch=True, strip=False):
-    """Return a name for an oid. This function is extracted out of the
-    MibOrganizer class and takes mibSearch as a parameter to make it easier to
-    unit test.
-    """
-    oid = oid.strip('.')
-
-    if exactMatch:
-        brains = mibSearch(oid=oid)
-        if len(brains) > 0:
-            return brains[0].id
-        else:
-            return ""
-
-    oidlist = oid.split('.')
-    for i in range(len(oidlist), 0, -1):
-        brains = mibSearch(oid='.'.join(oidlist[:i]))
-        if len(brains) < 1: continue
-        if len(oidlist[i:]) > 0 and not strip:
-            return "%s.%s" % (brains[0].id, '.'.join(oidlist[i:]))
-        else:
-            return brains[0].id
-    return ""
-
-
 class MibOrganizer(Organizer, ZenPackable):
     meta_type = "MibOrganizer"
     dmdRootName = "Mibs"
@@ -107,21 +85,43 @@ class MibOrganizer(Organizer, ZenPackable):
             count += child.countMibs()
         return count
 
+    def mibsChanged(self):
+        """
+        Note that MIB nodes or notifications were indexed or unindexed, so
+        that the OID trie is rebuilt on next use. Called on the Mibs root.
+        """
+        generation = getattr(aq_base(self), '_mibGeneration', None)
+        if generation is None:
+            generation = self._mibGeneration = Length()
+        generation.change(1)
+        self._v_oidTrie = None
+
+    def getOidTrie(self):
+        """
+        Return an OidTrie of every OID in the mibSearch catalog. It is built
+        in one pass over the catalog once per MIB generation and shared by
+        the oid2name and name2oid lookups.
+        """
+        mibs = self.getDmdRoot("Mibs")
+        generation = getattr(aq_base(mibs), '_mibGeneration', None)
+        generation = generation() if generation is not None else 0
+        trie = getattr(aq_base(mibs), '_v_oidTrie', None)
+        if trie is None or trie[0] != generation:
+            oids = OidTrie((b.oid, b.id) for b in mibs.mibSearch() if b.oid)
+            trie = mibs._v_oidTrie = (generation, oids)
+        return trie[1]
+
     def oid2name(self, oid, exactMatch=True, strip=False):
         """
         Return a name for an oid.
         """
-        return _oid2name(self.getDmdRoot("Mibs").mibSearch, oid,
-            exactMatch, strip)
+        return self.getOidTrie().oid2name(oid, exactMatch, strip, default="")
 
     def name2oid(self, name):
         """
         Return an oid based on a name in the form MIB::name.
         """
-        brains = self.getDmdRoot("Mibs").mibSearch({'id': name})
-        if len(brains) > 0:
-            return brains[0].oid
-        return ''
+        return self.getOidTrie().name2oid(name, default="")
 
     def countClasses(self):
         """Count all mibs with in a MibOrganizer.
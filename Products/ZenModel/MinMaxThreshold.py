@@ -164,10 +164,6 @@ MinMaxThresholdClass = MinMaxThreshold
 
 
 class MinMaxThresholdInstance(MetricThresholdInstance):
-    # Not strictly necessary, but helps when restoring instances from
-    # pickle files that were not constructed with a count member.
-    count = {}
-
     def __init__(self, id, context, dpNames,
                  minval, maxval, eventClass, severity, escalateCount,
                  eventFields={}):
@@ -178,24 +174,26 @@ class MinMaxThresholdInstance(MetricThresholdInstance):
         self.escalateCount = escalateCount
         self.eventFields = eventFields
 
-    def countKey(self, dp):
-        return ':'.join(self.context().key()) + ':' + dp
+    def _counts(self):
+        # Counts are keyed by datapoint alone, since an instance only ever
+        # sees its own context. Instances restored from pickles made without
+        # a count member get their own dictionary here.
+        counts = self.__dict__.get('count')
+        if counts is None:
+            counts = self.count = {}
+        return counts
 
     def getCount(self, dp):
-        countKey = self.countKey(dp)
-        if not countKey in self.count:
-            return None
-        return self.count[countKey]
+        return self._counts().get(dp)
 
     def incrementCount(self, dp):
-        countKey = self.countKey(dp)
-        if not countKey in self.count:
-            self.resetCount(dp)
-        self.count[countKey] += 1
-        return self.count[countKey]
+        counts = self._counts()
+        count = counts[dp] = counts.get(dp, 0) + 1
+        return count
 
     def resetCount(self, dp):
-        self.count[self.countKey(dp)] = 0
+        # only breached datapoints keep a count
+        self._counts().pop(dp, None)
 
     def checkRange(self, dp, value):
         'Check the value for min/max thresholds'
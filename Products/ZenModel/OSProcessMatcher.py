@@ -13,6 +13,7 @@ import os
 import time
 import signal
 from contextlib import contextmanager
+from itertools import izip
 from sre_parse import parse_template
 from md5 import md5
 
@@ -22,6 +23,15 @@ log = logging.getLogger("zen.osprocessmatcher")
 
 BLANK_PARSE_TEMPLATE = ([],[])
 
+# The re module refuses patterns with 100 groups or more
+MAX_MERGED_GROUPS = 99
+# Include regexes that can't be merged into an alternation: group
+# references and conditionals would point at the wrong group, and inline
+# flags would apply to every alternative
+UNMERGEABLE_REGEX = re.compile(r'\\[1-9]|\(\?P=|\(\?\(|\(\?[iLmsux]')
+# Generated names remembered by a matcher set before it starts over
+MAX_GENERATED_NAMES = 10000
+
 class OSProcessClassMatcher(object):
     """
     Mixin class, for process command line matching functionality common to
@@ -210,29 +220,158 @@ class OSProcessClassDataMatcher(DataHolder, OSProcessClassMatcher):
 class OSProcessDataMatcher(DataHolder, OSProcessMatcher):
     pass
 
+class OSProcessMatcherSet(object):
+    """
+    A list of process matchers compiled for classifying many command lines.
+    As with applyOSProcessClassMatchers, a command line belongs to the first
+    matcher that matches it.
+
+    The include regexes of consecutive matchers are merged into
+    alternations, so a command line that no matcher includes is rejected
+    with a few searches instead of one per matcher. OSProcessMatchers of
+    the same process class are looked up by generated id instead of being
+    tried one after the other, in the position of the first of them.
+    Generated names are remembered per command line.
+    """
+
+    def __init__(self, matchers):
+        self.matchers = list(matchers)
+        self._names = {}
+        self._ids = {}
+
+        # each rule is a matcher standing for its process class, and for
+        # OSProcessMatchers the matchers of that class by generated id
+        rules = []
+        byClass = {}
+        for matcher in self.matchers:
+            if not matcher._compiledRegex('includeRegex'):
+                continue
+            key = (matcher.includeRegex, matcher.excludeRegex,
+                   matcher.replaceRegex, matcher.replacement,
+                   matcher.processClassPrimaryUrlPath())
+            rule = byClass.get(key)
+            if rule is None:
+                byId = {} if isinstance(matcher, OSProcessMatcher) else None
+                rule = byClass[key] = (matcher, byId)
+                rules.append(rule)
+            if rule[1] is not None:
+                rule[1].setdefault(getattr(matcher, 'generatedId', False),
+                                   matcher)
+        self._chunks = self._merge(rules)
+
+    def _merge(self, rules):
+        """
+        Split the rules into runs whose include regexes are searched at
+        once. Returns a list of (merged regex or None, rules).
+        """
+        runs = []
+        current = None
+        for rule in rules:
+            regex = rule[0].includeRegex
+            groups = rule[0]._compiledRegex('includeRegex').groups
+            if UNMERGEABLE_REGEX.search(regex) or \
+                    groups >= MAX_MERGED_GROUPS:
+                runs.append((None, [rule]))
+                current = None
+                continue
+            if current is None or current[2] + groups >= MAX_MERGED_GROUPS:
+                current = [[], [], 0]
+                runs.append(current)
+            current[0].append('(?:%s)' % regex)
+            current[1].append(rule)
+            current[2] += groups
+
+        chunks = []
+        for run in runs:
+            merged = None
+            if run[0] is not None and len(run[1]) > 1:
+                try:
+                    merged = re.compile('|'.join(run[0]))
+                except re.error:
+                    log.debug("Unable to merge include regexes %s", run[0])
+            chunks.append((merged, run[1]))
+        return chunks
+
+    def match(self, processText):
+        """
+        Find the matcher a process's command line belongs to.
+
+        @return: the matcher and the name it generates, or (None, None)
+        @rtype: tuple
+        """
+        if not processText:
+            return None, None
+        processText = processText.strip()
+        for merged, rules in self._chunks:
+            if merged is not None and not merged.search(processText):
+                continue
+            for matcher, byId in rules:
+                if not matcher._searchIncludeRegex(processText) or \
+                        matcher._searchExcludeRegex(processText):
+                    continue
+                name = self.generateName(matcher, processText)
+                if byId is None:
+                    return matcher, name
+                found = byId.get(self._generateId(matcher, name))
+                if found is not None:
+                    return found, name
+        return None, None
+
+    def classify(self, lines):
+        """
+        Match a batch of command lines. Each distinct line is matched once.
+
+        @return: the matcher and generated name of each line, as returned
+            by match
+        @rtype: list of tuples
+        """
+        seen = {}
+        results = []
+        for line in lines:
+            result = seen.get(line)
+            if result is None:
+                result = seen[line] = self.match(line)
+            results.append(result)
+        return results
+
+    def generateName(self, matcher, processText):
+        """
+        Return matcher.generateName(processText), remembered per command line
+        """
+        key = (matcher, processText)
+        name = self._names.get(key)
+        if name is None:
+            if len(self._names) >= MAX_GENERATED_NAMES:
+                self._names.clear()
+                self._ids.clear()
+            name = self._names[key] = matcher.generateName(processText)
+        return name
+
+    def _generateId(self, matcher, name):
+        key = (matcher, name)
+        generatedId = self._ids.get(key)
+        if generatedId is None:
+            generatedId = self._ids[key] = matcher.generateIdFromName(name)
+        return generatedId
+
 def applyOSProcessClassMatchers(matchers, lines):
     """
     @return (matched, unmatched), where...
             matched is: {matcher => {generatedName => [line, ...], ...}, ...}
             unmatched is: [line, ...]
     """
+    if not isinstance(matchers, OSProcessMatcherSet):
+        matchers = OSProcessMatcherSet(matchers)
+    lines = list(lines)
     matched = {}
     unmatched = []
-    for line in lines:
+    for line, (matcher, generatedName) in izip(lines, matchers.classify(lines)):
         log.debug("COMMAND LINE: %s", line)
-        unmatchedLine = True
-        for matcher in matchers:
-            if matcher.matches(line):
-                if matcher not in matched:
-                    matched[matcher] = {}
-                generatedName = matcher.generateName(line)
-                if generatedName not in matched[matcher]:
-                    matched[matcher][generatedName] = []
-                matched[matcher][generatedName].append(line)
-                unmatchedLine = False
-                break
-        if unmatchedLine:
+        if matcher is None:
             unmatched.append(line)
+        else:
+            matched.setdefault(matcher, {}).setdefault(generatedName, []) \
+                .append(line)
     return (matched, unmatched)
 
 def applyOSProcessMatchers(matchers, lines):
@@ -241,24 +380,40 @@ def applyOSProcessMatchers(matchers, lines):
             matched is: {generatedName => [line, ...], ...}
             unmatched is: [line, ...]
     """
+    if not isinstance(matchers, OSProcessMatcherSet):
+        matchers = OSProcessMatcherSet(matchers)
+    lines = list(lines)
     matched = {}
     unmatched = []
-    for line in lines:
+    for line, (matcher, _) in izip(lines, matchers.classify(lines)):
         log.debug("COMMAND LINE: %s", line)
-        unmatchedLine = True
-        for matcher in matchers:
-            if matcher.matches(line):
-                if matcher.generatedName not in matched:
-                    matched[matcher.generatedName] = []
-                matched[matcher.generatedName].append(line)
-                unmatchedLine = False
-                break
-        if unmatchedLine:
+        if matcher is None:
             unmatched.append(line)
+        else:
+            matched.setdefault(matcher.generatedName, []).append(line)
     return (matched, unmatched)
 
+# Compiled matcher sets by process class match data, so that modeling many
+# devices against the same process classes compiles them once
+_matcherSets = {}
+MAX_MATCHER_SETS = 16
+
+def getOSProcessClassMatcherSet(processClassMatchData):
+    """
+    Return an OSProcessMatcherSet of OSProcessClassDataMatchers for a
+    device's osProcessClassMatchData.
+    """
+    key = tuple(tuple(sorted(d.iteritems())) for d in processClassMatchData)
+    matcherSet = _matcherSets.get(key)
+    if matcherSet is None:
+        if len(_matcherSets) >= MAX_MATCHER_SETS:
+            _matcherSets.clear()
+        matcherSet = _matcherSets[key] = OSProcessMatcherSet(
+            OSProcessClassDataMatcher(**d) for d in processClassMatchData)
+    return matcherSet
+
 def buildObjectMapData(processClassMatchData, lines):
-    matchers = map(lambda(d):OSProcessClassDataMatcher(**d), processClassMatchData)
+    matchers = getOSProcessClassMatcherSet(processClassMatchData)
     matched, unmatched = applyOSProcessClassMatchers(matchers, lines)
     result = []
     for matcher, matchSet in matched.items():
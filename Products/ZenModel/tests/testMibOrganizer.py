@@ -14,44 +14,23 @@ if __name__ == '__main__':
 
 from Products.ZenModel.Exceptions import *
 from Products.ZenModel.MibOrganizer import *
-from Products.ZenModel.MibOrganizer import _oid2name
 from Products.Zuul import getFacade
 from ZenModelBaseTest import ZenModelBaseTest
 
 
-class MockBrain(object):
-
-    def __init__(self, oid=None, id=None):
-        self.oid = oid
-        self.id = id
-
-
-class MockCatalog(object):
-
-    def __init__(self, *brains):
-        self.brains = brains
-        
-    def __call__(self, **query):
-        matches = list(self.brains[:])
-        for brain in self.brains:
-            for query_key in query.keys():
-                if not hasattr(brain, query_key):
-                    raise Exception('brain is missing %s' % query_key)
-                if getattr(brain, query_key) != query[query_key]:
-                    matches.remove(brain)
-                    break
-        return matches
-
-
 class TestOid2Name(ZenModelBaseTest):
-    """tests the oid2name function
+    """tests oid2name and name2oid against the mibSearch catalog
     """
-    
-    def runTest(self):
-        brain = MockBrain(oid='1.3.6.1.4.1.4743.1.2.2.66',
-                          id='expedIfBssAAAVlanAtts')
-        self.mibSearch = MockCatalog(brain)
-        
+
+    def afterSetUp(self):
+        super(TestOid2Name, self).afterSetUp()
+        self.mibOrg = self.dmd.Mibs
+        self.mod = self.mibOrg.createMibModule('EXPED-MIB')
+        self.mod.createMibNode(id='expedIfBssAAAVlanAtts',
+                               moduleName='EXPED-MIB', nodetype='MibNode',
+                               oid='1.3.6.1.4.1.4743.1.2.2.66')
+
+    def testOid2Name(self):
         # exact matching without stripping
         self.doassert(
             '.1.3.6.1.4.1.4743.1.2.2.66', 'expedIfBssAAAVlanAtts',
@@ -59,7 +38,7 @@ class TestOid2Name(ZenModelBaseTest):
         self.doassert(
             '.1.3.6.1.4.1.4743.1.2.2.66.0', '',
             exactMatch=True, strip=False)
-        
+
         # exact matching with stripping
         self.doassert(
             '.1.3.6.1.4.1.4743.1.2.2.66', 'expedIfBssAAAVlanAtts',
@@ -83,10 +62,38 @@ class TestOid2Name(ZenModelBaseTest):
         self.doassert(
             '.1.3.6.1.4.1.4743.1.2.2.66.0', 'expedIfBssAAAVlanAtts',
             exactMatch=False, strip=True)
-    
-    
+
+        # no match at all
+        self.doassert('.1.2.3', '', exactMatch=False, strip=False)
+
+    def testName2Oid(self):
+        self.assertEqual('1.3.6.1.4.1.4743.1.2.2.66',
+                         self.mibOrg.name2oid('expedIfBssAAAVlanAtts'))
+        self.assertEqual('', self.mibOrg.name2oid('noSuchNode'))
+
+    def testTrieRebuiltForNewNodes(self):
+        trie = self.mibOrg.getOidTrie()
+        self.assert_(self.mibOrg.getOidTrie() is trie)
+        generation = self.mibOrg._mibGeneration()
+
+        # indexing a new node bumps the generation
+        self.mod.createMibNode(id='expedNew', moduleName='EXPED-MIB',
+                               nodetype='MibNode',
+                               oid='1.3.6.1.4.1.4743.1.2.2.67')
+        self.assert_(self.mibOrg._mibGeneration() > generation)
+        self.assert_(self.mibOrg.getOidTrie() is not trie)
+        self.doassert('.1.3.6.1.4.1.4743.1.2.2.67', 'expedNew',
+                      exactMatch=True, strip=False)
+
+        # and so does unindexing one
+        generation = self.mibOrg._mibGeneration()
+        self.mod.deleteMibNodes(['expedNew'])
+        self.assert_(self.mibOrg._mibGeneration() > generation)
+        self.doassert('.1.3.6.1.4.1.4743.1.2.2.67', '',
+                      exactMatch=True, strip=False)
+
     def doassert(self, oid, expected, exactMatch, strip):
-        actual = _oid2name(self.mibSearch, oid, exactMatch, strip)
+        actual = self.mibOrg.oid2name(oid, exactMatch, strip)
         self.assertEqual(expected, actual, 
                          'expected "%s" but got "%s"' % (expected, actual))
 
@@ -152,6 +152,22 @@ class TestMinMaxThreshold(ZenModelBaseTest):
         self.assert_(result[0]['current'] == 100)
         self.assert_(result[0]['how'] == 'violated')
 
+    def testEscalation(self):
+        self.threshold.minimum = None
+        self.threshold.maximum = 100
+        self.threshold.escalateCount = 2
+        severity = self.threshold.severity
+        result = self.threshold.checkRange('point', 101)
+        self.assertEqual(1, result[0]['escalation_count'])
+        self.assertEqual(severity, result[0]['severity'])
+        result = self.threshold.checkRange('point', 101)
+        self.assertEqual(2, result[0]['escalation_count'])
+        self.assertEqual(min(severity + 1, 5), result[0]['severity'])
+        # other datapoints keep their own counts
+        self.assertEqual(None, self.threshold.getCount('other'))
+        self.threshold.checkRange('point', 50)
+        self.assertEqual(None, self.threshold.getCount('point'))
+
 
 def test_suite():
     from unittest import TestSuite, makeSuite
@@ -0,0 +1,101 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2014, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+from Products.ZenModel.OSProcessMatcher import OSProcessClassDataMatcher, \
+    OSProcessDataMatcher, OSProcessMatcherSet, applyOSProcessClassMatchers, \
+    buildObjectMapData, getOSProcessClassMatcherSet
+
+
+def classMatcher(name, includeRegex, excludeRegex=None,
+                 replaceRegex='.*', replacement=None):
+    return OSProcessClassDataMatcher(
+        includeRegex=includeRegex,
+        excludeRegex=excludeRegex,
+        replaceRegex=replaceRegex,
+        replacement=replacement or name,
+        primaryUrlPath='/zport/dmd/Processes/osProcessClasses/' + name,
+        primaryDmdId='/Processes/' + name)
+
+
+class TestOSProcessMatcherSet(BaseTestCase):
+
+    def assertSameAsMatchers(self, matchers, lines):
+        matcherSet = OSProcessMatcherSet(matchers)
+        for line in lines:
+            expected = (None, None)
+            for matcher in matchers:
+                if matcher.matches(line):
+                    expected = matcher, matcher.generateName(line)
+                    break
+            self.assertEqual(expected, matcherSet.match(line))
+
+    def testFirstMatchWins(self):
+        matchers = [
+            classMatcher('java', 'java', excludeRegex='zeneventserver'),
+            # group references and inline flags are not merged
+            classMatcher('pair', r'(\w)\1x'),
+            classMatcher('ssh', '(?i)SSHD'),
+            classMatcher('python', r'python(\d)?', replaceRegex=r'.*python(\d)?.*',
+                         replacement=r'py\1'),
+            classMatcher('any', '.'),
+            classMatcher('never', 'never'),
+        ]
+        self.assertSameAsMatchers(matchers, [
+            '/usr/bin/java -jar app.jar',
+            '/usr/bin/java -jar zeneventserver.jar',
+            'aax', 'sshd: root', '/usr/bin/python2 zenhub.py',
+            'python', ' never ', '', '   '])
+
+    def testManyGroups(self):
+        matchers = [classMatcher('m%d' % i, '(a)(b)(%d)' % i)
+                    for i in range(100)]
+        matcherSet = OSProcessMatcherSet(matchers)
+        self.assertTrue(len(matcherSet._chunks) > 1)
+        self.assertSameAsMatchers(matchers, ['ab0', 'ab42', 'ab99', 'abc'])
+
+    def testGeneratedIds(self):
+        def processMatcher(name):
+            matcher = OSProcessDataMatcher(
+                includeRegex='python', excludeRegex=None,
+                replaceRegex=r'.*python (\w+).*', replacement=r'\1',
+                primaryUrlPath='/zport/dmd/Processes/osProcessClasses/python')
+            matcher.generatedId = matcher.generateIdFromName(name)
+            return matcher
+        matchers = [processMatcher('zenhub'), processMatcher('zenping')]
+        self.assertSameAsMatchers(matchers, [
+            'python zenhub', 'python zenping --cycle', 'python zenperf'])
+
+    def testClassify(self):
+        matchers = [classMatcher('httpd', 'httpd', replaceRegex=r'.*(httpd).*',
+                                 replacement=r'\1')]
+        matched, unmatched = applyOSProcessClassMatchers(
+            matchers, ['/sbin/httpd -k', '/sbin/httpd -k', 'init'])
+        self.assertEqual({matchers[0]: {'httpd': ['/sbin/httpd -k'] * 2}},
+                         matched)
+        self.assertEqual(['init'], unmatched)
+
+    def testBuildObjectMapData(self):
+        matchData = [dict(includeRegex='httpd', excludeRegex=None,
+                          replaceRegex='.*', replacement='httpd',
+                          primaryUrlPath='url', primaryDmdId='/httpd')]
+        self.assertTrue(getOSProcessClassMatcherSet(matchData) is
+                        getOSProcessClassMatcherSet([dict(matchData[0])]))
+        data = buildObjectMapData(matchData, ['httpd -k', 'init'])
+        self.assertEqual(1, len(data))
+        self.assertEqual('httpd', data[0]['displayName'])
+        self.assertEqual('/httpd', data[0]['setOSProcessClass'])
+        self.assertEqual(['httpd -k'], data[0]['monitoredProcesses'])
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestOSProcessMatcherSet))
+    return suite
@@ -11,8 +11,11 @@
 import logging
 log = logging.getLogger('zen.ZenRRD.CommandParser')
 
+import re
 from pprint import pformat
 
+_leadingSpace = re.compile(r'\s*')
+
 class ParsedResults(object):
 
     def __init__(self):
@@ -38,9 +41,12 @@ class CommandParser(object):
         @return: None.
         """
         
-        # If the command was echoed back, strip it off
-        if cmd.result.output.lstrip().startswith(cmd.command):
-            cmd.result.output = cmd.result.output.lstrip()[len(cmd.command):]
+        # If the command was echoed back, strip it off.  The output can be
+        # large, so only copy it when there is something to strip.
+        output = cmd.result.output
+        start = _leadingSpace.match(output).end()
+        if output.startswith(cmd.command, start):
+            cmd.result.output = output[start + len(cmd.command):]
 
     def processResults(self, cmd, results):
         """
@@ -63,3 +69,35 @@ class CommandParser(object):
         generated in the processResults function.
         """
         return True
+
+
+class ParserRegistry(object):
+    """
+    Resolves parser plugin loaders to parser classes once, rather than
+    importing the plugin module again for every command result. Parsers
+    are looked up by plugin package and module path, so the loaders sent
+    with each configuration share the classes resolved before.
+    """
+
+    def __init__(self):
+        self._classes = {}
+
+    def __len__(self):
+        return len(self._classes)
+
+    def clear(self):
+        self._classes.clear()
+
+    def create(self, loader):
+        """
+        Return a new parser for a PluginLoader.  Raises PluginImportError
+        when the plugin can not be loaded; failures are not remembered so
+        that a later call tries again.
+        """
+        key = loader.package, loader.modPath
+        cls = self._classes.get(key)
+        if cls is None:
+            parser = loader.create()
+            self._classes[key] = parser.__class__
+            return parser
+        return cls()
@@ -12,7 +12,14 @@ import logging
 log = logging.getLogger('zen.thresholds')
 
 class Thresholds:
-    "Class for holding multiple Thresholds, used in most collectors"
+    """
+    Class for holding multiple Thresholds, used in most collectors.
+
+    Thresholds are indexed by the (context key, datapoint) pair they are
+    checked against. Each entry maps threshold keys to thresholds, so a
+    threshold is removed or replaced without scanning the others on the
+    same datapoint.
+    """
 
     def __init__(self):
         self.byKey = {}
@@ -20,40 +27,48 @@ class Thresholds:
         self.byDevice = {}
 
     def _contextKey(self, contextKey, dp):
-        return '%s/%s' % (contextKey, dp)
-
+        return contextKey, dp
 
     def remove(self, threshold):
+        key = threshold.key()
         d = self.byDevice.get(threshold.context().deviceName, None)
-        if d and threshold.key() in d:
-            del d[threshold.key()]
-        doomed = self.byKey.get(threshold.key(), None)
+        if d and key in d:
+            del d[key]
+        doomed = self.byKey.pop(key, None)
         if doomed:
-            del self.byKey[doomed.key()]
             ctx = doomed.context()
             for dp in doomed.dataPoints():
                 contextKey = self._contextKey(ctx.contextKey, dp)
-                lst = self.byContextKey[contextKey]
-                if (doomed, dp) in lst:
-                    lst.remove( (doomed, dp) )
-                if not lst:
+                entry = self.byContextKey.get(contextKey)
+                if entry is None:
+                    continue
+                entry.pop(key, None)
+                if not entry:
                     del self.byContextKey[contextKey]
         return doomed
 
     def add(self, threshold):
-        self.byKey[threshold.key()] = threshold
-        d = self.byDevice.setdefault(threshold.context().deviceName, {})
-        d[threshold.key()] = threshold
+        key = threshold.key()
+        self.byKey[key] = threshold
         ctx = threshold.context()
+        self.byDevice.setdefault(ctx.deviceName, {})[key] = threshold
+        byContextKey = self.byContextKey
         for dp in threshold.dataPoints():
-            self.byContextKey.setdefault(self._contextKey(ctx.contextKey, dp), []).append((threshold, dp))
-        
+            contextKey = self._contextKey(ctx.contextKey, dp)
+            entry = byContextKey.get(contextKey)
+            if entry is None:
+                entry = byContextKey[contextKey] = {}
+            entry[key] = threshold
+
     def update(self, threshold):
         "Store a threshold instance for future computation"
         log.debug("Updating threshold %r", threshold.key())
         doomed = self.remove(threshold)
         if doomed:
-            threshold.count = doomed.count
+            # only carry over counts the old instance kept itself
+            count = vars(doomed).get('count')
+            if count is not None:
+                threshold.count = count
         self.add(threshold)
 
     def updateList(self, thresholds):
@@ -66,26 +81,61 @@ class Thresholds:
 
     def updateForDevice(self, device, thresholds):
         "Store a threshold instance for future computation"
-        doomed = dict((d.key(), d) for d in self.thresholdsForDevice(device))
+        doomed = dict(self.byDevice.get(device, {}))
         self.updateList(thresholds)
         for threshold in thresholds:
-            if threshold.key() in doomed:
-                del doomed[threshold.key()]
-        for d in doomed.values():
+            doomed.pop(threshold.key(), None)
+        for d in doomed.itervalues():
             self.remove(d)
 
+    def hasThresholds(self, contextId, datapoint):
+        "Is any threshold checked against this datapoint?"
+        return self._contextKey(contextId, datapoint) in self.byContextKey
+
     def check(self, contextId, datapoint, timeAt, value):
         "Check a given threshold based on an updated value"
         result = []
-        contextKey = self._contextKey(contextId, datapoint)
-        if contextKey in self.byContextKey:
-            log.debug("Checking value %s on %s", value, contextKey)
-            for t, dp in self.byContextKey[contextKey]:
-                events = t.checkValue(dp, timeAt, value)
+        entry = self.byContextKey.get(self._contextKey(contextId, datapoint))
+        if entry:
+            log.debug("Checking value %s on %s/%s", value, contextId, datapoint)
+            for t in entry.itervalues():
+                events = t.checkValue(datapoint, timeAt, value)
                 if events:
                     result.extend(events)
         return result
 
+    def checkMany(self, values):
+        """
+        Check a batch of (contextId, datapoint, timeAt, value) tuples, such as
+        the values of one collection cycle. Returns a list of (position,
+        events) pairs for the values that generated events; values without
+        a threshold cost a single dictionary lookup. A value that fails to
+        be checked is logged and does not stop the rest of the batch.
+        """
+        results = []
+        byContextKey = self.byContextKey
+        if not byContextKey:
+            return results
+        for i, (contextId, datapoint, timeAt, value) in enumerate(values):
+            if value is None:
+                continue
+            entry = byContextKey.get((contextId, datapoint))
+            if not entry:
+                continue
+            events = []
+            try:
+                for t in entry.itervalues():
+                    evts = t.checkValue(datapoint, timeAt, value)
+                    if evts:
+                        events.extend(evts)
+            except Exception:
+                log.exception("Unable to check thresholds of %s on %s",
+                              datapoint, contextId)
+                continue
+            if events:
+                results.append((i, events))
+        return results
+
 def test():
     pass
 
@@ -16,6 +16,7 @@ CPU utilization, total RSS and the number of processes that match the
 
 import re
 import logging
+from itertools import ifilter, imap, islice
 log = logging.getLogger("zen.ps")
 
 import Globals
@@ -128,9 +129,12 @@ class ps(CommandParser):
             pid, rss, cpu, cmdAndArgs = processMetrics
             return matcher.matches(cmdAndArgs)
 
-        lines = cmd.result.output.splitlines()[1:]
-        metrics = map(self._extractProcessMetrics, lines)
-        matchingMetrics = filter(matches, metrics)
+        # Skip the header and any line that could not be parsed. splitlines
+        # builds the list of lines, but the parsed metrics are filtered and
+        # combined as they are produced rather than collected in lists
+        lines = islice(cmd.result.output.splitlines(), 1, None)
+        metrics = ifilter(None, imap(self._extractProcessMetrics, lines))
+        matchingMetrics = ifilter(matches, metrics)
         pids, rss, cpu = self._combineProcessMetrics(matchingMetrics)
 
         processSet = cmd.displayName
@@ -169,6 +169,159 @@ class ProcessRunner(ProcessProtocol):
             d.callback(self)
 
 
+class SshConnectionPool(object):
+    """
+    Long lived SSH connections shared by the tasks of a collector, keyed by
+    device, credentials and port. A connection stays open while tasks use
+    it and for idleTimeout seconds after the last one releases it, so later
+    collection cycles reuse it instead of paying for a new handshake. Broken
+    connections are dropped and replaced on the next acquire.
+    """
+
+    def __init__(self, name, idleTimeout=900):
+        self.name = name
+        self.idleTimeout = idleTimeout
+        self.clock = reactor
+        self._connections = {}
+        self._connecting = {}
+        self._idle = {}
+
+        self.created = 0
+        self.reused = 0
+        self.failed = 0
+        self.lost = 0
+        self.expired = 0
+
+    def __len__(self):
+        return len(self._connections)
+
+    def __contains__(self, key):
+        return key in self._connections
+
+    def acquire(self, key, factory):
+        """
+        Return a deferred that fires with a connected client for the key,
+        calling factory to build a new one if there is no healthy connection
+        to reuse. Concurrent requests for the same key share one attempt.
+        """
+        self._cancelIdle(key)
+        connection = self._connections.get(key)
+        if connection is not None:
+            if self._isHealthy(connection):
+                self.reused += 1
+                return defer.succeed(connection)
+            log.debug("Replacing broken connection %s",
+                      connection.description)
+            self.discard(key, connection)
+
+        d = defer.Deferred()
+        if key in self._connecting:
+            self._connecting[key][1].append(d)
+            return d
+
+        connection = factory()
+        self._connecting[key] = (connection, [d])
+        self.created += 1
+        connected = connection.run()
+        connection.close_defer.addBoth(self._lost, key, connection)
+        connected.addCallbacks(self._connected, self._connectFailed,
+                               callbackArgs=(key, connection),
+                               errbackArgs=(key, connection))
+        return d
+
+    def release(self, key, connection):
+        """
+        Called once no task uses the connection. Keep it open for reuse
+        unless it is broken, has been removed from the pool or still has
+        channels open.
+        """
+        if connection.tasks:
+            return
+        if self._connections.get(key) is not connection \
+                or not self.idleTimeout \
+                or not self._isHealthy(connection) \
+                or getattr(connection, 'openSessions', 0) > 0:
+            self.discard(key, connection)
+            return
+        self._cancelIdle(key)
+        self._idle[key] = self.clock.callLater(self.idleTimeout,
+                                               self._expire, key, connection)
+
+    def remove(self, key, connection):
+        """
+        Stop handing out the connection without closing it. Tasks that
+        still use it finish, and the last release closes it.
+        """
+        if self._connections.get(key) is connection:
+            del self._connections[key]
+            self._cancelIdle(key)
+
+    def discard(self, key, connection):
+        """
+        Remove the connection from the pool and close it.
+        """
+        self.remove(key, connection)
+        transport = getattr(connection, 'transport', None)
+        if transport is not None and transport.connected:
+            log.debug("Closing connection %s", connection.description)
+            transport.loseConnection()
+
+    def _isHealthy(self, connection):
+        transport = getattr(connection, 'transport', None)
+        return not connection.is_expired and transport is not None \
+            and transport.connected and not transport.disconnecting
+
+    def _cancelIdle(self, key):
+        idle = self._idle.pop(key, None)
+        if idle is not None and idle.active():
+            idle.cancel()
+
+    def _expire(self, key, connection):
+        self._idle.pop(key, None)
+        self.expired += 1
+        log.debug("Closing idle connection %s", connection.description)
+        self.discard(key, connection)
+
+    def _waiters(self, key, connection):
+        attempt = self._connecting.get(key)
+        if attempt is None or attempt[0] is not connection:
+            return []
+        del self._connecting[key]
+        return attempt[1]
+
+    def _connected(self, result, key, connection):
+        self._connections[key] = connection
+        for d in self._waiters(key, connection):
+            d.callback(connection)
+
+    def _connectFailed(self, reason, key, connection):
+        self.failed += 1
+        for d in self._waiters(key, connection):
+            d.errback(reason)
+
+    def _lost(self, result, key, connection):
+        if self._connections.get(key) is connection:
+            self.lost += 1
+            self.remove(key, connection)
+        # the connection went away before it was ready
+        waiters = self._waiters(key, connection)
+        if waiters:
+            self.failed += 1
+            for d in waiters:
+                d.errback(Failure(Exception(
+                    "Connection %s lost" % connection.description)))
+
+    def __str__(self):
+        return "%d connections (%d idle), %d created, %d reused, " \
+            "%d failed, %d lost, %d expired" % (
+                len(self._connections), len(self._idle), self.created,
+                self.reused, self.failed, self.lost, self.expired)
+
+
+def getSshPool():
+    return getPool(SshRunner.POOLNAME, SshConnectionPool)
+
+
 class SshRunner(object):
     implements(IRunner)
 
@@ -210,60 +363,28 @@ class SshRunner(object):
             keyPath=_keyPath,
             concurrentSessions=_concurrentSessions,
         )
-        self._poolkey = hash((_username, _password, self.manageIp, self.port))
-        self._pool = getPool(SshRunner.POOLNAME)
+        self._poolkey = (self.deviceId, _username, _password, _keyPath,
+                         self.manageIp, self.port)
+        self._pool = getSshPool()
 
     @defer.inlineCallbacks
     def connect(self, task):
         """
-        Establish a connection with the device
+        Establish a connection with the device, reusing a pooled one if
+        possible
         """
         self.task = task
-        self._setupConnector()
-        self.connection = yield self._establishConnection()
+        self.connection = yield self._pool.acquire(self._poolkey,
+                                                   self._newConnection)
         log.debug("Connected to %s [%s]", self.deviceId, self.manageIp)
+        self.connection.concurrentSessions = \
+            self._sshOptions.concurrentSessions
         self.connection.tasks.add(self.task)
-        self.connection.close_defer.addCallback(self.cleanUpPool)
 
-    @defer.inlineCallbacks
-    def _setupConnector(self):
-        """
-        Create a new connection object for the pool if it doesn't exist.
-        Set up a list for storing deferred objects that will callback
-        or errback based on the result of the initial deferred.
-        """
-        if self._poolkey not in self._pool:
-            log.debug("Creating connection object to %s", self.deviceId)
-            connection = self.client(self.deviceId, self.manageIp, self.port,
-                                     options=self._sshOptions)
-            self._pool[self._poolkey] = []
-
-            try:
-                connection = yield connection.run()
-            except Exception, e:
-                deferredList = self._pool.get(self._poolkey, [])
-                self.cleanUpPool(connection)
-                for d in deferredList:
-                    d.errback(e)
-            else:
-                deferredList = self._pool.get(self._poolkey, [])
-                self._pool[self._poolkey] = connection
-                for d in deferredList:
-                    d.callback(connection)
-
-    def _establishConnection(self):
-        """
-        Either creates a deferred to append to the pool list otherwise, wraps
-        the result
-        """
-
-        if isinstance(self._pool[self._poolkey], list):
-            d = defer.Deferred()
-            self._pool[self._poolkey].append(d)
-        else:
-            d = defer.succeed(self._pool[self._poolkey])
-
-        return d
+    def _newConnection(self):
+        log.debug("Creating connection object to %s", self.deviceId)
+        return self.client(self.deviceId, self.manageIp, self.port,
+                           options=self._sshOptions)
 
     def send(self, command):
         """
@@ -278,15 +399,14 @@ class SshRunner(object):
 
     def close(self):
         """
-        Discard the task and close the connection if there are no remaining
-        tasks
+        Discard the task and hand the connection back to the pool if there
+        are no remaining tasks
         """
         if self.connection:
             self.connection.tasks.discard(self.task)
             if not self.connection.tasks:
                 self.connection.clientFinished()
-                if not self.connection.is_expired:
-                    self.cleanUpPool()
+                self._pool.release(self._poolkey, self.connection)
             self.connection = None
 
     def timeout(self, timedOut=True):
@@ -300,14 +420,13 @@ class SshRunner(object):
 
     def cleanUpPool(self, connection=None):
         """
-        Deletes the connection from the pool (if it exists)
+        Stop reusing the connection (if it is pooled)
         """
         connection = connection or self.connection
-
-        if self._poolkey in self._pool:
+        if connection is not None:
             log.debug("Deleting connection %s from pool",
                       connection.description)
-            del self._pool[self._poolkey]
+            self._pool.remove(self._poolkey, connection)
 
     def processEnded(self, result):
         """
@@ -0,0 +1,75 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2014, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+from Products.ZenRRD.tests.BaseParsersTestCase import Object
+from Products.ZenRRD.CommandParser import CommandParser, ParserRegistry
+
+
+class FakeLoader(object):
+    """
+    Stands in for a PluginLoader and counts the plugin imports.
+    """
+    package = '/plugins'
+    creates = 0
+
+    def __init__(self, modPath):
+        self.modPath = modPath
+
+    def create(self):
+        FakeLoader.creates += 1
+        return CommandParser()
+
+
+class TestCommandParser(BaseTestCase):
+
+    def afterSetUp(self):
+        super(TestCommandParser, self).afterSetUp()
+        FakeLoader.creates = 0
+
+    def testRegistryImportsOnce(self):
+        registry = ParserRegistry()
+        first = registry.create(FakeLoader('zenoss.Nagios'))
+        # a loader from a later configuration resolves to the same class
+        second = registry.create(FakeLoader('zenoss.Nagios'))
+        self.assertEqual(1, FakeLoader.creates)
+        self.assertTrue(first.__class__ is second.__class__)
+        self.assertFalse(first is second)
+        registry.create(FakeLoader('zenoss.Cacti'))
+        self.assertEqual(2, FakeLoader.creates)
+        self.assertEqual(2, len(registry))
+
+    def testNewConfigurationClearsParsers(self):
+        from Products.ZenCollector.tasks import SimpleTaskFactory
+        from Products.ZenRRD.zencommand import _parsers, \
+            SshPerformanceCollectionTask, SshPerCycletimeTaskSplitter
+        _parsers.create(FakeLoader('zenoss.Nagios'))
+        self.assertEqual(1, len(_parsers))
+        splitter = SshPerCycletimeTaskSplitter(
+            SimpleTaskFactory(SshPerformanceCollectionTask))
+        splitter.splitConfiguration([])
+        self.assertEqual(0, len(_parsers))
+
+    def testPreprocessResults(self):
+        cmd = Object()
+        cmd.command = 'ps -eo pid'
+        cmd.result = Object()
+        cmd.result.output = '\n  ps -eo pid\n1\n'
+        CommandParser().preprocessResults(cmd, None)
+        self.assertEqual('\n1\n', cmd.result.output)
+        output = cmd.result.output = ' 1\n2\n'
+        CommandParser().preprocessResults(cmd, None)
+        self.assertTrue(output is cmd.result.output)
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestCommandParser))
+    return suite
@@ -0,0 +1,132 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2014, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+from twisted.internet import defer
+from twisted.internet.task import Clock
+
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+from Products.ZenRRD.runner import SshConnectionPool
+
+
+class FakeTransport(object):
+    connected = True
+    disconnecting = False
+
+    def loseConnection(self):
+        self.connected = False
+
+
+class FakeClient(object):
+    """
+    Stands in for MySshClient. run() is answered by calling connect() or
+    fail() so that the connection attempt stays in flight until then.
+    """
+    is_expired = False
+    openSessions = 0
+    description = 'user:*****@10.0.0.1:22'
+
+    def __init__(self):
+        self.tasks = set()
+        self.transport = None
+
+    def run(self):
+        self.connect_defer = defer.Deferred()
+        self.close_defer = defer.Deferred()
+        return self.connect_defer
+
+    def connect(self):
+        self.transport = FakeTransport()
+        self.connect_defer.callback(self)
+
+    def fail(self):
+        self.connect_defer.errback(Exception('refused'))
+        self.close_defer.callback('lost')
+
+    def lose(self):
+        self.transport.connected = False
+        self.close_defer.callback('lost')
+
+
+class TestSshConnectionPool(BaseTestCase):
+
+    def afterSetUp(self):
+        super(TestSshConnectionPool, self).afterSetUp()
+        self.pool = SshConnectionPool('test', idleTimeout=60)
+        self.pool.clock = self.clock = Clock()
+        self.clients = []
+
+    def factory(self):
+        client = FakeClient()
+        self.clients.append(client)
+        return client
+
+    def acquire(self):
+        results = []
+        self.pool.acquire('key', self.factory).addBoth(results.append)
+        return results
+
+    def release(self, client, task):
+        client.tasks.discard(task)
+        self.pool.release('key', client)
+
+    def testReuseAcrossCycles(self):
+        first, second = self.acquire(), self.acquire()
+        self.assertEqual(1, len(self.clients))
+        self.clients[0].connect()
+        self.assertTrue(first[0] is second[0] is self.clients[0])
+        self.release(self.clients[0], None)
+        self.clock.advance(30)
+        third = self.acquire()
+        self.assertTrue(third[0] is self.clients[0])
+        self.assertEqual(1, self.pool.created)
+        self.assertEqual(1, self.pool.reused)
+
+    def testIdleTimeout(self):
+        self.acquire()
+        client = self.clients[0]
+        client.connect()
+        self.release(client, None)
+        self.clock.advance(61)
+        self.assertFalse(client.transport.connected)
+        self.assertEqual(0, len(self.pool))
+        self.assertEqual(1, self.pool.expired)
+
+    def testReconnect(self):
+        self.acquire()
+        self.clients[0].connect()
+        self.clients[0].lose()
+        self.assertEqual(0, len(self.pool))
+        result = self.acquire()
+        self.assertEqual(2, len(self.clients))
+        self.clients[1].connect()
+        self.assertTrue(result[0] is self.clients[1])
+
+    def testFailedConnect(self):
+        result = self.acquire()
+        self.clients[0].fail()
+        self.assertTrue(result[0].check(Exception))
+        self.assertEqual(1, self.pool.failed)
+        self.assertEqual(0, len(self.pool))
+
+    def testBusyConnectionClosed(self):
+        self.acquire()
+        client = self.clients[0]
+        client.connect()
+        # a channel that never closed keeps the connection from being reused
+        client.openSessions = 1
+        self.release(client, None)
+        self.assertFalse(client.transport.connected)
+        self.assertEqual(0, len(self.pool))
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestSshConnectionPool))
+    return suite
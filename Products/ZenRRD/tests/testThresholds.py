@@ -0,0 +1,89 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2014, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+from Products.ZenRRD.Thresholds import Thresholds
+
+
+class FakeContext(object):
+    def __init__(self, deviceName, contextKey):
+        self.deviceName = deviceName
+        self.contextKey = contextKey
+
+    def key(self):
+        return self.deviceName, ''
+
+
+class FakeThreshold(object):
+    def __init__(self, name, context, dataPoints, limit):
+        self._name = name
+        self._context = context
+        self._dataPoints = dataPoints
+        self.limit = limit
+
+    def key(self):
+        return self._name, self._context.key()
+
+    def context(self):
+        return self._context
+
+    def dataPoints(self):
+        return self._dataPoints
+
+    def checkValue(self, dp, timeAt, value):
+        if value > self.limit:
+            return [dict(eventKey=self._name, dp=dp, current=value)]
+        return []
+
+
+class TestThresholds(BaseTestCase):
+
+    def afterSetUp(self):
+        super(TestThresholds, self).afterSetUp()
+        self.thresholds = Thresholds()
+        self.ctx = FakeContext('dev', 'uuid-dev')
+
+    def testUpdateReplaces(self):
+        self.thresholds.update(FakeThreshold('high', self.ctx, ['cpu'], 10))
+        self.thresholds.update(FakeThreshold('high', self.ctx, ['cpu'], 50))
+        self.assertEqual(1, len(self.thresholds.byKey))
+        self.assertEqual([], self.thresholds.check('uuid-dev', 'cpu', 0, 20))
+        self.assertEqual(1, len(self.thresholds.check('uuid-dev', 'cpu', 0, 60)))
+
+    def testUpdateForDevice(self):
+        self.thresholds.updateForDevice('dev', [
+            FakeThreshold('a', self.ctx, ['cpu', 'mem'], 10),
+            FakeThreshold('b', self.ctx, ['mem'], 10)])
+        self.assertTrue(self.thresholds.hasThresholds('uuid-dev', 'cpu'))
+        self.thresholds.updateForDevice('dev', [
+            FakeThreshold('b', self.ctx, ['mem'], 10)])
+        self.assertEqual(1, len(self.thresholds.byKey))
+        self.assertFalse(self.thresholds.hasThresholds('uuid-dev', 'cpu'))
+        self.assertEqual(1, len(self.thresholds.byContextKey))
+        self.assertEqual(1, len(self.thresholds.thresholdsForDevice('dev')))
+
+    def testCheckMany(self):
+        self.thresholds.updateList([
+            FakeThreshold('a', self.ctx, ['cpu'], 10),
+            FakeThreshold('b', self.ctx, ['cpu'], 20)])
+        results = self.thresholds.checkMany([
+            ('uuid-dev', 'cpu', 0, 5),
+            ('uuid-dev', 'cpu', 0, None),
+            ('uuid-dev', 'mem', 0, 100),
+            ('uuid-dev', 'cpu', 0, 15),
+            ('uuid-dev', 'cpu', 0, 25)])
+        self.assertEqual([3, 4], [i for i, events in results])
+        self.assertEqual([1, 2], [len(events) for i, events in results])
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestThresholds))
+    return suite
@@ -0,0 +1,184 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2014, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+from datetime import datetime
+
+import zope.component
+import zope.interface
+from twisted.internet import defer
+
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+from Products.ZenCollector.interfaces import ICollectorPreferences, \
+    IDataService
+from Products.ZenRRD.zenperfsnmp import SnmpPerformanceCollectionTask, \
+    COLLECTOR_NAME
+
+IFINOCTETS = '1.3.6.1.2.1.2.2.1.10'
+IFOUTOCTETS = '1.3.6.1.2.1.2.2.1.16'
+SYSUPTIME = '1.3.6.1.2.1.1.3.0'
+
+
+class Options(object):
+    triesPerCycle = 2
+    maxTimeouts = 3
+    minTableRows = 3
+
+
+class Preferences(object):
+    zope.interface.implements(ICollectorPreferences)
+
+    def __init__(self):
+        self.options = Options()
+
+
+class DataService(object):
+    zope.interface.implements(IDataService)
+
+    def __init__(self):
+        self.values = {}
+
+    def writeMetrics(self, batch):
+        for contextId, value in zip(batch.contextIds, batch.values):
+            self.values[contextId] = value
+
+
+class Object(object):
+    pass
+
+
+class FakeAgent(object):
+    """
+    An SNMP agent that answers gets with nothing at all when a request
+    holds one of its bad oids, like agents that fail the whole PDU.
+    """
+    def __init__(self, values, bad=()):
+        self.values = values
+        self.bad = set(bad)
+        self.gets = []
+        self.walks = []
+
+    def get(self, oids, timeout, retries):
+        self.gets.append(list(oids))
+        if self.bad.intersection(oids):
+            return defer.succeed({})
+        return defer.succeed(dict(('.' + oid, self.values[oid])
+                                  for oid in oids))
+
+    def getTable(self, columns, **kwargs):
+        self.walks.append(columns)
+        column = columns[0]
+        rows = dict(('.' + oid, value)
+                     for oid, value in self.values.iteritems()
+                     if '.' + oid.rpartition('.')[0] == column)
+        return defer.succeed({column: rows})
+
+
+class TestZenPerfSnmp(BaseTestCase):
+
+    def afterSetUp(self):
+        super(TestZenPerfSnmp, self).afterSetUp()
+        self.preferences = Preferences()
+        self.dataService = DataService()
+        zope.component.provideUtility(self.preferences, ICollectorPreferences,
+                                      COLLECTOR_NAME)
+        zope.component.provideUtility(self.dataService, IDataService)
+
+    def makeTask(self, oids, maxOidsPerRequest=4, minTableRows=3):
+        self.preferences.options.minTableRows = minTableRows
+        config = Object()
+        config.id = 'device1'
+        config.cycleInterval = 300
+        config.zMaxOIDPerRequest = maxOidsPerRequest
+        config.snmpConnInfo = Object()
+        config.snmpConnInfo.manageIp = '10.0.0.1'
+        config.snmpConnInfo.zSnmpVer = 'v2c'
+        config.snmpConnInfo.zSnmpTimeout = 1
+        config.snmpConnInfo.zSnmpTries = 1
+        # the datapoint of each oid is named after the oid
+        config.oids = dict((oid, [(oid, 'ds_dp', 'uuid', 'devuuid', 'GAUGE',
+                                   None, None, None)])
+                           for oid in oids)
+        task = SnmpPerformanceCollectionTask('device1', 'device1 300', 300,
+                                             config)
+        task._doTask_start = datetime.now()
+        return task
+
+    def oids(self, column, count):
+        return ['%s.%d' % (column, i) for i in range(1, count + 1)]
+
+    def testGroupTableColumns(self):
+        inOctets = self.oids(IFINOCTETS, 3)
+        outOctets = self.oids(IFOUTOCTETS, 2)
+        oids = inOctets + outOctets + [SYSUPTIME]
+        task = self.makeTask(oids)
+        tables, scalars = task._groupTableColumns(oids)
+        self.assertEqual({IFINOCTETS: inOctets}, tables)
+        self.assertEqual(sorted(outOctets + [SYSUPTIME]), sorted(scalars))
+
+        # columns that did not pay off as walks are fetched with gets
+        task._scalarColumns.add(IFINOCTETS)
+        tables, scalars = task._groupTableColumns(oids)
+        self.assertEqual({}, tables)
+        self.assertEqual(sorted(oids), sorted(scalars))
+
+    def testMinTableRows(self):
+        oids = self.oids(IFINOCTETS, 3)
+        values = dict((oid, 100) for oid in oids)
+
+        task = self.makeTask(oids, minTableRows=3)
+        task._snmpProxy = agent = FakeAgent(values)
+        task._fetchPerf()
+        self.assertEqual([['.' + IFINOCTETS]], agent.walks)
+        self.assertEqual([], agent.gets)
+        self.assertEqual(values, self.dataService.values)
+
+        # 0 turns table walks off
+        task = self.makeTask(oids, minTableRows=0)
+        task._snmpProxy = agent = FakeAgent(values)
+        task._fetchPerf()
+        self.assertEqual([], agent.walks)
+        self.assertEqual([sorted(oids)], [sorted(get) for get in agent.gets])
+
+    def testSparseTableUsesGets(self):
+        # only 3 of 10 rows are monitored, so walking does not pay off
+        allOids = self.oids(IFINOCTETS, 10)
+        oids = allOids[:3]
+        task = self.makeTask(oids)
+        task._snmpProxy = FakeAgent(dict((oid, 1) for oid in allOids))
+        task._fetchPerfTable(IFINOCTETS, oids)
+        self.assertTrue(IFINOCTETS in task._scalarColumns)
+        self.assertEqual(sorted(oids), sorted(self.dataService.values))
+
+    def testBisectIsolatesBadOids(self):
+        oids = self.oids(IFOUTOCTETS, 2) + [SYSUPTIME] + \
+            self.oids(IFINOCTETS, 2)
+        bad = oids[3]
+        task = self.makeTask(oids, minTableRows=0)
+        task._snmpProxy = FakeAgent(dict((oid, 1) for oid in oids), [bad])
+        task._fetchPerf()
+        self.assertEqual(set([bad]), task._bad_oids)
+        self.assertEqual(set(oids) - set([bad]), task._collectedOids)
+
+    def testBisectSingleMissingOid(self):
+        oids = self.oids(IFINOCTETS, 2)
+        task = self.makeTask(oids, minTableRows=0)
+        task._snmpProxy = agent = FakeAgent(dict((oid, 1) for oid in oids),
+                                            [oids[0]])
+        # the other oid of the chunk was already collected
+        task._collectedOids.add(oids[1])
+        task._bisectPerfChunk(oids)
+        self.assertEqual([oids, [oids[0]]], agent.gets)
+        self.assertEqual(set([oids[0]]), task._bad_oids)
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestZenPerfSnmp))
+    return suite
@@ -16,6 +16,7 @@ from md5 import md5
 log = logging.getLogger('zen.testzenprocess')
 
 import re
+from twisted.internet import defer
 from Products.ZenTestCase.BaseTestCase import BaseTestCase
 from Products.ZenRRD.zenprocess import ZenProcessTask
 from Products.ZenUtils.Utils import zenPath
@@ -86,6 +87,7 @@ class TestZenprocess(BaseTestCase):
         task._preferences.options.showrawtables = False
         task._preferences.options.showprocs = False
         task._preferences.options.captureFilePrefix = ''
+        task._preferences.options.fulltablecycles = 10
         task._eventService = EventService()
         return task
 
@@ -856,6 +858,112 @@ class TestZenprocess(BaseTestCase):
                                             '.1.3.6.1.2.1.25.4.2.1.5.2': 'arbitrary arguments'}}
         self.compareTestData(data, task, self.expected(PROCESSES=18, AFTERBYCONFIG=9, MISSING=0))
 
+    def testIncrementalProcessTables(self):
+        self.printTestTitle("testIncrementalProcessTables")
+        task = self.getSingleProcessTask()
+        NAME, PATH, ARGS = ('.1.3.6.1.2.1.25.4.2.1.2', '.1.3.6.1.2.1.25.4.2.1.4',
+                            '.1.3.6.1.2.1.25.4.2.1.5')
+        device = {NAME: {NAME + '.1': 'testProcess', NAME + '.2': 'other',
+                         NAME + '.3': 'other'},
+                  PATH: {PATH + '.1': '/fake/path/testProcess',
+                         PATH + '.2': '/bin/other', PATH + '.3': '/bin/other'},
+                  ARGS: {ARGS + '.1': 'args', ARGS + '.2': '', ARGS + '.3': ''}}
+        walked, fetched = [], []
+        def getTables(oids):
+            walked.extend(oids)
+            return defer.succeed(dict((oid, dict(device[oid])) for oid in oids))
+        def get(oids):
+            fetched.extend(oids)
+            return defer.succeed(dict((oid, device[oid.rsplit('.', 1)[0]].get(oid))
+                                      for oid in oids))
+        task._getTables = getTables
+        task._get = get
+
+        results = []
+        task._getProcessTables().addCallback(results.append)
+        self.assertEqual([NAME, PATH, ARGS], walked)
+
+        # a new process is read with gets, known ones come from the cache
+        del walked[:]
+        device[NAME][NAME + '.4'] = 'testProcess'
+        device[PATH][PATH + '.4'] = '/fake/path/testProcess'
+        device[ARGS][ARGS + '.4'] = 'more args'
+        task._getProcessTables().addCallback(results.append)
+        self.assertEqual([NAME], walked)
+        self.assertEqual([PATH + '.4', ARGS + '.4'], fetched)
+        procs = dict(task._parseProcessNames(results[-1]))
+        self.assertEqual('/fake/path/testProcess args', procs[1])
+        self.assertEqual('/fake/path/testProcess more args', procs[4])
+        self.assertEqual('/bin/other', procs[2])
+
+        # a process reusing a pid under another name is read again
+        del walked[:], fetched[:]
+        device[NAME][NAME + '.2'] = 'renamed'
+        task._getProcessTables().addCallback(results.append)
+        self.assertEqual([PATH + '.2', ARGS + '.2'], fetched)
+
+        # changed arguments under the same pid and name are only seen when
+        # the whole tables are walked again
+        del walked[:]
+        task._preferences.options.fulltablecycles = 4
+        device[ARGS][ARGS + '.1'] = 'new args'
+        task._getProcessTables().addCallback(results.append)
+        self.assertEqual([NAME], walked)
+        procs = dict(task._parseProcessNames(results[-1]))
+        self.assertEqual('/fake/path/testProcess args', procs[1])
+        task._getProcessTables().addCallback(results.append)
+        self.assertEqual([NAME, NAME, PATH, ARGS], walked)
+        procs = dict(task._parseProcessNames(results[-1]))
+        self.assertEqual('/fake/path/testProcess new args', procs[1])
+
+    def testFetchPerf(self):
+        self.printTestTitle("testFetchPerf")
+        task = self.getSingleProcessTask()
+        deviceStats = task._deviceStats
+        calls = []
+        def get(oids):
+            calls.append(('get', list(oids)))
+            return defer.succeed(dict((oid, 1) for oid in oids))
+        def getPerfTables():
+            calls.append(('walk', None))
+            return defer.succeed({})
+        task._get = get
+        task._getPerfTables = getPerfTables
+        task._storePerfStats = lambda results: None
+
+        # one monitored process out of many is read with gets
+        deviceStats.processTable = dict((pid, ('other', '', ''))
+                                        for pid in range(1, 11))
+        task._fetchPerf()
+        self.assertEqual(set(['get']), set(call for call, oids in calls))
+
+        # the perf table is walked when most processes are monitored
+        del calls[:]
+        deviceStats.processTable = {1: ('testProcess', '', '')}
+        task._fetchPerf()
+        self.assertEqual(['walk'], [call for call, oids in calls])
+
+    def testMatchesCached(self):
+        self.printTestTitle("testMatchesCached")
+        task = self.getSingleProcessTask()
+        deviceStats = task._deviceStats
+        pStats = deviceStats.match(1, '/fake/path/testProcess args')
+        self.assertEqual('url_testProcess_args', pStats._config.name)
+        self.assertEqual(None, deviceStats.match(2, '/bin/other'))
+        self.assertTrue(deviceStats.match(1, '/fake/path/testProcess args') is pStats)
+        # the same pid with another command line is matched again
+        self.assertEqual(None, deviceStats.match(1, '/bin/other'))
+
+        # changed regexes throw the cached matches away
+        procDefs = {}
+        self.updateProcDefs(procDefs, 'url_testProcess_args', '/bin/other', 'nothing')
+        deviceStats.update(TaskConfig(procDefs=procDefs))
+        self.assertFalse(deviceStats._matches)
+        self.assertEqual('url_testProcess_args',
+                         deviceStats.match(1, '/bin/other')._config.name)
+        deviceStats.forgetPids([])
+        self.assertFalse(deviceStats._matches)
+
 
 def test_suite():
     print "..Starting the test suite........."
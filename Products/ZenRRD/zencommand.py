@@ -14,6 +14,7 @@ Run Command plugins periodically.
 
 """
 
+import re
 import time
 from pprint import pformat
 import logging
@@ -33,7 +34,7 @@ import zope.interface
 from Products.ZenUtils.Utils import unused, getExitMessage
 from Products.DataCollector.SshClient import SshClient
 from Products.ZenEvents.ZenEventClasses import Clear, Cmd_Fail
-from Products.ZenRRD.CommandParser import ParsedResults
+from Products.ZenRRD.CommandParser import ParsedResults, ParserRegistry
 from Products.ZenRRD import runner
 
 from Products.ZenCollector.daemon import CollectorDaemon
@@ -47,12 +48,14 @@ from Products.ZenCollector.tasks import SimpleTaskFactory,\
                                         BaseTask
 from Products.ZenEvents import Event
 from Products.ZenUtils.Executor import TwistedExecutor
+from Products.ZenUtils.metricwriter import MetricBatch
 
 from Products.DataCollector import Plugins
 unused(Plugins)
 
 MAX_CONNECTIONS = 250
 MAX_BACK_OFF_MINUTES = 20
+SSH_IDLE_TIMEOUT = 15 * 60
 
 # We retrieve our configuration data remotely via a Twisted PerspectiveBroker
 # connection. To do so, we need to import the class that will be used by the
@@ -73,6 +76,11 @@ TimeoutError = runner.TimeoutError
 
 COLLECTOR_NAME = "zencommand"
 
+# parser classes shared by all tasks
+_parsers = ParserRegistry()
+
+_nonBlank = re.compile(r'\S')
+
 
 class SshPerformanceCollectionPreferences(object):
     zope.interface.implements(ICollectorPreferences)
@@ -117,13 +125,27 @@ class SshPerformanceCollectionPreferences(object):
                           help="Display the entire command and command-line arguments, " \
                                " including any passwords.")
 
+        parser.add_option('--sshidletimeout',
+                          dest='sshidletimeout',
+                          default=SSH_IDLE_TIMEOUT,
+                          type='int',
+                          help="Seconds to keep an idle SSH connection open for" \
+                               " later collection cycles to reuse. 0 closes" \
+                               " connections as soon as a cycle ends.")
+
     def postStartup(self):
-        pass
+        runner.getSshPool().idleTimeout = self.options.sshidletimeout
 
 
 class SshPerCycletimeTaskSplitter(SubConfigurationTaskSplitter):
     subconfigName = 'datasources'
 
+    def splitConfiguration(self, configs):
+        # resolve the parsers again from the loaders of the new
+        # configuration, so parsers no longer in use are not kept
+        _parsers.clear()
+        return super(SshPerCycletimeTaskSplitter, self).splitConfiguration(configs)
+
     def makeConfigKey(self, config, subconfig):
         return (config.id, subconfig.cycleTime, 'Remote' if subconfig.useSsh else 'Local')
 
@@ -503,10 +525,11 @@ class SshPerformanceCollectionTask(BaseTask):
         @type results: ParsedResults object
         """
         exitCode = datasource.result.exitCode
-        output = datasource.result.output.strip()
+        output = datasource.result.output
         stderr = datasource.result.stderr.strip()
-        
-        if exitCode == 0 and not output:
+
+        # the output can be large, so look for content instead of stripping
+        if exitCode == 0 and not _nonBlank.search(output):
             msg = "No data returned for command"
             if self._showfullcommand:
                 msg += ": %s" % datasource.command
@@ -519,7 +542,7 @@ class SshPerformanceCollectionTask(BaseTask):
         else:
             try:
                 operation = "Creating Parser"
-                parser = datasource.parser.create()
+                parser = _parsers.create(datasource.parser)
 
                 operation = "Running Parser"
                 parser.preprocessResults(datasource, log)
@@ -548,7 +571,7 @@ class SshPerformanceCollectionTask(BaseTask):
                 log.exception(msg)
                 event = self._makeCmdEvent(datasource, msg)
                 event['message'] = traceback.format_exc()
-                event['output'] = output
+                event['output'] = output.strip()
                 results.events.append(event)
 
     def _storeResults(self, resultList):
@@ -559,22 +582,25 @@ class SshPerformanceCollectionTask(BaseTask):
         @type resultList: array of (datasource, dictionary)
         """
         self.state = SshPerformanceCollectionTask.STATE_STORE_PERF
+        batch = MetricBatch()
         for datasource, results in resultList:
             for dp, value in results.values:
                 threshData = {
                     'eventKey': datasource.getEventKey(dp),
                     'component': dp.component,
                 }
-                self._dataService.writeMetric(dp.contextUUID,
-                                              dp.dpName,
-                                              value,
-                                              dp.rrdType,
-                                              dp.componentId,
-                                              deviceuuid=dp.devuuid,
-                                              min=dp.rrdMin,
-                                              max=dp.rrdMax,
-                                              threshEventData=threshData)
+                batch.append(dp.contextUUID,
+                             dp.dpName,
+                             value,
+                             dp.rrdType,
+                             dp.componentId,
+                             deviceuuid=dp.devuuid,
+                             min=dp.rrdMin,
+                             max=dp.rrdMax,
+                             threshEventData=threshData)
+        self._dataService.writeMetrics(batch)
 
+        for datasource, results in resultList:
             eventList = results.events
             exitCode = getattr(datasource.result, 'exitCode', -1)
             output = None
@@ -615,6 +641,8 @@ class SshPerformanceCollectionTask(BaseTask):
         """
         display = "%s useSSH: %s\n" % (
             self.name, self._useSsh)
+        if self._useSsh:
+            display += "SSH connection pool: %s\n" % runner.getSshPool()
         if self._lastErrorMsg:
             display += "%s\n" % self._lastErrorMsg
         return display
@@ -16,8 +16,9 @@ Gets SNMP performance data and stores it in RRD files.
 """
 
 from datetime import datetime, timedelta
-from collections import deque
+from collections import deque, defaultdict
 import random
+import sys
 import logging
 log = logging.getLogger("zen.zenperfsnmp")
 
@@ -46,6 +47,7 @@ from Products.ZenEvents import Event
 # connection. To do so, we need to import the class that will be used by the
 # configuration service to send the data over, i.e. SnmpDeviceProxy.
 from Products.ZenUtils.Utils import unused
+from Products.ZenUtils.metricwriter import MetricBatch
 from Products.ZenHub.services.SnmpPerformanceConfig import SnmpDeviceProxy
 unused(SnmpDeviceProxy)
 from Products.ZenHub.services.PerformanceConfig import SnmpConnInfo
@@ -100,6 +102,13 @@ class SnmpPerformanceCollectionPreferences(object):
                           type='int',
                           help="How many consecutive time outs per cycle before stopping attempts to collect")
 
+        parser.add_option('--mintablerows',
+                          dest='minTableRows',
+                          default=10,
+                          type='int',
+                          help="Minimum number of OIDs sharing a table column for the column to be collected "\
+                                "with a table walk (GETBULK) instead of gets, 0 to always use gets")
+
 
     def postStartup(self):
         pass
@@ -175,6 +184,10 @@ class SnmpPerformanceCollectionTask(BaseTask):
         self._snmpPort = snmpprotocol.port()
         self.triesPerCycle = max(2, self._preferences.options.triesPerCycle)
         self._maxTimeouts = self._preferences.options.maxTimeouts
+        self._minTableRows = self._preferences.options.minTableRows
+        # table columns that did not pay off as table walks; their oids are
+        # collected with gets from then on
+        self._scalarColumns = set()
 
         self._lastErrorMsg = ''
         self._cycleExceededCount = 0
@@ -231,6 +244,26 @@ class SnmpPerformanceCollectionTask(BaseTask):
     def _uncollectedOids(self):
         return set(self._oids) - self._bad_oids - self._collectedOids
 
+    def _groupTableColumns(self, oids):
+        """
+        Split oids into table columns worth walking and the oids to get
+        individually.
+
+        @return: dict of column oid to its oids, and a list of the others
+        """
+        columns = defaultdict(list)
+        for oid in oids:
+            columns[oid.rpartition('.')[0]].append(oid)
+        tables = {}
+        scalars = []
+        for column, columnOids in columns.iteritems():
+            if (self._minTableRows and len(columnOids) >= self._minTableRows
+                    and column not in self._scalarColumns):
+                tables[column] = columnOids
+            else:
+                scalars.extend(columnOids)
+        return tables, scalars
+
     @defer.inlineCallbacks
     def _fetchPerf(self):
         """
@@ -251,19 +284,27 @@ class SnmpPerformanceCollectionTask(BaseTask):
         consecutiveTimeouts = 0
         while oids_to_test and try_count < maxTries:
             try_count += 1
-            if try_count > 1:
-                log.debug("%s [%s] some oids still uncollected after %s tries, trying again with chunk size %s", self._devId,
-                          self._manageIp, try_count - 1, chunk_size)
-            oid_chunks = self.chunk(oids_to_test, chunk_size)
-            for oid_chunk in oid_chunks:
+            requests = []
+            if try_count == 1:
+                # oids sharing a table column are walked, the rest are fetched in chunks
+                tables, oids_to_test = self._groupTableColumns(oids_to_test)
+                requests.extend((self._fetchPerfTable, (column, columnOids))
+                                for column, columnOids in tables.iteritems())
+                fetch = self._fetchPerfChunk
+            else:
+                log.debug("%s [%s] some oids still uncollected after %s tries, trying again bisecting failed chunks",
+                          self._devId, self._manageIp, try_count - 1)
+                fetch = self._bisectPerfChunk
+            requests.extend((fetch, (oid_chunk,)) for oid_chunk in self.chunk(oids_to_test, chunk_size))
+            for fetch, args in requests:
                 try:
                     self._checkTaskTime()
-                    log.debug("Fetching OID chunk size %s from %s [%s] - %s", chunk_size, self._devId, self._manageIp, oid_chunk)
-                    yield self._fetchPerfChunk(oid_chunk)
+                    log.debug("Calling %s for %s [%s] - %s", fetch.__name__, self._devId, self._manageIp, args)
+                    yield fetch(*args)
                     consecutiveTimeouts = 0
-                    log.debug("Finished fetchPerfChunk call %s [%s]", self._devId, self._manageIp)
+                    log.debug("Finished %s call %s [%s]", fetch.__name__, self._devId, self._manageIp)
                 except error.TimeoutError as e:
-                    log.debug("timeout for %s [%s] oids - %s", self._devId, self._manageIp, oid_chunk)
+                    log.debug("timeout for %s [%s] oids - %s", self._devId, self._manageIp, args)
                     consecutiveTimeouts += 1
                     if consecutiveTimeouts >= self._maxTimeouts:
                         log.debug("%s consecutive timeouts, abandoning run for %s [%s]", consecutiveTimeouts,
@@ -271,14 +312,68 @@ class SnmpPerformanceCollectionTask(BaseTask):
                         raise
                 except SnmpTimeoutError as e:
                     # only seem to get these for V3 and subsequent calls throw credential exceptions, so just bail here
-                    log.debug("SnmpTimeoutError for %s [%s] oids - %s", self._devId, self._manageIp, oid_chunk)
+                    log.debug("SnmpTimeoutError for %s [%s] oids - %s", self._devId, self._manageIp, args)
                     raise
             # can still have untested oids from a chunk that failed to return data, one or more of those may be bad.
-            # run with a smaller chunk size to identify bad oid. Can also have uncollected good oids because of timeouts
+            # bisect the chunks to identify bad oids. Can also have uncollected good oids because of timeouts
             oids_to_test = list(self._uncollectedOids())
-            chunk_size = 1
-    
 
+    @defer.inlineCallbacks
+    def _bisectPerfChunk(self, oid_chunk):
+        """
+        Fetch a chunk of oids; if the agent returns nothing for it, split the
+        chunk in half and fetch each half until the bad oids are isolated.
+        A single oid left over from a larger chunk is fetched on its own, so
+        it is marked bad in this cycle rather than retried in the next one.
+        """
+        yield self._fetchPerfChunk(oid_chunk)
+        missing = [oid for oid in oid_chunk
+                   if oid not in self._collectedOids and oid not in self._bad_oids]
+        if len(missing) > 1:
+            half = len(missing) / 2
+            for part in (missing[:half], missing[half:]):
+                self._checkTaskTime()
+                yield self._bisectPerfChunk(part)
+        elif missing and len(oid_chunk) > 1:
+            self._checkTaskTime()
+            yield self._fetchPerfChunk(missing)
+
+    @defer.inlineCallbacks
+    def _fetchPerfTable(self, column, oids):
+        """
+        Walk a table column with GETBULK requests and store the values of
+        the requested oids. Columns that return none of them, or far more
+        rows than requested, are collected with gets from then on.
+        """
+        self.state = SnmpPerformanceCollectionTask.STATE_FETCH_PERF
+        try:
+            result = yield self._snmpProxy.getTable(['.' + column],
+                                                    timeout=self._snmpConnInfo.zSnmpTimeout,
+                                                    retryCount=self._snmpConnInfo.zSnmpTries,
+                                                    maxRepetitions=self._maxOidsPerRequest,
+                                                    limit=sys.maxint)
+        except (error.TimeoutError, SnmpTimeoutError), e:
+            raise
+        except Exception, e:
+            log.debug('Failed to walk {0} on {1} ({2.__class__.__name__}: {2}), using gets'.format(
+                column, self.configId, e))
+            self._scalarColumns.add(column)
+            defer.returnValue(None)
+        finally:
+            self.state = TaskStates.STATE_RUNNING
+
+        rows = {}
+        for values in result.itervalues():
+            for oid, value in values.iteritems():
+                rows[oid.strip('.')] = value
+        if rows:
+            self._responseReceived = True
+        update = dict((oid, rows[oid]) for oid in oids if oid in rows)
+        if not update or len(rows) > 2 * len(oids):
+            log.debug("%s [%s] walking %s returned %s rows for %s oids, using gets",
+                      self._devId, self._manageIp, column, len(rows), len(oids))
+            self._scalarColumns.add(column)
+        self._storeValues(update)
 
     @defer.inlineCallbacks
     def _fetchPerfChunk(self, oid_chunk):
@@ -320,37 +415,43 @@ class SnmpPerformanceCollectionTask(BaseTask):
                     log.error("SNMP get did not return result: {0} {1}".format(self.configId, oid))
                     self.remove_from_good_oids([oid])
                     self._addBadOids([oid])
-            self.state=SnmpPerformanceCollectionTask.STATE_STORE_PERF
+            self._storeValues(update)
+
+    def _storeValues(self, update):
+        """
+        Write the values of collected oids to the data service.
+        """
+        self.state=SnmpPerformanceCollectionTask.STATE_STORE_PERF
+        try:
+            batch = MetricBatch()
+            for oid, value in update.items():
+
+                if oid not in self._oids:
+                    log.error("SNMP get returned unexpected OID: {0} {1}".format(self.configId, oid))
+                    continue
+
+                # We should always get something useful back
+                if value == '' or value is None:
+                    if oid not in self._bad_oids:
+                        log.error("SNMP get returned empty value: {0} {1}".format(self.configId, oid))
+                        self._addBadOids([oid])
+                    continue
+
+                self._good_oids.add(oid)
+                self._bad_oids.discard(oid)
+                self._collectedOids.add(oid)
+                # An OID's data can be stored multiple times
+                for rrdMeta in self._oids[oid]:
+                    # see SnmpPerformanceConfig line _getComponentConfig
+                    contextId, metric, contextUUID, devuuid, rrdType, rrdCommand, rrdMin, rrdMax = rrdMeta
+                    batch.append(contextUUID, metric, value, rrdType, contextId,
+                                 min=rrdMin, max=rrdMax, deviceuuid=devuuid)
             try:
-                for oid, value in update.items():
-
-                    if oid not in self._oids:
-                        log.error("SNMP get returned unexpected OID: {0} {1}".format(self.configId, oid))
-                        continue
-
-                    # We should always get something useful back
-                    if value == '' or value is None:
-                        if oid not in self._bad_oids:
-                            log.error("SNMP get returned empty value: {0} {1}".format(self.configId, oid))
-                            self._addBadOids([oid])
-                        continue
-
-                    self._good_oids.add(oid)
-                    self._bad_oids.discard(oid)
-                    self._collectedOids.add(oid)
-                    # An OID's data can be stored multiple times
-                    for rrdMeta in self._oids[oid]:
-                        try:
-                            # see SnmpPerformanceConfig line _getComponentConfig
-                            contextId, metric, contextUUID, devuuid, rrdType, rrdCommand, rrdMin, rrdMax = rrdMeta
-                            self._dataService.writeMetric(
-                                contextUUID, metric, value, rrdType, contextId,
-                                min=rrdMin, max=rrdMax, deviceuuid=devuuid)
-                        except Exception, e:
-                            log.exception("Failed to write to metric service: {0} {1.__class__.__name__} {1}".format(contextUUID, e))
-                            continue
-            finally:
-                self.state = TaskStates.STATE_RUNNING
+                self._dataService.writeMetrics(batch)
+            except Exception, e:
+                log.exception("Failed to write to metric service: {0} {1.__class__.__name__} {1}".format(self.configId, e))
+        finally:
+            self.state = TaskStates.STATE_RUNNING
 
     @defer.inlineCallbacks
     def _processBadOids(self, previous_bad_oids):
@@ -595,6 +696,8 @@ class SnmpPerformanceCollectionTask(BaseTask):
             self.name, len(self._good_oids), self._good_oids)
         display += "%s Bad OIDs: %d - %s\n" % (
             self.name, len(self._bad_oids), self._bad_oids)
+        display += "%s Table columns collected with gets: %d\n" % (
+            self.name, len(self._scalarColumns))
 
         if self._lastErrorMsg:
             display += "%s\n" % self._lastErrorMsg
@@ -34,10 +34,12 @@ from Products.ZenCollector.tasks import SimpleTaskFactory, SimpleTaskSplitter,\
 from Products.ZenEvents import Event
 from Products.ZenEvents.ZenEventClasses import Status_Snmp, Status_OSProcess,\
     Status_Perf
-from Products.ZenModel.OSProcessMatcher import OSProcessMatcher
+from Products.ZenModel.OSProcessMatcher import OSProcessMatcher, \
+    OSProcessMatcherSet
 from Products.ZenModel.OSProcessState import determineProcessState
 from Products.ZenUtils.observable import ObservableMixin
 from Products.ZenUtils.Utils import prepId as globalPrepId
+from Products.ZenUtils.metricwriter import MetricBatch
 
 # We retrieve our configuration data remotely via a Twisted PerspectiveBroker
 # connection. To do so, we need to import the class that will be used by the
@@ -65,8 +67,10 @@ NAMETABLE = RUNROOT + '.2.1.2'
 PATHTABLE = RUNROOT + '.2.1.4'
 ARGSTABLE = RUNROOT + '.2.1.5'
 PERFROOT = HOSTROOT + '.5'
-CPU = PERFROOT + '.1.1.1.'        # note trailing dot
-MEM = PERFROOT + '.1.1.2.'        # note trailing dot
+CPUTABLE = PERFROOT + '.1.1.1'
+MEMTABLE = PERFROOT + '.1.1.2'
+CPU = CPUTABLE + '.'        # note trailing dot
+MEM = MEMTABLE + '.'        # note trailing dot
 
 # Max size for CPU numbers
 WRAP = 0xffffffffL
@@ -126,6 +130,12 @@ class ZenProcessPreferences(object):
                           default='',
                           help="Directory and filename to use as a template"
                                " to store SNMP results from device.")
+        parser.add_option('--fulltablecycles', dest='fulltablecycles',
+                          type='int', default=10,
+                          help="Walk the whole process tables every this many"
+                               " cycles, to see the path and argument changes"
+                               " of processes that kept their pid and name"
+                               " (default %default)")
 
     def postStartup(self):
         pass
@@ -140,6 +150,28 @@ class DeviceStats:
         self._processes = {}
         for id, process in deviceProxy.processes.iteritems():
             self._processes[id] = ProcessStats(process)
+        # map pid number to the (name, path, args) read from the device
+        self.processTable = {}
+        # cycles since the whole process tables were walked
+        self.cyclesSinceFullTable = 0
+        # map pid number to (command line, ProcessStats or None)
+        self._matches = {}
+        self._matchersKey = self._matchers()
+        self._matcherSet = self._compileMatchers()
+
+    def _matchers(self):
+        """
+        Returns what the process matching depends on, to tell when cached
+        matches have to be thrown away
+        """
+        return sorted((id, p.includeRegex, p.excludeRegex, p.replaceRegex,
+                       p.replacement, p.primaryUrlPath, p.generatedId,
+                       p._config.name)
+                      for id, p in self._processes.iteritems())
+
+    def _compileMatchers(self):
+        return OSProcessMatcherSet(p for p in self._processes.itervalues()
+                                   if p._config.name is not None)
 
     def update(self, deviceProxy):
         unused = set(self._processes)
@@ -157,6 +189,35 @@ class DeviceStats:
                 if value._config.name == id:
                     del self._pidToProcess[key]
 
+        matchersKey = self._matchers()
+        if matchersKey != self._matchersKey:
+            self._matchersKey = matchersKey
+            self._matcherSet = self._compileMatchers()
+            self._matches = {}
+
+    def match(self, pid, name_with_args):
+        """
+        Return the ProcessStats a process belongs to, or None. Matches are
+        remembered by pid, so a process is only tested against the process
+        classes when it is new or its command line changed.
+        """
+        cached = self._matches.get(pid)
+        if cached is not None and cached[0] == name_with_args:
+            return cached[1]
+        match = self._matcherSet.match(name_with_args)[0]
+        if match is not None:
+            log.debug("Found process %s belonging to %s",
+                      name_with_args, match._config)
+        self._matches[pid] = (name_with_args, match)
+        return match
+
+    def forgetPids(self, pids):
+        """
+        Drop the remembered matches of processes that are gone
+        """
+        for pid in set(self._matches).difference(pids):
+            del self._matches[pid]
+
     @property
     def processStats(self):
         """
@@ -386,9 +447,8 @@ class ZenProcessTask(ObservableMixin):
         log.debug("Scanning for processes from %s [%s]", self._devId, self._manageIp)
 
         self.state = ZenProcessTask.STATE_SCANNING_PROCS
-        tables = [NAMETABLE, PATHTABLE, ARGSTABLE]
         try:
-            tableResult = yield self._getTables(tables)
+            tableResult = yield self._getProcessTables()
             summary = 'Process table up for device %s' % self._devId
             self._clearSnmpError("%s - timeout cleared" % summary, 'table_scan_timeout')
             if self.snmpConnInfo.zSnmpVer == 'v3':
@@ -564,8 +624,10 @@ class ZenProcessTask(ObservableMixin):
             else:
                 log.warn('%s monitored proc %s %s not in process stats', self._devId, procStat._config.name, procStat._config.originalName)
                 log.debug("%s pidcounts is %s", self._devId, pidCounts)
+        batch = MetricBatch()
         for procName, count in pidCounts.iteritems():
-            self._save(procName, 'count_count', count, 'GAUGE')
+            self._save(procName, 'count_count', count, 'GAUGE', batch=batch)
+        self._saveBatch(batch)
         return "Sent events"
 
     def _determineProcessStatus(self, procs):
@@ -580,14 +642,13 @@ class ZenProcessTask(ObservableMixin):
         beforePids = set(self._deviceStats.pids)
         afterPidToProcessStats = {}
 
+        match = self._deviceStats.match
         for pid, name_with_args in procs:
-            log.debug("pid: %s --- name_with_args: %s" % (pid, name_with_args))
-            for pStats in self._deviceStats.processStats:
-                if pStats._config.name is not None:
-                    if pStats.matches(name_with_args):
-                        log.debug("Found process %s belonging to %s", name_with_args, pStats._config)
-                        afterPidToProcessStats[pid] = pStats
-                        break
+            log.debug("pid: %s --- name_with_args: %s", pid, name_with_args)
+            pStats = match(pid, name_with_args)
+            if pStats is not None:
+                afterPidToProcessStats[pid] = pStats
+        self._deviceStats.forgetPids(pid for pid, _ in procs)
 
         afterPids = set(afterPidToProcessStats)
         afterByConfig = reverseDict(afterPidToProcessStats)
@@ -624,8 +685,21 @@ class ZenProcessTask(ObservableMixin):
         """
         self.state = ZenProcessTask.STATE_FETCH_PERF
 
+        pids = list(self._deviceStats.pids)
+        if len(pids) * 2 > len(self._deviceStats.processTable):
+            # most processes are monitored, so walking the perf table with
+            # GETBULK reads about as many values as the gets would
+            try:
+                results = yield self._getPerfTables()
+            except (error.TimeoutError, Snmpv3Error) as e:
+                log.debug("%s error walking process perf table - %s",
+                          self._devId, e)
+            else:
+                self._storePerfStats(results)
+                return
+
         oids = []
-        for pid in self._deviceStats.pids:
+        for pid in pids:
             oids.extend([CPU + str(pid), MEM + str(pid)])
         if oids:
             singleOids = set()
@@ -657,6 +731,7 @@ class ZenProcessTask(ObservableMixin):
         """
         self.state = ZenProcessTask.STATE_STORE_PERF
         byConf = reverseDict(self._deviceStats._pidToProcess)
+        batch = MetricBatch()
         for procStat, pids in byConf.iteritems():
             if len(pids) != 1:
                 log.debug("There are %d pids by the name %s - %s",
@@ -668,11 +743,107 @@ class ZenProcessTask(ObservableMixin):
                 procStat.updateCpu(pid, cpu)
                 procStat.updateMemory(pid, mem)
             self._save(procName, 'cpu_cpu', procStat.getCpu(),
-                       'DERIVE', min=0)
+                       'DERIVE', min=0, batch=batch)
             self._save(procName, 'mem_mem',
-                       procStat.getMemory() * 1024, 'GAUGE')
+                       procStat.getMemory() * 1024, 'GAUGE', batch=batch)
+        self._saveBatch(batch)
         return results
 
+    @defer.inlineCallbacks
+    def _getProcessTables(self):
+        """
+        Read the process tables. The name table is walked every cycle; the
+        path and arguments of processes already seen with the same name are
+        taken from the previous cycle, and only fetched for new processes.
+        The whole tables are walked when most processes are new, and every
+        fulltablecycles cycles, since a process can change its arguments, or
+        its pid can be reused by a process with the same name, without it
+        showing in the name table.
+
+        @return: results of SNMP table gets, as returned by _getTables
+        @rtype: Twisted deferred
+        """
+        deviceStats = self._deviceStats
+        known = deviceStats.processTable
+        options = self._preferences.options
+        if not known or options.captureFilePrefix or \
+                deviceStats.cyclesSinceFullTable + 1 >= options.fulltablecycles:
+            results = yield self._getTables([NAMETABLE, PATHTABLE, ARGSTABLE])
+            deviceStats.cyclesSinceFullTable = 0
+        else:
+            deviceStats.cyclesSinceFullTable += 1
+            results = yield self._getTables([NAMETABLE])
+            results = yield self._getNewProcessTables(
+                results.get(NAMETABLE, {}), known)
+        deviceStats.processTable = processTableFromResults(results)
+        defer.returnValue(results)
+
+    @defer.inlineCallbacks
+    def _getNewProcessTables(self, names, known):
+        """
+        Complete a walk of the name table with the paths and arguments of
+        the processes, reading only the ones not in the known process table
+
+        @parameter names: the name table
+        @type names: dictionary
+        @parameter known: the process table of the previous cycle
+        @type known: dictionary
+        @return: results of SNMP table gets, as returned by _getTables
+        @rtype: Twisted deferred
+        """
+        paths, args = {}, {}
+        newPids = []
+        for oid, name in names.iteritems():
+            pid = int(oid.rsplit('.', 1)[-1])
+            previous = known.get(pid)
+            if previous is None or previous[0] != name:
+                newPids.append(pid)
+            else:
+                paths[PATHTABLE + '.%d' % pid] = previous[1]
+                args[ARGSTABLE + '.%d' % pid] = previous[2]
+
+        if len(newPids) * 2 > len(names):
+            results = yield self._getTables([PATHTABLE, ARGSTABLE])
+            results[NAMETABLE] = names
+            defer.returnValue(results)
+
+        oids = []
+        for pid in newPids:
+            oids.extend([PATHTABLE + '.%d' % pid, ARGSTABLE + '.%d' % pid])
+        try:
+            for oidChunk in chunk(oids, self._maxOidsPerRequest):
+                result = yield self._get(oidChunk)
+                for oid, value in result.iteritems():
+                    if value is None:
+                        continue
+                    column, pid = oid.rsplit('.', 2)[-2:]
+                    if column == PATHTABLE.rsplit('.', 1)[-1]:
+                        paths[PATHTABLE + '.' + pid] = value
+                    else:
+                        args[ARGSTABLE + '.' + pid] = value
+        except (error.TimeoutError, Snmpv3Error) as e:
+            log.debug("%s error reading new processes - %s", self._devId, e)
+            results = yield self._getTables([PATHTABLE, ARGSTABLE])
+            results[NAMETABLE] = names
+            defer.returnValue(results)
+        defer.returnValue({NAMETABLE: names, PATHTABLE: paths, ARGSTABLE: args})
+
+    @defer.inlineCallbacks
+    def _getPerfTables(self):
+        """
+        Walk the CPU and memory columns of hrSWRunPerfTable
+
+        @return: CPU and memory values keyed the same way as the results
+            of _get
+        @rtype: Twisted deferred
+        """
+        tables = yield self._getTables([CPUTABLE, MEMTABLE])
+        results = {}
+        for table, prefix in ((CPUTABLE, CPU), (MEMTABLE, MEM)):
+            for oid, value in tables.get(table, {}).iteritems():
+                results[prefix + oid.rsplit('.', 1)[-1]] = value
+        defer.returnValue(results)
+
     def _getTables(self, oids):
         """
         Perform SNMP getTable for specified OIDs
@@ -760,7 +931,7 @@ class ZenProcessTask(ObservableMixin):
                                      eventKey=eventKey,
                                      severity=Event.Clear)
 
-    def _save(self, pidName, statName, value, rrdType, min='U'):
+    def _save(self, pidName, statName, value, rrdType, min='U', batch=None):
         """
         Save a value into an RRD file
 
@@ -772,37 +943,60 @@ class ZenProcessTask(ObservableMixin):
         @type value: number
         @param rrdType: Metric data type (eg ABSOLUTE, DERIVE, COUNTER)
         @type rrdType: string
+        @param batch: if given, add the value to this batch instead of
+            writing it immediately
+        @type batch: MetricBatch
         """
         uuid = pidName._config.contextUUID
         devuuid = pidName._config.deviceuuid
+        if batch is not None:
+            batch.append(uuid, statName, value, rrdType, pidName._config.name, min=min, deviceuuid=devuuid)
+            return
         try:
             self._dataService.writeMetric(uuid, statName, value, rrdType, pidName._config.name, min=min, deviceuuid=devuuid)
         except Exception, ex:
             summary = "Unable to save data for process-monitor metric %s" %\
                       uuid
-            log.critical(summary)
-
             message = "Data was value= %s, type=%s" %\
                       ( value, rrdType )
-            log.critical(message)
-            log.exception(ex)
+            self._sendMetricWriteFailure(summary, message, ex,
+                                         pidName=pidName, statName=statName)
 
-            import traceback
+    def _saveBatch(self, batch):
+        """
+        Write a batch of values collected by _save
 
-            trace_info = traceback.format_exc()
+        @param batch: values to be stored
+        @type batch: MetricBatch
+        """
+        try:
+            self._dataService.writeMetrics(batch)
+        except Exception, ex:
+            summary = "Unable to save data for process-monitor metrics on %s" %\
+                      self._devId
+            message = "Batch of %d values" % len(batch)
+            self._sendMetricWriteFailure(summary, message, ex)
+
+    def _sendMetricWriteFailure(self, summary, message, ex, **kwargs):
+        log.critical(summary)
+        log.critical(message)
+        log.exception(ex)
+
+        import traceback
+
+        trace_info = traceback.format_exc()
 
-            self._eventService.sendEvent(dict(
-                dedupid="%s|%s" % (self._preferences.options.monitor,
-                                   'Metric write failure'),
-                severity=Event.Critical,
-                device=self._preferences.options.monitor,
-                eventClass=Status_Perf,
-                component="METRIC",
-                pidName=pidName,
-                statName=statName,
-                message=message,
-                traceback=trace_info,
-                summary=summary))
+        self._eventService.sendEvent(dict(
+            dedupid="%s|%s" % (self._preferences.options.monitor,
+                               'Metric write failure'),
+            severity=Event.Critical,
+            device=self._preferences.options.monitor,
+            eventClass=Status_Perf,
+            component="METRIC",
+            message=message,
+            traceback=trace_info,
+            summary=summary,
+            **kwargs))
 
 
 def mapResultsToDicts(showrawtables, results):
@@ -851,6 +1045,27 @@ def mapResultsToDicts(showrawtables, results):
 
     return procs
 
+def processTableFromResults(results):
+    """
+    Map each pid in the process tables to its raw (name, path, args)
+
+    @parameter results: results of SNMP table gets
+    @type results: dictionary of dictionaries
+    @rtype: dictionary
+    """
+    table = {}
+    if not results or not results.get(NAMETABLE):
+        return table
+    paths, args = {}, {}
+    for source, target in ((results.get(PATHTABLE, {}), paths),
+                           (results.get(ARGSTABLE, {}), args)):
+        for oid, value in source.iteritems():
+            target[int(oid.rsplit('.', 1)[-1])] = value
+    for oid, name in results[NAMETABLE].iteritems():
+        pid = int(oid.rsplit('.', 1)[-1])
+        table[pid] = (name, paths.get(pid, ''), args.get(pid, ''))
+    return table
+
 def reverseDict(d):
     """
     Return a dictionary with keys and values swapped:
@@ -147,7 +147,9 @@ class PropertyDescriptor(object):
             if instance is None:
                 retval = self
             else:
-                self._migrate(instance)
+                if self.id not in (vars(instance).get('_v_migratedProps')
+                                   or ()):
+                    self._migrate(instance)
                 value = instance._propertyValues[self.id]
                 retval = self._transform(instance, value, 'transformForGet')
             return retval
@@ -173,6 +175,9 @@ class PropertyDescriptor(object):
         If the id is in __dict__ then move the value to the _propertyValues
         dictionary. Check to make sure that the type of this descriptor class
         and the type in the Zope OFS PropertyManager metadata are the same.
+
+        Reads skip this once it has been done for the property, until the
+        object is reloaded or its properties are changed.
         """
         if not hasattr(instance, '_propertyValues'):
             instance._propertyValues = {}
@@ -186,6 +191,10 @@ class PropertyDescriptor(object):
                     dct['type'] = self.type
                     instance._p_changed = True
                 break
+        migrated = vars(instance).get('_v_migratedProps')
+        if migrated is None:
+            migrated = instance._v_migratedProps = set()
+        migrated.add(self.id)
 
     def _set(self, instance, value):
         """
@@ -255,6 +264,24 @@ class ZenPropertyManager(object, PropertyManager):
     manage_propertiesForm=DTMLFile('dtml/properties', globals(),
                                    property_extensible_schema__=1)
 
+    def _propertiesChanged(self):
+        # a property was set or deleted, so check for values to migrate again
+        self._v_migratedProps = set()
+
+    def _propertyIdSet(self):
+        """
+        Return the ids of the properties defined on this object. The set is
+        rebuilt whenever _properties is replaced, which every change to the
+        property ids does.
+        """
+        base = aq_base(self)
+        props = base._properties
+        index = vars(base).get('_v_propertyIdSet')
+        if index is None or index[0] is not props:
+            index = (props, frozenset(p['id'] for p in props))
+            base._v_propertyIdSet = index
+        return index[1]
+
     def _setPropValue(self, id, value):
         """override from PerpertyManager to handle checks and ip creation"""
         self._wrapperCheck(value)
@@ -275,6 +302,7 @@ class ZenPropertyManager(object, PropertyManager):
             setter(value)
         else:
             setattr(self, id, value)
+        self._propertiesChanged()
 
 
     def _setProperty(self, id, value, type='string', label=None,
@@ -475,6 +503,7 @@ class ZenPropertyManager(object, PropertyManager):
                 self._properties=tuple(newProps)
             except ValueError:
                 raise ZenPropertyDoesNotExist()
+            self._propertiesChanged()
         if REQUEST:
             if propname:
                 audit(('UI',getDisplayType(self),'DeleteZProperty'), self, property=propname)
@@ -519,7 +548,8 @@ class ZenPropertyManager(object, PropertyManager):
         the id.  Returns None if no parent had the id.
         """
         for ob in aq_chain(self):
-            if isinstance(ob, ZenPropertyManager) and ob.hasProperty(id):
+            if isinstance(ob, ZenPropertyManager) and \
+                    id in ob._propertyIdSet():
                 parentWithProperty = ob
                 break
         else:
@@ -533,7 +563,7 @@ class ZenPropertyManager(object, PropertyManager):
         if useAcquisition:
             hasProp = self._findParentWithProperty(id) is not None
         else:
-            hasProp = PropertyManager.hasProperty(self, id)
+            hasProp = id in self._propertyIdSet()
         return hasProp
 
     def getProperty(self, id, d=None):
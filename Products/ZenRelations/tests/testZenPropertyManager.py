@@ -93,6 +93,19 @@ class ZenPropertyManagerTest(ZenRelationsBaseTest):
         self.assert_(subnode.zenPropertyPath("zBool") == "/")
 
 
+    def testHasPropertyAfterChanges(self):
+        """hasProperty sees properties as they are added and deleted"""
+        subnode = self.create(self.orgroot, Organizer, "SubOrg")
+        self.failIf(subnode.hasProperty("zString"))
+        self.assert_(subnode.hasProperty("zString", useAcquisition=True))
+        subnode.setZenProperty("zString", "teststring")
+        self.assert_(subnode.hasProperty("zString"))
+        self.assert_(subnode.zenPropertyPath("zString") == "/SubOrg")
+        subnode.deleteZenProperty("zString")
+        self.failIf(subnode.hasProperty("zString"))
+        self.assert_(subnode.zenPropertyPath("zString") == "/")
+
+
     def testUpdatePropertyLines(self):
         """Set the value of a zenProperty with type lines"""
         subnode = self.create(self.orgroot, Organizer, "SubOrg")
@@ -252,6 +265,14 @@ class PropertyDescriptorTest(BaseTestCase):
         self.assertEqual('bar_foo_quux', self.manager.myProp)
         self.manager.myProp2 = 'duck'
         self.assertEqual('duck', self.manager.myProp2)
+
+    def testMigrate(self):
+        "a value stored as a plain attribute is moved on first read"
+        self.manager.__dict__['myProp2'] = 'legacy'
+        self.assertEqual('legacy', self.manager.myProp2)
+        self.failIf('myProp2' in vars(self.manager))
+        self.assertEqual('legacy', self.manager._propertyValues['myProp2'])
+        self.assert_('myProp2' in self.manager._v_migratedProps)
         
 def test_suite():
     from unittest import TestSuite, makeSuite
@@ -95,7 +95,7 @@ class DaemonStats(object):
         if metric_type in {'DERIVE', 'COUNTER'}:
             # compute (and cache) a rate for COUNTER/DERIVE
             value = self._derivative_tracker.derivative(
-                context_id, (int(value), timestamp))
+                '%s/%s' % (context_id, name), (int(value), timestamp))
 
         # check for threshold breaches and send events when needed
         self._threshold_notifier.notify(
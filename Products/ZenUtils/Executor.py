@@ -20,6 +20,7 @@ class TwistedExecutor(object):
         self._max = maxParrallel
         self._running = 0
         self._taskQueue = []
+        self._paused = False
 
     def setMax(self, max):
         self._max = max
@@ -36,6 +37,20 @@ class TwistedExecutor(object):
     def queued(self):
         return len(self._taskQueue)
 
+    @property
+    def paused(self):
+        return self._paused
+
+    def pause(self):
+        """
+        Stop starting queued callables; running ones are left to finish.
+        """
+        self._paused = True
+
+    def resume(self):
+        self._paused = False
+        reactor.callLater(0, self._runTask)
+
     
     def submit(self, callable, *args, **kw):
         """
@@ -50,7 +65,8 @@ class TwistedExecutor(object):
         return deferred
 
     def _runTask(self):
-        if self._taskQueue and (self._max is None or self._running < self._max):
+        if self._taskQueue and not self._paused and \
+                (self._max is None or self._running < self._max):
             self._running += 1
             task = self._taskQueue.pop(0)
             task()
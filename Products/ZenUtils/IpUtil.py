@@ -19,12 +19,15 @@ is representable in URLs.  Zope object names *MUST* be okay in URLs.
 
 import re
 import socket
+import time
 
 from ipaddr import IPAddress, IPNetwork
 
 from Products.ZenUtils.Exceptions import ZentinelException
+from Products.ZenUtils.LRUCache import LRUCache
 from twisted.names.client import lookupPointer
-from twisted.internet import threads
+from twisted.internet import defer, threads
+from twisted.python.failure import Failure
 
 IP_DELIM = '..'
 INTERFACE_DELIM = '...'
@@ -407,6 +410,81 @@ def asyncNameLookup(address, uselibcresolver = True):
         d.addCallback(ip)
         return d
 
+class NameLookupCache(object):
+    """
+    Remembers the results of asyncNameLookup so that a busy sender does not
+    cost a reverse lookup per message. Names are kept for ttl seconds and
+    failed lookups for negativeTtl seconds, at most maxsize addresses are
+    kept, and concurrent lookups of the same address share one query.
+    """
+
+    def __init__(self, ttl=300, negativeTtl=60, maxsize=10000,
+                 uselibcresolver=True):
+        self.ttl = ttl
+        self.negativeTtl = negativeTtl
+        self.uselibcresolver = uselibcresolver
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._cache = LRUCache(maxsize)
+        self._pending = {}
+
+    def lookup(self, address):
+        """
+        Return a deferred that fires with the name of the address, or fails
+        as asyncNameLookup would.
+        """
+        entry = self._cache.get(address)
+        if entry is not None:
+            expires, result = entry
+            if expires > time.time():
+                self.hits += 1
+                if isinstance(result, Failure):
+                    return defer.fail(result)
+                return defer.succeed(result)
+            self._cache.pop(address)
+        d = defer.Deferred()
+        waiting = self._pending.get(address)
+        if waiting is not None:
+            self.coalesced += 1
+            waiting.append(d)
+            return d
+        self.misses += 1
+        self._pending[address] = [d]
+        asyncNameLookup(address, self.uselibcresolver).addBoth(
+            self._gotResult, address)
+        return d
+
+    def _gotResult(self, result, address):
+        if isinstance(result, Failure):
+            result.cleanFailure()
+            ttl = self.negativeTtl
+        else:
+            ttl = self.ttl
+        if ttl > 0:
+            self._cache[address] = (time.time() + ttl, result)
+        for d in self._pending.pop(address, ()):
+            if isinstance(result, Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+
+    def clear(self):
+        self._cache.clear()
+
+    def __len__(self):
+        return len(self._cache)
+
+    @property
+    def hitRate(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return float(self.hits + self.coalesced) / lookups if lookups else 0.0
+
+    def __str__(self):
+        return '%d names, %d hits, %d misses, %d coalesced (%.1f%% hit rate)' % (
+            len(self._cache), self.hits, self.misses, self.coalesced,
+            self.hitRate * 100)
+
 def asyncIpLookup(name):
     """
     Look up an IP based on the name passed in.  We use gethostbyname to make
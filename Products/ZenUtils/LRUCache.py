@@ -0,0 +1,65 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2014, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    A dictionary like cache that holds at most maxsize items. When it is
+    full the least recently used item is dropped to make room for a new
+    one. Lookups made with get are counted as hits or misses.
+    """
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data[key] = value
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        data = self._data
+        data.pop(key, None)
+        data[key] = value
+        while len(data) > self.maxsize:
+            data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        return self._data.pop(key, default)
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def hitRate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def __str__(self):
+        return '%d/%d items, %d hits, %d misses (%.1f%% hit rate), %d evictions' % (
+            len(self._data), self.maxsize, self.hits, self.misses,
+            self.hitRate * 100, self.evictions)
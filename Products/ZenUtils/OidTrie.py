@@ -0,0 +1,202 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2014, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+
+def _split(oid):
+    """
+    Return the arcs of an OID given as a dotted string or a tuple of
+    integers, both as integers and as strings, or None if it is not numeric.
+    """
+    if isinstance(oid, tuple):
+        parts = map(str, oid)
+    else:
+        oid = oid.strip('.')
+        if not oid:
+            return None
+        parts = oid.split('.')
+    try:
+        return map(int, parts), parts
+    except (TypeError, ValueError):
+        return None
+
+
+class OidTrie(object):
+    """
+    Maps numeric OIDs to MIB names and answers longest-prefix lookups by
+    walking one node per arc, rather than probing a dictionary once for each
+    prefix length of the OID.
+
+    Nodes are numbered and kept in two parallel lists: the children of a
+    node, keyed by integer arc, and the name stored at the node (None for
+    nodes that are only part of a longer OID). Removing an OID clears its
+    name but keeps its nodes; they are reused if the OID comes back.
+    """
+
+    def __init__(self, mapping=None):
+        self.clear()
+        if mapping:
+            self.update(mapping)
+
+    def clear(self):
+        self._children = [{}]
+        self._names = [None]
+        self._oids = {}
+        self._byName = {}
+
+    def _find(self, arcs):
+        """
+        Return the node for the arcs, or None if there is none.
+        """
+        children = self._children
+        node = 0
+        for arc in arcs:
+            node = children[node].get(arc)
+            if node is None:
+                return None
+        return node
+
+    def add(self, oid, name):
+        """
+        Map an OID to a name. Returns False if the OID is not numeric.
+        """
+        split = _split(oid)
+        if split is None:
+            return False
+        arcs = split[0]
+        key = '.'.join(map(str, arcs))
+        if key in self._oids:
+            self.remove(key)
+        children, names = self._children, self._names
+        node = 0
+        for arc in arcs:
+            child = children[node].get(arc)
+            if child is None:
+                child = len(names)
+                children[node][arc] = child
+                children.append({})
+                names.append(None)
+            node = child
+        names[node] = name
+        self._oids[key] = name
+        self._byName.setdefault(name.lower(), []).append(key)
+        return True
+
+    def remove(self, oid):
+        """
+        Forget the name of an OID. Returns False if it was not mapped.
+        """
+        split = _split(oid)
+        if split is None:
+            return False
+        arcs = split[0]
+        key = '.'.join(map(str, arcs))
+        name = self._oids.pop(key, None)
+        if name is None:
+            return False
+        self._names[self._find(arcs)] = None
+        oids = self._byName[name.lower()]
+        oids.remove(key)
+        if not oids:
+            del self._byName[name.lower()]
+        return True
+
+    def update(self, mapping):
+        """
+        Add every OID to name pair of a dictionary or sequence of pairs.
+        """
+        if hasattr(mapping, 'iteritems'):
+            mapping = mapping.iteritems()
+        for oid, name in mapping:
+            self.add(oid, name)
+
+    def sync(self, mapping):
+        """
+        Make the trie hold exactly the OID to name dictionary given, only
+        touching the OIDs that were added, renamed or removed. Returns the
+        number of OIDs added or renamed and the number removed.
+        """
+        wanted = {}
+        for oid, name in mapping.iteritems():
+            split = _split(oid)
+            if split is not None:
+                wanted['.'.join(map(str, split[0]))] = name
+        removed = [oid for oid in self._oids if oid not in wanted]
+        for oid in removed:
+            self.remove(oid)
+        added = 0
+        for oid, name in wanted.iteritems():
+            if self._oids.get(oid) != name:
+                self.add(oid, name)
+                added += 1
+        return added, len(removed)
+
+    def items(self):
+        return self._oids.items()
+
+    def __len__(self):
+        return len(self._oids)
+
+    def __contains__(self, oid):
+        split = _split(oid)
+        return split is not None and \
+            '.'.join(map(str, split[0])) in self._oids
+
+    def lookup(self, oid):
+        """
+        Return the name of the longest mapped prefix of an OID and the number
+        of arcs it covers, or (None, 0) if no prefix is mapped.
+        """
+        split = _split(oid)
+        if split is None:
+            return None, 0
+        return self._longest(split[0])
+
+    def _longest(self, arcs):
+        children, names = self._children, self._names
+        name, depth = None, 0
+        node = 0
+        for i, arc in enumerate(arcs):
+            node = children[node].get(arc)
+            if node is None:
+                break
+            if names[node] is not None:
+                name, depth = names[node], i + 1
+        return name, depth
+
+    def oid2name(self, oid, exactMatch=True, strip=False, default=None):
+        """
+        Return the name for an OID. With exactMatch the OID itself must be
+        mapped. Otherwise the longest mapped prefix is used, followed by the
+        rest of the OID unless strip is set. Returns default if nothing
+        matches.
+        """
+        split = _split(oid)
+        if split is None:
+            return default
+        arcs, parts = split
+        if exactMatch:
+            node = self._find(arcs)
+            if node is None or self._names[node] is None:
+                return default
+            return self._names[node]
+        name, depth = self._longest(arcs)
+        if name is None:
+            return default
+        if depth < len(parts) and not strip:
+            return "%s.%s" % (name, '.'.join(parts[depth:]))
+        return name
+
+    def name2oid(self, name, default=None):
+        """
+        Return the OID mapped to a name, ignoring case, or default.
+        """
+        oids = self._byName.get(name.lower())
+        if not oids:
+            return default
+        return oids[0]
@@ -7,11 +7,65 @@
 #
 ##############################################################################
 import logging
+from array import array
 from Products.ZenRRD.Thresholds import Thresholds
 
 log = logging.getLogger("zen.MetricWriter")
 
 
+def _put_many(publisher, metrics):
+    """
+    Hand a list of (metric, value, timestamp, tags) tuples to the publisher,
+    in one call when the publisher supports it.
+    """
+    put_many = getattr(publisher, 'put_many', None)
+    if put_many is not None:
+        put_many(metrics)
+    else:
+        for metric in metrics:
+            publisher.put(*metric)
+
+
+def _register_producer(publisher, producer):
+    """
+    Register producer for backpressure with publishers that support it.
+    """
+    if hasattr(publisher, 'registerProducer'):
+        publisher.registerProducer(producer)
+
+
+class MetricBatch(object):
+    """
+    Columnar batch of datapoints for CollectorDaemon.writeMetrics.  The
+    columns are parallel lists; append takes the same arguments as
+    CollectorDaemon.writeMetric.
+    """
+    __slots__ = ('contextUUIDs', 'metrics', 'values', 'metricTypes',
+                 'contextIds', 'timestamps', 'mins', 'maxes',
+                 'threshEventData', 'deviceUUIDs')
+
+    def __init__(self):
+        for column in self.__slots__:
+            setattr(self, column, [])
+
+    def append(self, contextUUID, metric, value, metricType, contextId,
+               timestamp='N', min='U', max='U', threshEventData=None,
+               deviceuuid=None):
+        self.contextUUIDs.append(contextUUID)
+        self.metrics.append(metric)
+        self.values.append(value)
+        self.metricTypes.append(metricType)
+        self.contextIds.append(contextId)
+        self.timestamps.append(timestamp)
+        self.mins.append(min)
+        self.maxes.append(max)
+        self.threshEventData.append(threshEventData)
+        self.deviceUUIDs.append(deviceuuid)
+
+    def __len__(self):
+        return len(self.values)
+
+
 class MetricWriter(object):
 
     def __init__(self, publisher):
@@ -35,6 +89,30 @@ class MetricWriter(object):
         except Exception as x:
             log.exception(x)
 
+    def registerProducer(self, producer):
+        """
+        Have the publisher pause and resume producer (an object with
+        pauseProducing and resumeProducing methods) as its buffer fills
+        and drains
+
+        @param producer:
+        @return:
+        """
+        _register_producer(self._publisher, producer)
+
+    def write_metrics(self, metrics):
+        """
+        Publish a batch of metrics with a single call to the publisher
+
+        @param metrics: list of (metric, value, timestamp, tags) tuples
+        @return:
+        """
+        try:
+            _put_many(self._publisher, metrics)
+            self._datapoints += len(metrics)
+        except Exception as x:
+            log.exception(x)
+
     @property
     def dataPoints(self):
         """
@@ -67,6 +145,39 @@ class FilteredMetricWriter(object):
         except Exception as x:
             log.exception(x)
 
+    def registerProducer(self, producer):
+        """
+        Have the publisher pause and resume producer as its buffer fills
+        and drains
+
+        @param producer:
+        @return:
+        """
+        _register_producer(self._publisher, producer)
+
+    def write_metrics(self, metrics):
+        """
+        Publish the metrics in a batch that pass the test_filter
+
+        @param metrics: list of (metric, value, timestamp, tags) tuples
+        @return:
+        """
+        try:
+            test_filter = self._test_filter
+            passed = []
+            for m in metrics:
+                try:
+                    if test_filter(*m):
+                        passed.append(m)
+                except Exception as x:
+                    log.exception(x)
+            metrics = passed
+            if metrics:
+                _put_many(self._publisher, metrics)
+                self._datapoints += len(metrics)
+        except Exception as x:
+            log.exception(x)
+
     @property
     def dataPoints(self):
         """
@@ -97,6 +208,37 @@ class AggregateMetricWriter(object):
                 log.exception(x)
 	self._datapoints += 1
 
+    def registerProducer(self, producer):
+        """
+        Register producer with the primary metric writer, the first one.
+        The other writers, such as the internal metrics writer, only see a
+        share of the metrics and must not pause collection.
+
+        @param producer:
+        @return:
+        """
+        if self._writers and hasattr(self._writers[0], 'registerProducer'):
+            self._writers[0].registerProducer(producer)
+
+    def write_metrics(self, metrics):
+        """
+        Writes a batch of metrics to multiple metric writers
+
+        @param metrics: list of (metric, value, timestamp, tags) tuples
+        @return:
+        """
+        for writer in self._writers:
+            try:
+                write_metrics = getattr(writer, 'write_metrics', None)
+                if write_metrics is not None:
+                    write_metrics(metrics)
+                else:
+                    for metric in metrics:
+                        writer.write_metric(*metric)
+            except Exception as x:
+                log.exception(x)
+        self._datapoints += len(metrics)
+
     @property
     def dataPoints(self):
         """
@@ -105,10 +247,36 @@ class AggregateMetricWriter(object):
         """
         return self._datapoints
 
+# How often, in seconds of metric time, DerivativeTracker looks for metrics
+# that are no longer collected
+EXPIRE_INTERVAL = 5 * 60
+# Collection interval assumed for a metric that has been seen only once
+UNKNOWN_INTERVAL = 24 * 60 * 60
+
 class DerivativeTracker(object):
+    """
+    Tracks the last value seen for each COUNTER/DERIVE metric and computes
+    rates from it.  Each metric key is mapped to a slot in a set of parallel
+    arrays rather than to its own tuple.  Metrics that have not been updated
+    for max_idle_cycles of their own collection intervals are dropped, so a
+    metric collected hourly is kept as long as one collected every minute is
+    kept relative to its interval.  Trackers can be pickled so that rates are
+    available in the first cycle after a restart.
+    """
 
-    def __init__(self):
-        self._timed_metric_cache = {}
+    def __init__(self, max_idle_cycles=None):
+        self.max_idle_cycles = max_idle_cycles
+        self._reset()
+
+    def _reset(self):
+        self._slots = {}
+        # values are kept as python numbers; a 64 bit counter does not fit
+        # in a double (or, above 2**63, a signed long) without losing counts
+        self._values = []
+        self._timestamps = array('d')
+        # time between the last two samples, 0 until there are two
+        self._intervals = array('d')
+        self._lastExpire = None
 
     def derivative(self, name, timed_metric, min='U', max='U'):
         """
@@ -120,24 +288,88 @@ class DerivativeTracker(object):
         @param max: restricts maximum value returned
         @return: change from previous value if a previous value exists
         """
-        last_timed_metric = self._timed_metric_cache.get(name)
-        if last_timed_metric:
-            # identical timestamps?
-            if timed_metric[1] == last_timed_metric[1]:
-                return 0
-            else:
-                delta = float(timed_metric[0] - last_timed_metric[0]) / \
-                    float(timed_metric[1] - last_timed_metric[1])
-                if isinstance(min, (int, float)) and delta < min:
-                    delta = min
-                if isinstance(max, (int, float)) and delta > max:
-                    delta = max
-                return delta
-        else:
+        value, timestamp = timed_metric
+        self._expireEvery(timestamp)
+        slot = self._slots.get(name)
+        if slot is None:
             # first value we've seen for path
-            self._timed_metric_cache[name] = timed_metric
+            self._slots[name] = len(self._values)
+            self._values.append(value)
+            self._timestamps.append(timestamp)
+            self._intervals.append(0.0)
             return None
 
+        last_value = self._values[slot]
+        last_timestamp = self._timestamps[slot]
+        self._values[slot] = value
+        self._timestamps[slot] = timestamp
+
+        # identical timestamps?
+        if timestamp == last_timestamp:
+            return 0
+        if timestamp > last_timestamp:
+            self._intervals[slot] = timestamp - last_timestamp
+        delta = float(value - last_value) / float(timestamp - last_timestamp)
+        if isinstance(min, (int, float)) and delta < min:
+            delta = min
+        if isinstance(max, (int, float)) and delta > max:
+            delta = max
+        return delta
+
+    def _expireEvery(self, now):
+        if self._lastExpire is None or now < self._lastExpire:
+            self._lastExpire = now
+        elif now - self._lastExpire >= EXPIRE_INTERVAL:
+            self.expire(now)
+
+    def expire(self, now):
+        """
+        Drop metrics that have not been updated within max_idle_cycles of
+        their collection interval. A metric seen only once is assumed to be
+        collected every UNKNOWN_INTERVAL seconds.  Called by derivative every
+        EXPIRE_INTERVAL seconds of metric time.
+
+        @param now: the current time
+        @return: the number of metrics dropped
+        """
+        self._lastExpire = now
+        if not self.max_idle_cycles:
+            return 0
+        timestamps, intervals = self._timestamps, self._intervals
+        idle = self.max_idle_cycles
+        keep = [(slot, name) for name, slot in self._slots.iteritems()
+                if now - timestamps[slot] <=
+                    idle * (intervals[slot] or UNKNOWN_INTERVAL)]
+        dropped = len(self._slots) - len(keep)
+        if dropped:
+            keep.sort()
+            values = self._values
+            self._slots = dict((name, i) for i, (slot, name) in enumerate(keep))
+            self._values = [values[slot] for slot, name in keep]
+            self._timestamps = array('d', (timestamps[slot] for slot, name in keep))
+            self._intervals = array('d', (intervals[slot] for slot, name in keep))
+            log.debug("Expired %d idle derivative metrics", dropped)
+        return dropped
+
+    def __getstate__(self):
+        names = sorted(self._slots, key=self._slots.get)
+        return {'max_idle_cycles': self.max_idle_cycles,
+                'names': names,
+                'values': self._values,
+                'timestamps': self._timestamps.tostring(),
+                'intervals': self._intervals.tostring()}
+
+    def __setstate__(self, state):
+        self.max_idle_cycles = state['max_idle_cycles']
+        self._reset()
+        self._slots = dict((name, i) for i, name in enumerate(state['names']))
+        self._values = list(state['values'])
+        self._timestamps.fromstring(state['timestamps'])
+        if 'intervals' in state:
+            self._intervals.fromstring(state['intervals'])
+        else:
+            self._intervals.fromlist([0.0] * len(self._values))
+
 
 class ThresholdNotifier(object):
     """
@@ -173,19 +405,48 @@ class ThresholdNotifier(object):
         @return:
         """
         if self._thresholds and value is not None:
-            if 'eventKey' in thresh_event_data:
-                eventKeyPrefix = [thresh_event_data['eventKey']]
-            else:
-                eventKeyPrefix = [context_id]
-            for ev in self._thresholds.check(context_uuid, metric, timestamp, value):
-                parts = eventKeyPrefix[:]
-                if 'eventKey' in ev:
-                    parts.append(ev['eventKey'])
-                ev['eventKey'] = '|'.join(parts)
-                # add any additional values for this threshold
-                # (only update if key is not in event, or if
-                # the event's value is blank or None)
-                for key, value in thresh_event_data.items():
-                    if ev.get(key, None) in ('', None):
-                        ev[key] = value
-                self._send_callback(ev)
+            self._sendEvents(
+                self._thresholds.check(context_uuid, metric, timestamp, value),
+                context_id, thresh_event_data)
+
+    def _sendEvents(self, events, context_id, thresh_event_data):
+        if 'eventKey' in thresh_event_data:
+            eventKeyPrefix = [thresh_event_data['eventKey']]
+        else:
+            eventKeyPrefix = [context_id]
+        for ev in events:
+            parts = eventKeyPrefix[:]
+            if 'eventKey' in ev:
+                parts.append(ev['eventKey'])
+            ev['eventKey'] = '|'.join(parts)
+            # add any additional values for this threshold
+            # (only update if key is not in event, or if
+            # the event's value is blank or None)
+            for key, value in thresh_event_data.items():
+                if ev.get(key, None) in ('', None):
+                    ev[key] = value
+            self._send_callback(ev)
+
+    def notify_many(self, datapoints):
+        """
+        Check a batch of values against thresholds.  Datapoints without a
+        threshold are skipped with a single dict lookup, so callers need not
+        filter the batch first.
+
+        @param datapoints: iterable of (context_uuid, context_id, metric,
+            timestamp, value, thresh_event_data) tuples
+        @return:
+        """
+        if not self._thresholds:
+            return
+        if not isinstance(datapoints, list):
+            datapoints = list(datapoints)
+        checked = self._thresholds.checkMany(
+            (context_uuid, metric, timestamp, value)
+            for context_uuid, _, metric, timestamp, value, _ in datapoints)
+        for i, events in checked:
+            context_id, thresh_event_data = datapoints[i][1], datapoints[i][5]
+            try:
+                self._sendEvents(events, context_id, thresh_event_data or {})
+            except Exception as x:
+                log.exception(x)
@@ -8,9 +8,12 @@
 ##############################################################################
 
 
+import socket
 import unittest
+from twisted.internet import defer
 from Products.ZenTestCase.BaseTestCase import BaseTestCase
-from Products.ZenUtils.IpUtil import ensureIp
+from Products.ZenUtils import IpUtil
+from Products.ZenUtils.IpUtil import ensureIp, NameLookupCache
 
 
 class IpUtilsTest(BaseTestCase):
@@ -27,10 +30,62 @@ class IpUtilsTest(BaseTestCase):
         # invalid number
         ip = '1212121212121'
         self.assertEqual(ensureIp(ip), '0.0.0.0')
-                         
+
+
+class NameLookupCacheTest(BaseTestCase):
+    """ Tests the reverse lookup cache"""
+
+    def setUp(self):
+        self.queries = {}
+        self._asyncNameLookup = IpUtil.asyncNameLookup
+        IpUtil.asyncNameLookup = self.asyncNameLookup
+
+    def tearDown(self):
+        IpUtil.asyncNameLookup = self._asyncNameLookup
+
+    def asyncNameLookup(self, address, uselibcresolver=True):
+        d = self.queries[address] = defer.Deferred()
+        return d
+
+    def results(self, d):
+        results = []
+        d.addBoth(results.append)
+        return results
+
+    def testCoalesceAndCache(self):
+        cache = NameLookupCache()
+        first = self.results(cache.lookup('10.0.0.1'))
+        second = self.results(cache.lookup('10.0.0.1'))
+        self.assertEqual(1, len(self.queries))
+        self.queries.pop('10.0.0.1').callback('host1')
+        self.assertEqual(['host1'], first)
+        self.assertEqual(['host1'], second)
+        self.assertEqual(['host1'], self.results(cache.lookup('10.0.0.1')))
+        self.assertEqual(0, len(self.queries))
+        self.assertEqual((1, 1, 1),
+                         (cache.hits, cache.misses, cache.coalesced))
+
+    def testNegativeCache(self):
+        cache = NameLookupCache(negativeTtl=60)
+        first = self.results(cache.lookup('10.0.0.2'))
+        self.queries.pop('10.0.0.2').errback(socket.herror('not found'))
+        self.assertTrue(first[0].check(socket.herror))
+        second = self.results(cache.lookup('10.0.0.2'))
+        self.assertTrue(second[0].check(socket.herror))
+        self.assertEqual(0, len(self.queries))
+
+    def testExpiry(self):
+        cache = NameLookupCache(ttl=0)
+        cache.lookup('10.0.0.3')
+        self.queries.pop('10.0.0.3').callback('host3')
+        cache.lookup('10.0.0.3')
+        self.assertTrue('10.0.0.3' in self.queries)
+        self.assertEqual(2, cache.misses)
+
 def test_suite():
     return unittest.TestSuite((
         unittest.makeSuite(IpUtilsTest),
+        unittest.makeSuite(NameLookupCacheTest),
         ))
 
 if __name__ == '__main__':
@@ -0,0 +1,46 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2014, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+
+import unittest
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+from Products.ZenUtils.LRUCache import LRUCache
+
+
+class LRUCacheTest(BaseTestCase):
+    """Test the LRUCache"""
+
+    def testEviction(self):
+        cache = LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(1, cache.get('a'))
+        # 'b' is now the least recently used
+        cache['c'] = 3
+        self.assertFalse('b' in cache)
+        self.assertEqual(2, len(cache))
+        self.assertEqual(1, cache.evictions)
+
+    def testCounts(self):
+        cache = LRUCache()
+        cache['a'] = 1
+        cache.get('a')
+        cache.get('b')
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+        self.assertEqual(0.5, cache.hitRate)
+        self.assertEqual(1, cache.pop('a'))
+        self.assertEqual(None, cache.get('a'))
+
+
+def test_suite():
+    return unittest.TestSuite((unittest.makeSuite(LRUCacheTest),))
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
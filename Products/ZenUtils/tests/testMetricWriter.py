@@ -0,0 +1,208 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2014, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+import cPickle as pickle
+import unittest
+
+from Products.ZenUtils.metricwriter import MetricWriter, \
+    FilteredMetricWriter, AggregateMetricWriter, MetricBatch, \
+    DerivativeTracker, ThresholdNotifier
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+
+class FakePublisher(object):
+    def __init__(self):
+        self.calls = []
+
+    def put(self, metric, value, timestamp, tags):
+        self.calls.append([(metric, value, timestamp, tags)])
+
+
+class FakeBatchPublisher(FakePublisher):
+    def put_many(self, metrics):
+        self.calls.append(list(metrics))
+
+
+class FakeProducerPublisher(FakePublisher):
+    def __init__(self):
+        super(FakeProducerPublisher, self).__init__()
+        self.producers = []
+
+    def registerProducer(self, producer):
+        self.producers.append(producer)
+
+
+class FakeContext(object):
+    deviceName = 'device1'
+
+    def __init__(self, contextKey):
+        self.contextKey = contextKey
+
+
+class FakeThreshold(object):
+    def __init__(self, contextKey):
+        self.contextKey = contextKey
+
+    def key(self):
+        return 'limit', self.contextKey
+
+    def context(self):
+        return FakeContext(self.contextKey)
+
+    def dataPoints(self):
+        return ['cpu']
+
+    def checkValue(self, dp, timeAt, value):
+        if float(value) > 10:
+            return [dict(eventKey='limit', severity=4)]
+        return []
+
+
+class MetricWriterTest(BaseTestCase):
+    """Test the batch API of the metric writers"""
+
+    def setUp(self):
+        self.metrics = [('a', 1, 100, {'uuid': 'x'}),
+                        ('b', 2, 100, {'uuid': 'y'}),
+                        ('c', 3, 100, {'uuid': 'z'})]
+
+    def testWriteMetricsBatched(self):
+        publisher = FakeBatchPublisher()
+        writer = MetricWriter(publisher)
+        writer.write_metrics(self.metrics)
+        self.assertEqual([self.metrics], publisher.calls)
+        self.assertEqual(3, writer.dataPoints)
+
+    def testWriteMetricsFallback(self):
+        publisher = FakePublisher()
+        writer = MetricWriter(publisher)
+        writer.write_metrics(self.metrics)
+        self.assertEqual([[m] for m in self.metrics], publisher.calls)
+
+    def testFilteredWriteMetrics(self):
+        publisher = FakeBatchPublisher()
+        writer = FilteredMetricWriter(publisher,
+                                      lambda metric, *args: metric != 'b')
+        writer.write_metrics(self.metrics)
+        self.assertEqual([[self.metrics[0], self.metrics[2]]],
+                         publisher.calls)
+        self.assertEqual(2, writer.dataPoints)
+
+    def testAggregateWriteMetrics(self):
+        first, second = FakeBatchPublisher(), FakePublisher()
+        writer = AggregateMetricWriter([MetricWriter(first),
+                                        MetricWriter(second)])
+        writer.write_metrics(self.metrics)
+        self.assertEqual([self.metrics], first.calls)
+        self.assertEqual(3, len(second.calls))
+        self.assertEqual(3, writer.dataPoints)
+
+    def testAggregateRegisterProducer(self):
+        primary, internal = FakeProducerPublisher(), FakeProducerPublisher()
+        writer = AggregateMetricWriter([
+            MetricWriter(primary),
+            FilteredMetricWriter(internal, lambda *args: True)])
+        producer = object()
+        writer.registerProducer(producer)
+        self.assertEqual([producer], primary.producers)
+        self.assertEqual([], internal.producers)
+
+    def testFilteredWriteMetricsIsolatesFailures(self):
+        def test_filter(metric, value, *args):
+            return 10 / value
+        publisher = FakeBatchPublisher()
+        writer = FilteredMetricWriter(publisher, test_filter)
+        writer.write_metrics([('a', 0, 100, {})] + self.metrics)
+        self.assertEqual([self.metrics], publisher.calls)
+
+    def testNotifyManyIsolatesFailures(self):
+        events = []
+        notifier = ThresholdNotifier(events.append,
+                                     [FakeThreshold('x'), FakeThreshold('y'),
+                                      FakeThreshold('z')])
+        # the bad value of y is logged, x and z are still checked
+        notifier.notify_many([('x', 'ctx', 'cpu', 100, 11, None),
+                              ('y', 'ctx', 'cpu', 100, 'bad', None),
+                              ('z', 'ctx', 'cpu', 100, 12, None)])
+        self.assertEqual(2, len(events))
+
+    def testMetricBatch(self):
+        batch = MetricBatch()
+        self.assertFalse(batch)
+        batch.append('uuid', 'ds_dp', 1, 'GAUGE', 'ctx', min=0)
+        self.assertEqual(1, len(batch))
+        self.assertEqual(['N'], batch.timestamps)
+        self.assertEqual([0], batch.mins)
+        self.assertEqual([None], batch.deviceUUIDs)
+
+
+class DerivativeTrackerTest(BaseTestCase):
+    """Test the DerivativeTracker"""
+
+    def setUp(self):
+        self.tracker = DerivativeTracker(max_idle_cycles=2)
+
+    def testDerivative(self):
+        self.assertEqual(None, self.tracker.derivative('a', (100, 10)))
+        self.assertEqual(5.0, self.tracker.derivative('a', (150, 20)))
+        # rates are computed from the previous sample, not the first one
+        self.assertEqual(1.0, self.tracker.derivative('a', (160, 30)))
+        self.assertEqual(0, self.tracker.derivative('a', (170, 30)))
+        self.assertEqual(0, self.tracker.derivative('a', (100, 40), min=0))
+        self.assertEqual(None, self.tracker.derivative('b', (1, 40)))
+
+    def testExpire(self):
+        self.tracker.derivative('a', (1, 0))
+        self.tracker.derivative('a', (2, 60))
+        self.tracker.derivative('b', (1, 0))
+        self.tracker.derivative('b', (2, 200))
+        self.tracker.derivative('c', (1, 200))
+        self.assertEqual(0, self.tracker.expire(180))
+        # idle for more than two of their own intervals
+        self.assertEqual(1, self.tracker.expire(200 + 121))
+        self.assertEqual(1, self.tracker.expire(200 + 401))
+        # metrics seen once are kept for max_idle_cycles days
+        self.assertEqual(0, self.tracker.expire(200 + 2 * 86400))
+        self.assertEqual(1, self.tracker.expire(201 + 2 * 86400))
+        self.assertEqual(None, self.tracker.derivative('b', (5, 2 * 86400)))
+
+    def testExpireLongIntervals(self):
+        # an hourly metric is not dropped between its samples
+        self.tracker.derivative('a', (1, 0))
+        self.tracker.derivative('a', (2, 3600))
+        self.assertEqual(0, self.tracker.expire(3600 * 3))
+        self.assertEqual(1.0 / 3600, self.tracker.derivative('a', (3, 7200)))
+
+    def testExpireWithoutCalls(self):
+        # derivative expires idle metrics itself, without heartbeats
+        self.tracker.derivative('a', (1, 0))
+        self.tracker.derivative('a', (2, 60))
+        self.tracker.derivative('b', (1, 60))
+        self.tracker.derivative('b', (1, 1000))
+        self.assertFalse('a' in self.tracker._slots)
+
+    def testPickle(self):
+        self.tracker.derivative('a', (2 ** 64 - 20, 0))
+        self.tracker.derivative('a', (2 ** 64 - 10, 10))
+        self.tracker.derivative('b', (0, 10))
+        tracker = pickle.loads(pickle.dumps(self.tracker, 2))
+        self.assertEqual(2, tracker.max_idle_cycles)
+        self.assertEqual(10.0, tracker._intervals[0])
+        self.assertEqual(1.0, tracker.derivative('a', (2 ** 64, 20)))
+        self.assertEqual(2.0, tracker.derivative('b', (20, 20)))
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(MetricWriterTest),
+        unittest.makeSuite(DerivativeTrackerTest),
+        ))
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -0,0 +1,66 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2014, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+
+import unittest
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+from Products.ZenUtils.OidTrie import OidTrie
+
+
+class OidTrieTest(BaseTestCase):
+    """Test the OidTrie"""
+
+    def setUp(self):
+        self.trie = OidTrie({'1.3.6.1.2.1.1': 'system',
+                             '.1.3.6.1.2.1.1.3': 'sysUpTime',
+                             '1.3.6.1.6.3.1.1.5.1': 'coldStart',
+                             'not.an.oid': 'bogus'})
+
+    def testExactMatch(self):
+        self.assertEqual(3, len(self.trie))
+        self.assertEqual('sysUpTime', self.trie.oid2name('.1.3.6.1.2.1.1.3'))
+        self.assertEqual('coldStart',
+                         self.trie.oid2name((1, 3, 6, 1, 6, 3, 1, 1, 5, 1)))
+        self.assertEqual(None, self.trie.oid2name('1.3.6.1.2.1.1.3.0'))
+        self.assertEqual('', self.trie.oid2name('1.3.6.1.2', default=''))
+        self.assertEqual(None, self.trie.oid2name('not.an.oid'))
+
+    def testPrefixMatch(self):
+        oid2name = self.trie.oid2name
+        self.assertEqual('sysUpTime.0',
+                         oid2name('1.3.6.1.2.1.1.3.0', exactMatch=False))
+        self.assertEqual('sysUpTime', oid2name('1.3.6.1.2.1.1.3.0',
+                                               exactMatch=False, strip=True))
+        self.assertEqual('system.5.0',
+                         oid2name((1, 3, 6, 1, 2, 1, 1, 5, 0), exactMatch=False))
+        self.assertEqual(None, oid2name('1.3.6.1.4', exactMatch=False))
+        self.assertEqual(('system', 7), self.trie.lookup('1.3.6.1.2.1.1.9'))
+
+    def testName2Oid(self):
+        self.assertEqual('1.3.6.1.2.1.1.3', self.trie.name2oid('SYSUPTIME'))
+        self.assertEqual(None, self.trie.name2oid('missing'))
+
+    def testSync(self):
+        added, removed = self.trie.sync({'1.3.6.1.2.1.1': 'system',
+                                         '1.3.6.1.2.1.1.3': 'upTime',
+                                         '1.3.6.1.2.1.2': 'interfaces'})
+        self.assertEqual((2, 1), (added, removed))
+        self.assertEqual('upTime', self.trie.oid2name('1.3.6.1.2.1.1.3'))
+        self.assertEqual(None, self.trie.name2oid('sysUpTime'))
+        self.assertEqual(None, self.trie.oid2name('1.3.6.1.6.3.1.1.5.1.0',
+                                                  exactMatch=False))
+        self.assertFalse('1.3.6.1.6.3.1.1.5.1' in self.trie)
+        self.assertEqual((0, 0), self.trie.sync(dict(self.trie.items())))
+
+
+def test_suite():
+    return unittest.TestSuite((unittest.makeSuite(OidTrieTest),))
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -127,6 +127,8 @@ class EventClassesFacade(TreeFacade):
         for i, uid in enumerate(uids):
             obj = self._getObject(uid)
             obj.sequence = i
+        if uids:
+            obj._mappingsChanged()
 
     def setTransform(self, uid, transform):
         """
@@ -67,15 +67,33 @@ class EventClassInfo(InfoBase):
     implements(IEventClassInfo)
     adapts(IEventClasses)
 
-    eventClassKey   = ProxyProperty('eventClassKey')
     evaluation      = ProxyProperty('explanation')
     example         = ProxyProperty('example')
     rule            = ProxyProperty('rule')
     regex           = ProxyProperty('regex')
-    sequence        = ProxyProperty('sequence')
     resolution      = ProxyProperty('resolution')
     transform       = ProxyProperty('transform')
 
+    # the mapping index of the event class tree is keyed and sorted by
+    # these, so it has to be rebuilt when they change
+    def getEventClassKey(self):
+        return self._object.eventClassKey
+
+    def setEventClassKey(self, eventClassKey):
+        self._object.eventClassKey = eventClassKey
+        self._object._mappingsChanged()
+
+    eventClassKey = property(getEventClassKey, setEventClassKey)
+
+    def getSequence(self):
+        return self._object.sequence
+
+    def setSequence(self, sequence):
+        self._object.sequence = sequence
+        self._object._mappingsChanged()
+
+    sequence = property(getSequence, setSequence)
+
     @property
     def getEventStatus(self):
         return self._object.getStatus()